@@ -0,0 +1,203 @@
+'''
+向量化自定义指标：
+
+第16天 的 WeightMovingAverage 只写了 next()：每根K线 list(self.data.get(size=period))，
+再用 Python 循环逐个相乘求和；没有 once()，Backtrader 默认的 runonce 批量模式也只能一根一根地调用 next()。
+内置指标（SMA、StdDev……）都实现了 once()，所以历史越长，自定义指标和内置指标的速度差得越多。
+
+KernelIndicator 让自定义指标只写一个 NumPy 核函数 kernel(self, *arrays)：
+    - 输入：每个输入 line 的完整历史（float64 数组）
+    - 输出：和输入一样长的数组（多条 lines 时返回元组），窗口不够的位置填 NaN
+基类自动生成：
+    - once / preonce：整段历史只调用一次 kernel，把结果整块写进 lines（runonce 模式）
+    - next：只把最后 window 根K线交给 kernel，取最后一个值（runonce=False、实盘逐根推送时；
+      每根K线都有 NumPy 调用开销，短窗口时不比纯 Python 快，主要保证两种模式结果一致）
+    - 最小周期：自动 addminperiod(window)
+要求 kernel 在第 t 根的结果只依赖 t 及之前 window 根的数据（滑动窗口类指标都满足）。
+
+用法：
+    class WMA(KernelIndicator):
+        lines = ('wma',)
+        params = (('period', 10),)
+
+        def kernel(self, close):
+            return wma(close, self.p.period)
+'''
+
+import time
+import array
+
+import numpy as np
+import backtrader as bt
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+# ================= NumPy 核函数 =================
+def _pad(values, n):
+    """前面补 n-1 个 NaN，让滑动窗口的结果和输入对齐"""
+    return np.concatenate([np.full(n - 1, np.nan), values])
+
+
+def wma(x, period):
+    """线性加权移动平均，权重 1..period，越新的K线权重越大（和 第16天 的算法相同）"""
+    x = np.asarray(x, dtype='d')
+    if len(x) < period:
+        return np.full(len(x), np.nan)
+    weights = np.arange(1, period + 1, dtype='d')
+    weights /= weights.sum()
+    return _pad(np.convolve(x, weights[::-1], mode='valid'), period)
+
+
+def rolling_mean(x, period):
+    """简单移动平均"""
+    x = np.asarray(x, dtype='d')
+    if len(x) < period:
+        return np.full(len(x), np.nan)
+    return _pad(sliding_window_view(x, period).mean(axis=1), period)
+
+
+def rolling_std(x, period):
+    """滚动标准差（总体标准差 ddof=0，和 bt.indicators.StdDev 一样）"""
+    x = np.asarray(x, dtype='d')
+    if len(x) < period:
+        return np.full(len(x), np.nan)
+    return _pad(sliding_window_view(x, period).std(axis=1), period)
+
+
+# ================= 指标基类 =================
+class KernelIndicator(bt.Indicator):
+    """
+    只需要实现 kernel(self, *arrays)，见模块说明
+    - inputs: 从 self.data 上取哪些 line，例如 ('volume',)；None 表示每个输入数据的第 0 条 line
+              （数据源是 close，指标是第一条输出线）
+    - window(): kernel 需要的K线数量，默认是 period 参数
+    抽象基类：子类没有实现 kernel 时，创建指标就报 TypeError（Backtrader 的元类和 abc.ABCMeta 不能混用）
+    """
+    inputs = None
+
+    def __init__(self):
+        if type(self).kernel is KernelIndicator.kernel:
+            raise TypeError(f"{type(self).__name__} 必须实现 kernel(self, *arrays)")
+        self.addminperiod(self.window())
+        self._cache = (None, None)
+
+    def window(self):
+        return self.p.period
+
+    def kernel(self, *arrays):
+        """子类实现：输入每条 line 的完整历史数组，返回同样长度的数组（多条 lines 时返回元组）"""
+        raise NotImplementedError
+
+    def _sources(self):
+        if self.inputs is None:
+            return list(self.datas)
+        return [getattr(self.data.lines, name) for name in self.inputs]
+
+    def _outputs(self, result):
+        return result if isinstance(result, tuple) else (result,)
+
+    # ---------- runonce 批量模式 ----------
+    def _compute(self):
+        """整段历史只算一次，preonce / oncestart / once 共用同一份结果"""
+        sources = self._sources()
+        key = tuple(len(src.array) for src in sources)
+        if self._cache[0] != key:
+            # np.array 会复制一份，不持有 array.array 的内存，之后 line 还能继续增长
+            arrays = [np.array(src.array, dtype='d') for src in sources]
+            # kernel 可以返回任意数值类型（例如 int 的标记），写进 line 之前统一转成 float64
+            outputs = self._outputs(self.kernel(*arrays))
+            self._cache = (key, tuple(np.asarray(values, dtype='d') for values in outputs))
+        return self._cache[1]
+
+    def _write(self, start, end):
+        if start >= end:
+            return
+        for line, values in zip(self.lines, self._compute()):
+            line.array[start:end] = array.array('d', np.ascontiguousarray(values[start:end]).tobytes())
+
+    def preonce(self, start, end):
+        self._write(start, end)
+
+    def once(self, start, end):
+        self._write(start, end)
+
+    # ---------- 逐根K线模式 ----------
+    def next(self):
+        """只取最后 window 根K线计算，结果取最后一个值"""
+        size = self.window()
+        arrays = [np.array(src.get(size=size), dtype='d') for src in self._sources()]
+        for line, values in zip(self.lines, self._outputs(self.kernel(*arrays))):
+            line[0] = values[-1]
+
+
+# ================= 常用指标 =================
+class WMA(KernelIndicator):
+    """加权移动平均（第16天 WeightMovingAverage 的向量化版本）"""
+    lines = ('wma',)
+    params = (('period', 10),)
+
+    def kernel(self, close):
+        return wma(close, self.p.period)
+
+
+class RollingStd(KernelIndicator):
+    """滚动标准差"""
+    lines = ('std',)
+    params = (('period', 20),)
+
+    def kernel(self, close):
+        return rolling_std(close, self.p.period)
+
+
+class VolumeSMA(KernelIndicator):
+    """成交量均线：直接传数据源即可，自动取 volume 线"""
+    lines = ('vsma',)
+    params = (('period', 20),)
+    inputs = ('volume',)
+
+    def kernel(self, volume):
+        return rolling_mean(volume, self.p.period)
+
+
+if __name__ == '__main__':
+    import pandas as pd
+
+    from 第16天 import WeightMovingAverage
+    from 数组数据源 import NumpyData
+
+    # 用 20 年的随机行情、10 个不同周期，对比 第16天 的逐根 WMA、这里的向量化 WMA、内置的 WMA
+    n = 252 * 20
+    rng = np.random.default_rng(0)
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.02, n)))
+    df = pd.DataFrame({'open': close, 'high': close, 'low': close, 'close': close,
+                       'volume': rng.integers(1e5, 1e6, n).astype(float)},
+                      index=pd.bdate_range('2005-01-03', periods=n))
+
+    class Record(bt.Strategy):
+        params = (('ind', None), ('periods', (10,)))
+
+        def __init__(self):
+            self.inds = [self.p.ind(self.data, period=p) for p in self.p.periods]
+            self.ind = self.inds[0]
+
+    for runonce in (True, False):
+        results = {}
+        for name, ind in [('第16天', WeightMovingAverage), ('KernelIndicator', WMA),
+                          ('内置', bt.indicators.WeightedMovingAverage)]:
+            cerebro = bt.Cerebro(stdstats=False, runonce=runonce)
+            cerebro.adddata(NumpyData.from_dataframe(df))
+            cerebro.addstrategy(Record, ind=ind, periods=range(5, 55, 5))
+            start = time.time()
+            strat = cerebro.run()[0]
+            results[name] = np.array(strat.ind.lines[0].array)
+            print(f"runonce={runonce} {name}: {n} 根K线, 用时 {time.time() - start:.3f}秒")
+        diff = np.nanmax(np.abs(results['KernelIndicator'] - results['第16天']) / results['第16天'])
+        print(f"  KernelIndicator 和 第16天 的最大相对误差: {diff:.2e}")
+
+    # 其它核函数和内置指标对照
+    cerebro = bt.Cerebro(stdstats=False)
+    cerebro.adddata(NumpyData.from_dataframe(df))
+    cerebro.addstrategy(Record, ind=VolumeSMA)
+    strat = cerebro.run()[0]
+    expect = df['volume'].rolling(10).mean().to_numpy()
+    print(f"VolumeSMA 和 pandas rolling 的最大误差: {np.nanmax(np.abs(np.array(strat.ind.array) - expect)):.2e}")
@@ -0,0 +1,183 @@
+'''
+回测工具：
+    把每天脚本里重复出现的 load_data、Cerebro 设置、分析器读取抽出来，
+    给参数搜索、批量回测这些工具共用。
+
+用法：
+    datas = {'BABA': load_csv('./BABA_year_data.csv')}
+    row = run_once(MACD_strategy, {'fast': 12, 'slow': 26}, datas, cash=10000)
+'''
+
+import os
+import time
+import itertools
+from multiprocessing import Pool
+
+import pandas as pd
+import backtrader as bt
+
+from 数组数据源 import NumpyData
+
+
+class DailySharpe(bt.analyzers.SharpeRatio):
+    """
+    按日收益计算、再年化的夏普比率
+    SharpeRatio 默认按年收益计算，一年以内的回测（逐步减半的前几轮、短历史）只有一个年度样本，结果是 None
+    """
+    params = (
+        ('timeframe', bt.TimeFrame.Days),
+        ('annualize', True),
+    )
+
+
+# 默认分析器：和 第6天 / 多因子学习 第5天 的优化脚本用的一样，夏普改为日频年化
+DEFAULT_ANALYZERS = (
+    (DailySharpe, 'sharpe'),
+    (bt.analyzers.Returns, 'returns'),
+    (bt.analyzers.DrawDown, 'drawdown'),
+)
+
+
+# ================= 数据 =================
+def load_csv(file_path):
+    """读取 *_year_data.csv，返回按日期排序、带 openinterest 列的 DataFrame"""
+    df = pd.read_csv(file_path)
+    df['date'] = pd.to_datetime(df['date'])
+    df.set_index('date', inplace=True)
+    df.sort_index(inplace=True)
+    df['openinterest'] = 0
+    return df
+
+
+def slice_datas(datas, bars):
+    """
+    只保留前 bars 根K线（以第一只股票的日期为准），用于在一段历史前缀上回测
+    返回的是切片视图，不会复制数据
+    """
+    first = next(iter(datas.values()))
+    bars = min(bars, len(first))
+    end = first.index[bars - 1]
+    return {name: df.loc[:end] for name, df in datas.items()}
+
+
+def expand_grid(grid):
+    """把 optstrategy 风格的参数网格 {参数: 候选值列表} 展开成参数字典列表"""
+    keys = list(grid.keys())
+    values = [list(v) if hasattr(v, '__iter__') and not isinstance(v, str) else [v] for v in grid.values()]
+    return [dict(zip(keys, combo)) for combo in itertools.product(*values)]
+
+
+# ================= 回测 =================
+def build_cerebro(datas, cash=10000, commission=0.001, stake=None, analyzers=DEFAULT_ANALYZERS):
+    """
+    创建已经设置好数据、资金、佣金和分析器的 Cerebro
+    - datas: {股票代码: DataFrame}
+    - stake: 固定下单手数，None 表示使用默认 sizer
+    批量回测不画图，所以关掉默认的 observer（stdstats=False），省掉每根K线的记录开销
+    数据源用 NumpyData 整块预加载，代替逐行读取的 PandasData
+    """
+    cerebro = bt.Cerebro(stdstats=False)
+    for name, df in datas.items():
+        cerebro.adddata(NumpyData.from_dataframe(df), name=name)
+    cerebro.broker.setcash(cash)
+    cerebro.broker.setcommission(commission=commission)
+    if stake:
+        cerebro.addsizer(bt.sizers.FixedSize, stake=stake)
+    for analyzer, name in analyzers:
+        cerebro.addanalyzer(analyzer, _name=name)
+    return cerebro
+
+
+def extract_metrics(strat):
+    """
+    从运行结束的策略实例读取参数和分析器结果，返回一行扁平字典
+    sharpe 为 None（没有交易或没有波动）时按 第5天 的做法记为 0
+    """
+    row = {name: getattr(strat.params, name) for name in strat.params._getkeys()}
+    names = strat.analyzers.getnames()
+    if 'sharpe' in names:
+        sharpe = strat.analyzers.sharpe.get_analysis().get('sharperatio', None)
+        row['sharpe'] = sharpe if sharpe is not None else 0
+    if 'returns' in names:
+        rets = strat.analyzers.returns.get_analysis()
+        row['rnorm100'] = rets.get('rnorm100', 0)
+        row['rtot'] = rets.get('rtot', 0)
+    if 'drawdown' in names:
+        row['max_drawdown'] = strat.analyzers.drawdown.get_analysis().max.drawdown
+    if 'trades' in names:
+        trades = strat.analyzers.trades.get_analysis()
+        total = trades.get('total', {}).get('closed', 0)
+        won = trades.get('won', {}).get('total', 0)
+        row['trades'] = total
+        row['win_rate'] = won / total if total else 0
+    row['final_value'] = strat.broker.getvalue()
+    return row
+
+
+def run_once(strategy, params, datas, **broker_kw):
+    """用一组参数跑一次回测，返回 参数 + 指标 + 用时 的字典"""
+    start = time.time()
+    cerebro = build_cerebro(datas, **broker_kw)
+    cerebro.addstrategy(strategy, **params)
+    strat = cerebro.run()[0]
+    row = extract_metrics(strat)
+    row['bars'] = len(next(iter(datas.values())))
+    row['seconds'] = round(time.time() - start, 4)
+    return row
+
+
+def run_returns(strategy, params, datas, **broker_kw):
+    """用一组参数跑一次回测，返回每日收益率 Series（TimeReturn 分析器），用来拼接资金曲线"""
+    broker_kw = dict(broker_kw, analyzers=((bt.analyzers.TimeReturn, 'timereturn'),))
+    cerebro = build_cerebro(datas, **broker_kw)
+    cerebro.addstrategy(strategy, **params)
+    strat = cerebro.run()[0]
+    return pd.Series(strat.analyzers.timereturn.get_analysis(), dtype=float)
+
+
+# ================= 多进程 =================
+# 子进程里的共享状态：数据只在进程启动时传一次，之后每个任务只传参数
+_worker = {}
+
+
+def _init_worker(task, strategy, datas, broker_kw):
+    _worker['task'] = task
+    _worker['strategy'] = strategy
+    _worker['datas'] = datas
+    _worker['broker_kw'] = broker_kw
+
+
+def _run_in_worker(params):
+    return _worker['task'](_worker['strategy'], params, _worker['datas'], **_worker['broker_kw'])
+
+
+def iter_many(strategy, param_list, datas, maxcpus=None, task=run_once, **broker_kw):
+    """
+    和 run_many 一样，但每跑完一组就马上 yield 出来（完成顺序，不保证和 param_list 一致）
+    适合边跑边保存结果，中途崩溃也不会丢掉已经跑完的部分
+    """
+    maxcpus = maxcpus or os.cpu_count() or 1
+    if maxcpus == 1 or len(param_list) <= 1:
+        for p in param_list:
+            yield task(strategy, p, datas, **broker_kw)
+        return
+
+    with Pool(processes=min(maxcpus, len(param_list)), initializer=_init_worker,
+              initargs=(task, strategy, datas, broker_kw)) as pool:
+        yield from pool.imap_unordered(_run_in_worker, param_list)
+
+
+def run_many(strategy, param_list, datas, maxcpus=None, task=run_once, **broker_kw):
+    """
+    对一批参数分别回测，返回结果列表（顺序与 param_list 一致）
+    - task: 每组参数调用的函数，默认 run_once（指标字典），也可以是 run_returns（每日收益）
+    - maxcpus=1 时在当前进程里逐个运行，便于调试和复现
+    - 其它情况下用进程池并行，数据通过 initializer 每个进程只传一次
+    """
+    maxcpus = maxcpus or os.cpu_count() or 1
+    if maxcpus == 1 or len(param_list) <= 1:
+        return [task(strategy, p, datas, **broker_kw) for p in param_list]
+
+    with Pool(processes=min(maxcpus, len(param_list)), initializer=_init_worker,
+              initargs=(task, strategy, datas, broker_kw)) as pool:
+        return pool.map(_run_in_worker, param_list, chunksize=max(1, len(param_list) // (maxcpus * 4)))
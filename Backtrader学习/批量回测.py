@@ -0,0 +1,128 @@
+'''
+多股票批量回测：
+
+每天的脚本都在 load_data() 里写死一个文件（AI_year_data.csv、BABA_year_data.csv……），
+想试其它股票就得改路径再跑一次。
+
+run_universe 用同一个策略 + 参数，对一批数据文件（glob 通配符）分别做单股票回测：
+    - 每个文件一个独立回测，放进进程池并行；子进程自己读文件，主进程只传文件路径
+    - 不画图；quiet=True 时屏蔽策略里的 print，几千只股票也不会刷屏
+    - 汇总 最终资金、收益、夏普、最大回撤、交易次数、胜率 成一张表
+    - 某个文件读取或回测出错只记在 error 列，不影响其它股票
+
+用法：
+    table = run_universe(MACD_Strategy, './*_year_data.csv', cash=100000, stake=100)
+'''
+
+import io
+import os
+import glob
+import time
+import contextlib
+from multiprocessing import Pool
+
+import pandas as pd
+import backtrader as bt
+
+from 回测工具 import DEFAULT_ANALYZERS, load_csv, run_once
+
+
+ANALYZERS = DEFAULT_ANALYZERS + ((bt.analyzers.TradeAnalyzer, 'trades'),)
+
+
+def symbol_of(path):
+    """./BABA_year_data.csv -> BABA"""
+    return os.path.basename(path).split('_')[0].split('.')[0]
+
+
+# ================= 子进程 =================
+_universe_worker = {}
+
+
+def _init_universe_worker(strategy, params, loader, min_bars, quiet, broker_kw):
+    _universe_worker.update(strategy=strategy, params=params, loader=loader,
+                            min_bars=min_bars, quiet=quiet, broker_kw=broker_kw)
+
+
+def _run_file(path):
+    """回测一个文件，返回一行结果；出错时返回带 error 的行"""
+    w = _universe_worker
+    row = {'symbol': symbol_of(path), 'file': path}
+    try:
+        df = w['loader'](path)
+        if len(df) < w['min_bars']:
+            row['error'] = f"数据不足 {len(df)} 根K线"
+            return row
+        with contextlib.redirect_stdout(io.StringIO()) if w['quiet'] else contextlib.nullcontext():
+            row.update(run_once(w['strategy'], w['params'], {row['symbol']: df}, **w['broker_kw']))
+        row['start'], row['end'] = df.index[0], df.index[-1]
+    except Exception as e:
+        row['error'] = f"{type(e).__name__}: {e}"
+    return row
+
+
+# ================= 主流程 =================
+def run_universe(strategy, pattern='./*_year_data.csv', params=None, maxcpus=None, loader=load_csv,
+                 min_bars=30, quiet=True, analyzers=ANALYZERS, sort_by='sharpe', **broker_kw):
+    """
+    - strategy / params: 策略类和参数字典（None 表示默认参数）
+    - pattern: 数据文件通配符，也可以直接传文件路径列表
+    - loader: 读取一个文件、返回 DataFrame 的函数，默认 回测工具.load_csv
+    - min_bars: K线数少于这个数的股票直接跳过
+    - broker_kw: cash / commission / stake，和 回测工具.build_cerebro 一样
+    返回每只股票一行的 DataFrame，按 sort_by 从高到低排序
+    """
+    files = sorted(glob.glob(pattern)) if isinstance(pattern, str) else list(pattern)
+    maxcpus = maxcpus or os.cpu_count() or 1
+    initargs = (strategy, params or {}, loader, min_bars, quiet, dict(broker_kw, analyzers=analyzers))
+
+    rows = []
+    start = time.time()
+    if maxcpus == 1 or len(files) <= 1:
+        _init_universe_worker(*initargs)
+        results = map(_run_file, files)
+        pool = None
+    else:
+        pool = Pool(processes=min(maxcpus, len(files)), initializer=_init_universe_worker, initargs=initargs)
+        results = pool.imap_unordered(_run_file, files, chunksize=max(1, len(files) // (maxcpus * 8)))
+    try:
+        for i, row in enumerate(results, 1):
+            rows.append(row)
+            if i % 100 == 0:
+                print(f"  已完成 {i}/{len(files)}, 用时 {time.time() - start:.1f}秒")
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    table = pd.DataFrame(rows)
+    if 'final_value' in table:
+        table['return_pct'] = (table['final_value'] / broker_kw.get('cash', 10000) - 1) * 100
+    if sort_by in table:
+        table = table.sort_values(by=sort_by, ascending=False, na_position='last')
+    return table.reset_index(drop=True)
+
+
+def summarize(table):
+    """整个股票池的汇总：成功/失败数量、盈利比例、收益和夏普的中位数"""
+    ok = table[table['error'].isna()] if 'error' in table else table
+    return pd.Series({
+        '股票数': len(table),
+        '成功': len(ok),
+        '失败': len(table) - len(ok),
+        '盈利比例': (ok['return_pct'] > 0).mean() if len(ok) else float('nan'),
+        '收益中位数%': ok['return_pct'].median() if len(ok) else float('nan'),
+        '夏普中位数': ok['sharpe'].median() if len(ok) else float('nan'),
+        '最大回撤中位数%': ok['max_drawdown'].median() if len(ok) else float('nan'),
+    })
+
+
+if __name__ == '__main__':
+    # 第13天 的 MACD 柱状图策略，跑遍目录下所有 *_year_data.csv
+    from 第13天 import MACD_Strategy
+
+    start = time.time()
+    table = run_universe(MACD_Strategy, './*_year_data.csv', cash=100000, commission=0.01, stake=100)
+    print(f"{len(table)} 只股票, 用时 {time.time() - start:.2f}秒")
+    print(table[['symbol', 'final_value', 'return_pct', 'sharpe', 'max_drawdown', 'trades', 'win_rate']])
+    print(summarize(table))
@@ -0,0 +1,149 @@
+'''
+NumPy 数组数据源（代替 bt.feeds.PandasData）：
+
+每个脚本都用 bt.feeds.PandasData(dataname=df)，预加载（preload）时它逐行 iloc 读取 DataFrame，
+再一个值一个值写进 Backtrader 的 lines，大部分时间花在 Python 循环上。
+
+NumpyData 直接接收连续的 NumPy 数组（datetime / open / high / low / close / volume / openinterest），
+预加载时每条 line 用一次 memcpy 整体填进去：
+    - fromdate / todate 用二分查找（np.searchsorted）确定起止位置，不再逐行比较；
+    - 数组可以来自内存，也可以来自磁盘上的 .npy 文件（np.load(mmap_mode='r') 内存映射），
+      加载速度基本等于读盘速度；
+    - 用了 filters（比如 resampledata）、tzinput 或 exactbars 省内存模式时，自动退回逐行加载。
+
+注意：Backtrader 的 line 底层是 array.array，没办法直接引用 NumPy 的内存，所以每条 line 仍有一次整块复制，
+但不再有逐行的 Python 开销。
+
+用法：
+    data = NumpyData.from_dataframe(df)                   # 和 PandasData(dataname=df) 一样
+    save_arrays(df, './npy/BABA')                          # 把数据存成 .npy
+    data = NumpyData(dataname=load_arrays('./npy/BABA'))   # 内存映射读取
+'''
+
+import os
+import glob
+import time
+import array
+
+import numpy as np
+import backtrader as bt
+
+
+# 1970-01-01 在 Backtrader 日期数字（公历序数 + 当天的小数部分）里的值
+_EPOCH_ORDINAL = 719163.0
+_NS_PER_DAY = 86400 * 10**9
+
+LINE_NAMES = ('open', 'high', 'low', 'close', 'volume', 'openinterest')
+
+
+def to_bt_datetime(values):
+    """把 datetime64 数组一次性转换成 Backtrader 的日期数字（和 bt.date2num 相同，按 UTC 处理）"""
+    values = np.asarray(values)
+    if values.dtype.kind == 'f':
+        return values       # 已经是日期数字
+    ns = values.astype('datetime64[ns]').astype(np.int64)
+    return ns / _NS_PER_DAY + _EPOCH_ORDINAL
+
+
+def frame_to_arrays(df):
+    """
+    DataFrame（日期索引 + OHLCV 列，列名不区分大小写）-> {line 名: 连续 float64 数组}
+    缺少的列（例如 openinterest）不放进字典，加载时按 PandasData 的做法留成 NaN
+    """
+    cols = {str(c).lower(): c for c in df.columns}
+    arrays = {'datetime': np.ascontiguousarray(to_bt_datetime(df.index.values), dtype='d')}
+    for name in LINE_NAMES:
+        if name in cols:
+            arrays[name] = np.ascontiguousarray(df[cols[name]].to_numpy(dtype='d'))
+    return arrays
+
+
+def save_arrays(df, dirpath):
+    """把一只股票存成一个目录下的多个 .npy 文件（每条 line 一个），之后可以内存映射读取"""
+    os.makedirs(dirpath, exist_ok=True)
+    for name, values in frame_to_arrays(df).items():
+        np.save(os.path.join(dirpath, f"{name}.npy"), values)
+
+
+def load_arrays(dirpath, mmap=True):
+    """读取 save_arrays 保存的目录；mmap=True 时只做内存映射，真正用到时才从磁盘读"""
+    mode = 'r' if mmap else None
+    return {os.path.splitext(os.path.basename(f))[0]: np.load(f, mmap_mode=mode)
+            for f in glob.glob(os.path.join(dirpath, '*.npy'))}
+
+
+class NumpyData(bt.feed.DataBase):
+    """
+    dataname: {line 名: 数组} 字典，必须包含 'datetime'（datetime64 或 Backtrader 日期数字），
+              数组按时间升序排列
+    """
+
+    @classmethod
+    def from_dataframe(cls, df, **kwargs):
+        """和 bt.feeds.PandasData(dataname=df) 用法一样"""
+        return cls(dataname=frame_to_arrays(df), **kwargs)
+
+    def start(self):
+        super().start()
+        arrays = self.p.dataname
+        self._dt = to_bt_datetime(arrays['datetime'])
+        self._cols = {name: arrays[name] for name in self.getlinealiases()
+                      if name != 'datetime' and name in arrays}
+        self._idx = -1
+
+    def _window(self):
+        """用二分查找确定 fromdate ~ todate 对应的数组下标范围"""
+        lo = 0 if self.fromdate == float('-inf') else int(np.searchsorted(self._dt, self.fromdate, side='left'))
+        hi = len(self._dt) if self.todate == float('inf') else int(np.searchsorted(self._dt, self.todate, side='right'))
+        return lo, hi
+
+    def _can_bulk(self):
+        """filters、tzinput、exactbars（QBuffer 模式）都需要逐行处理，这些情况不走整块加载"""
+        if self._filters or self._ffilters or self._tzinput:
+            return False
+        return all(line.mode == line.UnBounded and line.extension == 0 for line in self.lines)
+
+    def preload(self):
+        if not self._can_bulk():
+            return super().preload()
+
+        lo, hi = self._window()
+        for name in self.getlinealiases():
+            line = getattr(self.lines, name)
+            if name == 'datetime':
+                values = self._dt[lo:hi]
+            elif name in self._cols:
+                values = self._cols[name][lo:hi]
+            else:
+                values = np.full(hi - lo, np.nan)       # 和 PandasData 一样，缺的列是 NaN
+            line.array = array.array('d')
+            line.array.frombytes(np.ascontiguousarray(values, dtype='d').tobytes())
+        self._idx = hi - 1
+        self.home()
+
+    def _load(self):
+        """逐行加载（preload=False、或有 filters 时用）"""
+        self._idx += 1
+        if self._idx >= len(self._dt):
+            return False
+        for name, values in self._cols.items():
+            getattr(self.lines, name)[0] = values[self._idx]
+        self.lines.datetime[0] = self._dt[self._idx]
+        return True
+
+
+if __name__ == '__main__':
+    from 回测工具 import load_csv
+
+    # 对比加载 全部 *_year_data.csv 时，PandasData 和 NumpyData 的预加载耗时
+    files = sorted(glob.glob('./*_year_data.csv'))
+    frames = {os.path.basename(f).split('_')[0]: load_csv(f) for f in files}
+
+    for name, make in [('PandasData', lambda df: bt.feeds.PandasData(dataname=df)),
+                       ('NumpyData', NumpyData.from_dataframe)]:
+        cerebro = bt.Cerebro(stdstats=False)
+        for symbol, df in frames.items():
+            cerebro.adddata(make(df), name=symbol)
+        start = time.time()
+        cerebro.run()
+        print(f"{name}: {len(frames)} 只股票, 预加载+运行用时 {time.time() - start:.3f}秒")
@@ -0,0 +1,90 @@
+'''
+流式参数优化：
+
+第8天、多因子学习 第5天 用 bt.Cerebro(optreturn=False)，优化结束前每一组参数的完整策略对象
+（包括所有 lines 和指标）都留在内存里，网格越大内存越大。
+
+StreamingCerebro 的做法：
+    - 每个策略跑完 stop() 之后，马上提取 参数 + 分析器结果，变成一行字典；
+    - 只把这行字典交回主进程（多进程时也只传这一行），策略对象随即释放；
+    - 结果通过 optcallback 回调流给调用方，或者直接写进 结果存储.SweepStore；
+    - keep_results=False（默认）时 run() 不保留结果列表。
+这样内存只和同时运行的进程数有关，和网格大小无关。
+
+用法和普通 Cerebro 一样：
+    cerebro = StreamingCerebro(maxcpus=4)
+    cerebro.optstrategy(MyStrategy, period=range(5, 30))
+    cerebro.optcallback(lambda rows: print(rows[0]))
+    cerebro.stream_to(store)      # 可选：边跑边写入结果存储
+    cerebro.run()
+'''
+
+import backtrader as bt
+
+from 回测工具 import extract_metrics
+
+
+class StreamingCerebro(bt.Cerebro):
+    params = (
+        ('keep_results', False),    # True: run() 仍然返回每组参数的结果行（只是字典，不是策略对象）
+    )
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.p.optreturn = False    # 需要完整的策略对象来读取 broker 资金，读取完就丢掉
+
+    def _register(self, strategy):
+        # self.strats 里存的是 itertools.product，没法回头读，这里记下 策略类名 -> 参数名，用来识别参数列
+        self._strategy_params = dict(getattr(self, '_strategy_params', {}))
+        self._strategy_params[strategy.__name__] = tuple(strategy.params._getkeys())
+
+    def addstrategy(self, strategy, *args, **kwargs):
+        self._register(strategy)
+        return super().addstrategy(strategy, *args, **kwargs)
+
+    def optstrategy(self, strategy, *args, **kwargs):
+        self._register(strategy)
+        return super().optstrategy(strategy, *args, **kwargs)
+
+    def runstrategies(self, iterstrat, predata=False):
+        """
+        运行一组参数；优化模式下返回 结果行列表 而不是策略对象
+        每行在生成时带上 strategy 列（策略类名）：同时有多个策略时，行的顺序不能用来判断它属于哪个策略
+        """
+        runstrats = super().runstrategies(iterstrat, predata=predata)
+        if not self._dooptimize:
+            return runstrats
+        rows = [dict(extract_metrics(strat), strategy=type(strat).__name__) for strat in runstrats]
+        self.runningstrats = None   # Cerebro 自己也保留了一份引用，一起释放
+        return rows
+
+    def run(self, **kwargs):
+        if not self.p.keep_results and self._drop_result not in self.optcbs:
+            self.optcallback(self._drop_result)     # 放在最后：其它回调拿到结果后再丢掉
+        result = super().run(**kwargs)
+        for store in getattr(self, '_stores', []):
+            store.flush()
+        return result
+
+    def _drop_result(self, rows):
+        self.runstrats.clear()
+
+    def stream_to(self, store):
+        """每组参数跑完就追加到 SweepStore（结果存储.py）"""
+        def append(rows):
+            for row in rows:
+                names = self._strategy_params[row['strategy']]
+                store.append({'strategy': row['strategy'], **{k: row[k] for k in names}}, row)
+        self.optcallback(append)
+        self._stores = getattr(self, '_stores', []) + [store]
+
+    def __getstate__(self):
+        # 多进程时整个 Cerebro 会被 pickle 到子进程，回调和结果存储留在主进程就行
+        state = super().__getstate__()
+        state.pop('optcbs', None)
+        state.pop('_stores', None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.optcbs = []
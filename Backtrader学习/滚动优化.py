@@ -0,0 +1,182 @@
+'''
+滚动优化（Walk-Forward）：
+
+第6天、第14天、第20天、多因子学习 第5天 都是在整年数据上找最优参数，再报告同一段数据上的成绩，
+这是样本内的结果，一定是过拟合的。
+滚动优化的做法：
+    1. 把历史切成一段段 训练窗口 + 紧跟着的测试窗口，窗口向前滚动；
+    2. 每个训练窗口上找最优参数；
+    3. 用这组参数在后面的测试窗口上跑，记录样本外收益；
+    4. 把所有测试窗口的收益拼起来，就是样本外资金曲线。
+
+两种模式：
+    shared=True（默认）：每组参数只在完整历史上回测一次，指标只算一遍，
+        各个窗口的训练/测试成绩直接从这一次回测的每日收益里按日期切出来，重叠的窗口不会重复计算。
+        缺点是窗口开始时可能带着之前的持仓。
+    shared=False：每个窗口独立回测。训练窗口上重新跑全部参数，
+        测试窗口前面多给 warmup 根K线只用来算指标、不交易。各个窗口放到进程池里并行。
+'''
+
+import os
+import time
+from multiprocessing import Pool
+
+import numpy as np
+import pandas as pd
+
+from 回测工具 import load_csv, expand_grid, run_many, run_returns
+
+
+# ================= 切分窗口 =================
+def make_folds(index, train_bars, test_bars, step=None):
+    """
+    按K线数量切分滚动窗口
+    - step: 每次向前滚动多少根K线，默认等于 test_bars（测试窗口首尾相接，不重叠）
+    返回字典列表：fold、训练/测试窗口的起止日期和位置
+    """
+    step = step or test_bars
+    folds = []
+    start = 0
+    while start + train_bars < len(index):
+        test_start = start + train_bars
+        test_end = min(test_start + test_bars, len(index))
+        folds.append({
+            'fold': len(folds),
+            'train_start': index[start], 'train_end': index[test_start - 1],
+            'test_start': index[test_start], 'test_end': index[test_end - 1],
+            'train_pos': (start, test_start), 'test_pos': (test_start, test_end),
+        })
+        start += step
+    return folds
+
+
+def score_returns(returns, metric='sharpe'):
+    """
+    给每日收益打分，returns 可以是 Series（一组参数）或 DataFrame（每列一组参数）
+    - sharpe: 年化夏普（日均收益 / 日标准差 * sqrt(252)），标准差为 0 时记为 0
+    - return: 窗口内复利总收益
+    """
+    if metric == 'sharpe':
+        sharpe = returns.mean() / returns.std(ddof=1) * np.sqrt(252)
+        if isinstance(sharpe, pd.Series):
+            return sharpe.replace([np.inf, -np.inf], np.nan).fillna(0)
+        return sharpe if np.isfinite(sharpe) else 0.0
+    if metric == 'return':
+        return (1 + returns).prod() - 1
+    raise ValueError(f"不支持的 metric: {metric}")
+
+
+def _window(datas, start, end):
+    """按日期切出 [start, end] 的数据（切片视图）"""
+    return {name: df.loc[start:end] for name, df in datas.items()}
+
+
+def _trade_from(strategy, start):
+    """生成一个子类：start 之前只更新指标，不调用策略的 next()，也就不会下单"""
+    class WarmupGate(strategy):
+        def next(self):
+            if self.data.datetime.datetime(0) < start:
+                return
+            super().next()
+    return WarmupGate
+
+
+# ================= 独立模式：每个窗口一个进程 =================
+_fold_worker = {}
+
+
+def _init_fold_worker(strategy, candidates, datas, metric, warmup, broker_kw):
+    _fold_worker.update(strategy=strategy, candidates=candidates, datas=datas,
+                        metric=metric, warmup=warmup, broker_kw=broker_kw)
+
+
+def _run_fold(fold):
+    """在一个窗口上完成 训练 -> 选参 -> 测试，返回 (最优参数下标, 训练得分, 测试期每日收益)"""
+    w = _fold_worker
+    strategy, datas, broker_kw = w['strategy'], w['datas'], w['broker_kw']
+    index = next(iter(datas.values())).index
+
+    # 训练：全部参数在训练窗口上回测并打分
+    train = _window(datas, fold['train_start'], fold['train_end'])
+    train_rets = run_many(strategy, w['candidates'], train, maxcpus=1, task=run_returns, **broker_kw)
+    scores = [score_returns(r, w['metric']) for r in train_rets]
+    best = int(np.argmax(scores))
+
+    # 测试：前面带 warmup 根K线算指标，从 test_start 开始才交易
+    warm_start = index[max(0, fold['test_pos'][0] - w['warmup'])]
+    test = _window(datas, warm_start, fold['test_end'])
+    gated = _trade_from(strategy, fold['test_start'])
+    test_rets = run_returns(gated, w['candidates'][best], test, **broker_kw)
+    return best, scores[best], test_rets.loc[fold['test_start']:]
+
+
+# ================= 主流程 =================
+def walk_forward(strategy, grid, datas, train_bars=120, test_bars=40, step=None, metric='sharpe',
+                 shared=True, warmup=60, maxcpus=None, **broker_kw):
+    """
+    - strategy / grid: 策略类和 optstrategy 风格的参数网格
+    - datas: {股票代码: DataFrame}，以第一只股票的日期切窗口
+    - train_bars / test_bars / step: 训练、测试窗口长度和滚动步长（K线数）
+    - metric: 训练窗口上选参的标准，'sharpe' 或 'return'
+    - shared: 是否共享一次完整历史回测（见模块说明）
+    - warmup: 独立模式下测试窗口前面用于指标预热的K线数
+    返回:
+    - report: 每个窗口的最优参数、训练得分、测试收益
+    - oos_returns: 拼接好的样本外每日收益
+    - equity: 样本外资金曲线（从 cash 开始复利）
+    """
+    candidates = expand_grid(grid)
+    index = next(iter(datas.values())).index
+    folds = make_folds(index, train_bars, test_bars, step)
+    maxcpus = maxcpus or os.cpu_count() or 1
+
+    if shared:
+        # 每组参数在完整历史上只跑一次，得到 日期 x 参数 的收益矩阵
+        rets = run_many(strategy, candidates, datas, maxcpus=maxcpus, task=run_returns, **broker_kw)
+        panel = pd.concat(rets, axis=1, keys=range(len(candidates))).fillna(0.0)
+        results = []
+        for fold in folds:
+            scores = score_returns(panel.loc[fold['train_start']:fold['train_end']], metric)
+            best = int(scores.idxmax())
+            results.append((best, scores[best], panel.loc[fold['test_start']:fold['test_end'], best]))
+    else:
+        initargs = (strategy, candidates, datas, metric, warmup, broker_kw)
+        if maxcpus == 1 or len(folds) <= 1:
+            _init_fold_worker(*initargs)
+            results = [_run_fold(fold) for fold in folds]
+        else:
+            with Pool(processes=min(maxcpus, len(folds)), initializer=_init_fold_worker,
+                      initargs=initargs) as pool:
+                results = pool.map(_run_fold, folds)
+
+    # 汇总每个窗口的结果，并拼接样本外收益
+    report = []
+    for fold, (best, train_score, test_rets) in zip(folds, results):
+        row = {k: v for k, v in fold.items() if not k.endswith('_pos')}
+        row.update(candidates[best])
+        row['train_score'] = train_score
+        row['test_return'] = score_returns(test_rets, 'return')
+        row['test_sharpe'] = score_returns(test_rets, 'sharpe')
+        report.append(row)
+
+    oos_returns = pd.concat([r[2] for r in results]) if results else pd.Series(dtype=float)
+    oos_returns = oos_returns[~oos_returns.index.duplicated(keep='first')]
+    equity = broker_kw.get('cash', 10000) * (1 + oos_returns).cumprod()
+    return pd.DataFrame(report), oos_returns, equity
+
+
+if __name__ == '__main__':
+    # 用 第6天 的 RSI 交叉策略和参数网格做演示
+    from 第6天 import RsiStrategy
+
+    grid = dict(rsi_short=range(5, 16, 2), rsi_long=range(20, 41, 5))
+    datas = {'AAL': load_csv('./AAL_year_data.csv')}
+
+    for shared in (True, False):
+        start = time.time()
+        report, oos_returns, equity = walk_forward(RsiStrategy, grid, datas, train_bars=120, test_bars=40,
+                                                   shared=shared, cash=10000, commission=0.001)
+        print(f"\n=== 滚动优化 shared={shared}, 用时 {time.time() - start:.2f}秒 ===")
+        print(report[['fold', 'test_start', 'test_end', 'rsi_short', 'rsi_long', 'train_score', 'test_return']])
+        print(f"样本外总收益: {(equity.iloc[-1] / 10000 - 1) * 100:.2f}%, "
+              f"样本外夏普: {score_returns(oos_returns, 'sharpe'):.2f}")
@@ -14,10 +14,11 @@ import backtrader as bt
 import pandas as pd
 from trio import sleep
 
+from 重采样缓存 import add_resampled
+
 
 # 加载数据
-def load_data():
-    file_path = './ALHC_year_data.csv'
+def load_data(file_path='./ALHC_year_data.csv'):
     df = pd.read_csv(file_path)     # 读取数据
     df['date'] = pd.to_datetime(df['date'])
     df.set_index('date', inplace=True)
@@ -74,11 +75,14 @@ def run_testing():
     cerebro = bt.Cerebro()
     cerebro.addstrategy(MultiTimeFrameStrategy)
 
-    data = load_data()
+    file_path = './ALHC_year_data.csv'
+    data = load_data(file_path)
     cerebro.adddata(data)
 
     # 用resample 生成周线数据
-    cerebro.resampledata(data, timeframe=bt.TimeFrame.Weeks)
+    # cerebro.resampledata(data, timeframe=bt.TimeFrame.Weeks)
+    # 改用预先合成好的周线（结果和 resampledata 一样，不用每次回测都重新合成）
+    add_resampled(cerebro, file_path, bt.TimeFrame.Weeks)
 
 
     cerebro.broker.setcash(100000)
@@ -7,6 +7,8 @@
 import pandas as pd
 # 导入回测框架 backtrader，用于搭建策略、指标与回测引擎
 import backtrader as bt
+# 流式优化引擎：每组参数跑完只留下结果行，策略对象马上释放
+from 流式优化 import StreamingCerebro
 
 
 
@@ -191,8 +193,8 @@ def load_data():
 
 # 回测主函数
 def run_optimization():
-    # 创建回测引擎 Cerebro；optreturn=False 表示优化时返回完整策略对象（非精简）
-    cerebro = bt.Cerebro(optreturn=False)
+    # 创建流式优化引擎：代替 optreturn=False，不再把每组参数的完整策略对象留在内存里
+    cerebro = StreamingCerebro()
 
     # 加载数据并添加到引擎
     data = load_data()      # 调用数据加载函数
@@ -215,18 +217,35 @@ def run_optimization():
     cerebro.broker.set_cash(100000)
     cerebro.broker.setcommission(commission=0.001)
 
-    # 运行参数优化：返回每组参数下的运行结果列表
-    opt_runs = cerebro.run()
-
-    # 遍历输出每组参数的回测结果：打印最终资金与关键参数
-    for run in opt_runs:
-        strat = run[0]
+    # 每组参数跑完马上回调：打印最终资金与关键参数，并记下结果行
+    opt_results = []
+    def on_result(rows):
+        row = rows[0]
         print('最终终极: %.2f, 参数: rsi_buy=%d, stop_loss=%.2f, take_profit=%.2f' % (
-            strat.broker.getvalue(),
-            strat.params.rsi_buy,
-            strat.params.stop_loss,
-            strat.params.take_profit
+            row['final_value'],
+            row['rsi_buy'],
+            row['stop_loss'],
+            row['take_profit']
         ))
+        opt_results.append(row)
+    cerebro.optcallback(on_result)
+
+    # 运行参数优化
+    cerebro.run()
+
+    # 优化结果里已经没有策略对象了，用最终资金最高的参数重新跑一次来画图
+    best = max(opt_results, key=lambda r: r['final_value'])
+    cerebro = bt.Cerebro()
+    cerebro.adddata(load_data())
+    cerebro.addstrategy(
+        MACD_RSI_Strategy,
+        rsi_buy=best['rsi_buy'],
+        stop_loss=best['stop_loss'],
+        take_profit=best['take_profit']
+    )
+    cerebro.broker.set_cash(100000)
+    cerebro.broker.setcommission(commission=0.001)
+    cerebro.run()
 
     # 绘制结果图表（蜡烛图样式），直观展示价格与交易点
     cerebro.plot(style='candlestick')
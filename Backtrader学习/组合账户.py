@@ -0,0 +1,299 @@
+'''
+多股票组合账户（NumPy 数组记账）：
+
+多因子学习 第6天 的 MultiFactorStrategy 每根K线都要
+    sum(self.getposition(data).size * data.close[0] for data in self.datas)
+再在循环里对每只股票 getposition、查字典算加权得分。股票一多（几百个数据源），
+每根K线的 Python 循环和字典查找就成了主要开销。
+
+PortfolioBook 把组合状态放进按数据源顺序排列的 NumPy 数组：
+    - size / cost：持仓数量、持仓均价，只在成交回报（notify_order）时增量更新
+    - price / value：每根K线 mark() 一次，读取全部收盘价，市值 = size * price；
+      数据预加载时，第一次 mark() 把全部收盘价按日期对齐成一个 日期 x 股票 的矩阵，
+      之后每根K线只取一行，不再逐个数据源读取
+    - 总仓位 exposure、单只占比 weights()、还能买多少 room() 都是一次向量运算
+    - realized / commission：已实现盈亏和手续费，按股票累计
+    - rebalance(目标权重)：一次向量运算算出每只股票要调整的股数，只下必要的订单，先卖后买
+
+用法（在策略里）：
+    def __init__(self):
+        self.book = PortfolioBook(self)
+
+    def notify_order(self, order):
+        self.book.on_order(order)
+
+    def next(self):
+        self.book.mark()
+        pct = self.book.exposure / self.broker.getvalue()
+        self.book.rebalance({'HOOD': 0.5, 'TME': 0.5})     # 调到目标权重，其它股票清仓
+'''
+
+import time
+
+import numpy as np
+import pandas as pd
+import backtrader as bt
+
+
+def rebalance_deltas(size, price, total_value, cash, weights, commission=0.0, lot=1,
+                     cash_buffer=0.0, min_trade_value=0.0):
+    """
+    目标权重 -> 每只股票要买卖的股数（正数买入，负数卖出），全部是向量运算
+    - size / price / weights / commission: 每只股票的 当前持仓、价格、目标权重、手续费率
+    - total_value / cash: 账户总资产和现金
+    - lot: 每手股数，目标股数向 0 取整到整手
+    - cash_buffer: 留出总资产的这个比例不用，防止第二天开盘价高于今天收盘价导致资金不足
+    - min_trade_value: 调整金额小于这个数的不下单，避免很小的零碎订单
+    买入所需资金（含手续费）超过 现金 + 卖出所得 时，所有买单按同一比例缩小后再取整
+    """
+    size = np.asarray(size, dtype=float)
+    price = np.asarray(price, dtype=float)
+    valid = np.isfinite(price) & (price > 0)        # 没有价格的股票不动
+    safe_price = np.where(valid, price, 1.0)
+
+    target = np.trunc(total_value * np.asarray(weights, dtype=float) / safe_price / lot) * lot
+    delta = np.where(valid, target - size, 0.0)
+    delta[np.abs(delta * safe_price) < max(min_trade_value, 1e-12)] = 0.0
+
+    sells = np.minimum(delta, 0.0)
+    buys = np.maximum(delta, 0.0)
+    available = cash - sells @ (safe_price * (1 - commission)) - cash_buffer * total_value
+    need = buys @ (safe_price * (1 + commission))
+    if need > available:
+        scale = max(available, 0.0) / need
+        buys = np.floor(buys * scale / lot) * lot
+    return sells + buys
+
+
+class PortfolioBook:
+    """按 strategy.datas 顺序记账，第 i 个数组元素对应 datas[i]"""
+
+    def __init__(self, strategy):
+        self.strategy = strategy
+        self.datas = list(strategy.datas)
+        self.names = [d._name for d in self.datas]
+        self.index = {id(d): i for i, d in enumerate(self.datas)}
+        n = len(self.datas)
+        self.size = np.zeros(n)             # 持仓数量（空头为负）
+        self.cost = np.zeros(n)             # 持仓均价
+        self.price = np.full(n, np.nan)     # 最近一次 mark() 的收盘价
+        self.realized = np.zeros(n)         # 已实现盈亏（不含手续费）
+        self.commission = np.zeros(n)       # 累计手续费
+        self._applied = {}                  # 订单 ref -> 已经记过账的成交数量（处理部分成交）
+        self._calendar = None               # 预加载时：全部数据源日期的并集
+        self._closes = None                 # 预加载时：日期 x 股票 的收盘价矩阵（向前填充）
+        self._t = 0
+
+    # ---------- 成交回报 ----------
+    def on_order(self, order):
+        """在策略的 notify_order 里调用；只处理新增的成交部分"""
+        if order.status not in (order.Partial, order.Completed):
+            return
+        done_size, done_value, done_comm = self._applied.get(order.ref, (0.0, 0.0, 0.0))
+        qty = order.executed.size - done_size
+        if qty == 0:
+            return
+        # executed 里是整张订单累计的成交，减去已经记过的部分就是这次新增的
+        value = order.executed.size * order.executed.price
+        self.fill(self.index[id(order.data)], qty, (value - done_value) / qty, order.executed.comm - done_comm)
+        if order.status == order.Completed:
+            self._applied.pop(order.ref, None)
+        else:
+            self._applied[order.ref] = (order.executed.size, value, order.executed.comm)
+
+    def fill(self, i, qty, price, comm=0.0):
+        """第 i 只股票成交 qty 股（买入为正），更新数量、均价、已实现盈亏"""
+        old = self.size[i]
+        new = old + qty
+        if old == 0 or np.sign(old) == np.sign(qty):
+            # 开仓或加仓：加权平均成本
+            self.cost[i] = (old * self.cost[i] + qty * price) / new
+        else:
+            # 减仓 / 平仓 / 反手：减掉的部分按均价结算盈亏
+            closed = min(abs(qty), abs(old)) * np.sign(old)
+            self.realized[i] += closed * (price - self.cost[i])
+            if new == 0:
+                self.cost[i] = 0.0
+            elif np.sign(new) != np.sign(old):
+                self.cost[i] = price      # 反手后剩下的是新仓位
+        self.size[i] = new
+        self.commission[i] += comm
+
+    # ---------- 每根K线 ----------
+    def _preloaded(self):
+        cerebro = self.strategy.cerebro
+        return cerebro._dopreload and cerebro._exactbars < 1 and \
+            all(d.close.mode == d.close.UnBounded for d in self.datas)
+
+    def _build_matrix(self):
+        """把每个数据源的收盘价按日期放进同一个矩阵，停牌/还没上市的日子用前一个价格（或 NaN）"""
+        dts = [np.array(d.datetime.array) for d in self.datas]
+        self._calendar = np.unique(np.concatenate(dts))
+        closes = np.full((len(self._calendar), len(self.datas)), np.nan)
+        for j, (d, dt) in enumerate(zip(self.datas, dts)):
+            closes[np.searchsorted(self._calendar, dt), j] = np.array(d.close.array)
+        self._closes = pd.DataFrame(closes).ffill().to_numpy()
+
+    def mark(self):
+        """更新全部股票的当前收盘价"""
+        if self._closes is None and self._preloaded():
+            self._build_matrix()
+        if self._closes is not None:
+            # 策略的 datetime 是当前所有数据源里最新的时间，也就是日历上的当前行
+            dt = self.strategy.lines.datetime[0]
+            while self._calendar[self._t] < dt:
+                self._t += 1
+            self.price = self._closes[self._t]
+        else:
+            self.price = np.fromiter((d.close[0] for d in self.datas), dtype=float, count=len(self.datas))
+
+    @property
+    def value(self):
+        """每只股票的持仓市值，没有持仓的是 0"""
+        return np.where(self.size != 0, self.size * self.price, 0.0)
+
+    @property
+    def exposure(self):
+        """总持仓市值"""
+        return float(self.size @ np.nan_to_num(self.price))
+
+    @property
+    def unrealized(self):
+        return np.where(self.size != 0, self.size * (self.price - self.cost), 0.0)
+
+    def weights(self, total_value):
+        """每只股票的持仓占比（相对账户总资产）"""
+        return self.value / total_value if total_value > 0 else np.zeros(len(self.datas))
+
+    def room(self, total_value, max_position_pct, max_total_position=1.0):
+        """
+        每只股票还能再买多少市值：同时满足 单只 <= max_position_pct 和 总仓位 <= max_total_position
+        """
+        single = np.maximum(total_value * max_position_pct - self.value, 0.0)
+        total = max(total_value * max_total_position - self.exposure, 0.0)
+        return np.minimum(single, total)
+
+    # ---------- 调仓 ----------
+    def target_vector(self, weights):
+        """{股票代码: 权重} 或数组 -> 按 datas 顺序的权重向量，字典里没有的股票权重为 0"""
+        if isinstance(weights, dict):
+            vec = np.zeros(len(self.datas))
+            for i, name in enumerate(self.names):
+                vec[i] = weights.get(name, 0.0)
+            return vec
+        return np.asarray(weights, dtype=float)
+
+    def rebalance(self, weights, lot=1, cash_buffer=0.0, min_trade_pct=0.0):
+        """
+        把组合调到目标权重，返回下出的订单列表
+        - 计算用当前收盘价（mark()），按 broker 的手续费设置估算费用
+        - 只对持仓和目标不一样的股票下单；先下全部卖单，再下买单（同一根K线的订单按顺序成交）
+        - 以已成交的持仓为准，调用前应确认没有未成交的订单
+        """
+        self.mark()
+        broker = self.strategy.broker
+        total_value = broker.getvalue()
+        target = self.target_vector(weights)
+
+        # 手续费率：getcommission(1股, 价格) / 价格，百分比和按股收费两种设置都适用
+        commission = np.zeros(len(self.datas))
+        for i in np.flatnonzero((target != 0) | (self.size != 0)):
+            if np.isfinite(self.price[i]) and self.price[i] > 0:
+                commission[i] = broker.getcommissioninfo(self.datas[i]).getcommission(1, self.price[i]) / self.price[i]
+
+        delta = rebalance_deltas(self.size, self.price, total_value, broker.getcash(), target,
+                                 commission=commission, lot=lot, cash_buffer=cash_buffer,
+                                 min_trade_value=min_trade_pct * total_value)
+        orders = []
+        for i in np.flatnonzero(delta < 0):
+            orders.append(self.strategy.sell(data=self.datas[i], size=float(-delta[i])))
+        for i in np.flatnonzero(delta > 0):
+            orders.append(self.strategy.buy(data=self.datas[i], size=float(delta[i])))
+        return orders
+
+    def to_frame(self):
+        """当前持仓明细"""
+        return pd.DataFrame({'size': self.size, 'cost': self.cost, 'price': self.price,
+                             'value': self.value, 'unrealized': self.unrealized,
+                             'realized': self.realized, 'commission': self.commission},
+                            index=self.names)
+
+
+if __name__ == '__main__':
+    from 数组数据源 import NumpyData
+
+    # 300 只随机行情：每根K线计算总仓位，对比 getposition 循环 和 PortfolioBook
+    n_assets, n_bars = 300, 500
+    rng = np.random.default_rng(0)
+    index = pd.bdate_range('2023-01-02', periods=n_bars)
+    frames = {}
+    for k in range(n_assets):
+        close = 50 * np.exp(np.cumsum(rng.normal(0, 0.02, n_bars)))
+        frames[f"S{k:03d}"] = pd.DataFrame({'open': close, 'high': close, 'low': close, 'close': close,
+                                            'volume': 1e6}, index=index)
+
+    class Rebalance(bt.Strategy):
+        params = (('use_book', True),)
+
+        def __init__(self):
+            self.book = PortfolioBook(self)
+            self.exposures = []
+            self.seconds = 0.0                  # 只统计计算总仓位的时间，Backtrader 本身的开销不算
+
+        def notify_order(self, order):
+            self.book.on_order(order)
+
+        def next(self):
+            start = time.perf_counter()
+            if self.p.use_book:
+                self.book.mark()
+                exposure = self.book.exposure
+            else:
+                exposure = sum(self.getposition(d).size * d.close[0] for d in self.datas)
+            self.seconds += time.perf_counter() - start
+            self.exposures.append(exposure)
+            if len(self) % 20 == 1:             # 每 20 天随机换一批持仓
+                for i in rng.choice(len(self.datas), 10, replace=False):
+                    self.order_target_size(data=self.datas[i], target=int(rng.integers(0, 50)))
+
+    for use_book in (False, True):
+        rng = np.random.default_rng(1)
+        cerebro = bt.Cerebro(stdstats=False)
+        for name, df in frames.items():
+            cerebro.adddata(NumpyData.from_dataframe(df), name=name)
+        cerebro.broker.setcash(1e7)
+        cerebro.addstrategy(Rebalance, use_book=use_book)
+        strat = cerebro.run()[0]
+        print(f"use_book={use_book}: {n_assets} 只股票 x {n_bars} 根K线, 计算总仓位用时 {strat.seconds:.3f}秒, "
+              f"最终总仓位 {strat.exposures[-1]:.2f}")
+
+    sizes = np.array([strat.getposition(d).size for d in strat.datas])
+    print(f"数组持仓和 broker 持仓一致: {np.array_equal(sizes, strat.book.size)}")
+    print(strat.book.to_frame().query('size != 0').head())
+
+    # 目标权重调仓：每 20 天选 20 日涨幅前 30 只等权持有
+    class TopN(bt.Strategy):
+        def __init__(self):
+            self.book = PortfolioBook(self)
+            self.orders = 0
+
+        def notify_order(self, order):
+            self.book.on_order(order)
+
+        def next(self):
+            if len(self) % 20 != 1 or len(self) < 21:
+                return
+            momentum = np.array([d.close[0] / d.close[-20] for d in self.datas])
+            weights = np.zeros(len(self.datas))
+            weights[np.argsort(-momentum)[:30]] = 0.95 / 30
+            self.orders += len(self.book.rebalance(weights, cash_buffer=0.01, min_trade_pct=0.002))
+
+    cerebro = bt.Cerebro(stdstats=False)
+    for name, df in frames.items():
+        cerebro.adddata(NumpyData.from_dataframe(df), name=name)
+    cerebro.broker.setcash(1e6)
+    cerebro.broker.setcommission(commission=0.001)
+    cerebro.addstrategy(TopN)
+    strat = cerebro.run()[0]
+    print(f"Top30 轮动: {strat.orders} 笔订单, 最终资金 {cerebro.broker.getvalue():.2f}, "
+          f"持仓 {int((strat.book.size != 0).sum())} 只")
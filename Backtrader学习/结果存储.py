@@ -0,0 +1,196 @@
+'''
+参数优化结果存储：
+
+多因子学习 第5天 要等 3645 组全部跑完才写 Excel，跑到一半崩了就全没了；
+第6天、第20天 每次写一个一次性的 CSV，不同批次的结果没法一起比较。
+
+这里把每组跑完的结果（参数、分析器指标、用时）马上追加到磁盘上的 Parquet 列式文件：
+    results/
+        sweep=第5天_多因子权重/part-....parquet
+        sweep=第20天_MACD/part-....parquet
+- 每个 sweep（一次参数优化）一个目录，每次 flush 写一个小 part 文件，compact() 合并成一个
+- 重新运行同一个 sweep 时，已经存在的参数组合会被跳过（断点续跑）
+- 读取时只读需要的列，可以跨 sweep 筛选、排名
+
+需要 pyarrow（pandas 读写 parquet 用）。
+'''
+
+import os
+import re
+import glob
+import json
+import time
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+
+from 回测工具 import expand_grid, iter_many
+
+
+def param_key(params):
+    """
+    参数字典 -> 唯一字符串，用来判断这组参数是否已经跑过
+    numpy 数值先转成 Python 数值，浮点数保留 10 位小数，避免 np.arange 的尾数误差
+    """
+    clean = {}
+    for k, v in params.items():
+        if isinstance(v, np.generic):
+            v = v.item()
+        if isinstance(v, float):
+            v = round(v, 10)
+        clean[k] = v
+    return json.dumps(clean, sort_keys=True, ensure_ascii=False, default=str)
+
+
+class SweepStore:
+    """一次参数优化（sweep）的结果表，边跑边写，可断点续跑"""
+
+    def __init__(self, root='./results', sweep='default', flush_every=20):
+        self.root = root
+        self.sweep = sweep
+        self.flush_every = flush_every      # 攒多少条写一次盘，崩溃最多丢这么多条
+        self.dir = os.path.join(root, f"sweep={sweep}")
+        os.makedirs(self.dir, exist_ok=True)
+        self._buffer = []
+        self._done = set(self.load(columns=['param_key'])['param_key']) if self._parts() else set()
+
+    # ---------- 写入 ----------
+    def pending(self, param_list):
+        """过滤掉已经存在的参数组合，返回还没跑的"""
+        return [p for p in param_list if param_key(p) not in self._done]
+
+    def append(self, params, metrics):
+        """追加一条结果：params 是参数网格里的那几个参数，metrics 是指标（可以包含全部策略参数）"""
+        key = param_key(params)
+        row = {'sweep': self.sweep, 'param_key': key, 'finished_at': pd.Timestamp.now()}
+        row.update(metrics)
+        self._buffer.append(row)
+        self._done.add(key)
+        if len(self._buffer) >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        """把缓冲区写成一个新的 part 文件"""
+        if not self._buffer:
+            return
+        df = pd.DataFrame(self._buffer)
+        name = f"part-{time.time_ns()}-{os.getpid()}.parquet"
+        tmp = os.path.join(self.dir, name + '.tmp')
+        df.to_parquet(tmp, index=False)
+        os.replace(tmp, os.path.join(self.dir, name))     # 先写临时文件再改名，避免写一半的坏文件
+        self._buffer = []
+
+    def compact(self):
+        """把所有 part 文件合并成一个，part 太多时读起来会慢"""
+        self.flush()
+        parts = self._parts()
+        if len(parts) <= 1:
+            return
+        df = self.load()
+        name = f"part-{time.time_ns()}-{os.getpid()}.parquet"
+        tmp = os.path.join(self.dir, name + '.tmp')
+        df.to_parquet(tmp, index=False)
+        os.replace(tmp, os.path.join(self.dir, name))
+        for f in parts:
+            os.remove(f)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.flush()
+
+    # ---------- 读取 ----------
+    def _parts(self):
+        return sorted(glob.glob(os.path.join(self.dir, 'part-*.parquet')))
+
+    def load(self, columns=None):
+        """读取本 sweep 的全部结果（加上还没写盘的缓冲区）"""
+        frames = [_read_part(f, columns) for f in self._parts()]
+        if self._buffer:
+            buf = pd.DataFrame(self._buffer)
+            frames.append(buf[[c for c in columns if c in buf]] if columns else buf)
+        return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=columns)
+
+    def __len__(self):
+        return len(self._done)
+
+
+def _read_part(path, columns=None):
+    """读一个 part 文件；只读存在的列，不同批次的列可能不完全一样"""
+    if columns is None:
+        return pd.read_parquet(path)
+    names = pq.read_schema(path).names
+    return pd.read_parquet(path, columns=[c for c in columns if c in names])
+
+
+def query(root='./results', sweeps=None, where=None, columns=None, sort_by=None, ascending=False, top=None):
+    """
+    跨 sweep 查询结果
+    - sweeps: sweep 名称列表，None 表示全部
+    - where: pandas query 表达式，例如 "sharpe > 1 and max_drawdown < 20"
+    - columns: 只读这些列（where 和 sort_by 用到的列会自动加上）
+    - sort_by / ascending / top: 按某个指标排名，取前 top 条
+    """
+    dirs = sorted(glob.glob(os.path.join(root, 'sweep=*')))
+    if sweeps is not None:
+        dirs = [d for d in dirs if os.path.basename(d)[len('sweep='):] in sweeps]
+
+    need = None
+    if columns is not None:
+        need = list(dict.fromkeys(['sweep', *columns, *([sort_by] if sort_by else [])]))
+        if where:
+            # where 里出现的列名也要读进来
+            tokens = set(re.findall(r'[A-Za-z_一-鿿][\w一-鿿]*', where))
+            need += [t for t in tokens if t not in need]
+
+    frames = [_read_part(f, need) for d in dirs for f in sorted(glob.glob(os.path.join(d, 'part-*.parquet')))]
+    if not frames:
+        return pd.DataFrame()
+    df = pd.concat(frames, ignore_index=True)
+    if where:
+        df = df.query(where)
+    if sort_by:
+        df = df.sort_values(by=sort_by, ascending=ascending)
+    if top:
+        df = df.head(top)
+    if columns is not None:
+        df = df[[c for c in ['sweep', *columns] if c in df]]
+    return df.reset_index(drop=True)
+
+
+def run_sweep(strategy, grid, datas, store, maxcpus=None, **broker_kw):
+    """
+    用 SweepStore 跑一次参数优化：跳过已经跑过的参数，每跑完一组马上追加到结果表
+    判断是否跑过用的是策略的全部参数（网格参数 + 默认值），所以换一个网格也能复用以前的结果
+    返回本 sweep 的完整结果（包括以前跑过的）
+    """
+    defaults = dict(strategy.params._getitems())
+    param_list = expand_grid(grid)
+    todo = [p for p in param_list if store.pending([{**defaults, **p}])]
+    print(f"{store.sweep}: 共 {len(param_list)} 组参数, 已完成 {len(param_list) - len(todo)} 组, 本次运行 {len(todo)} 组")
+    with store:
+        for i, row in enumerate(iter_many(strategy, todo, datas, maxcpus=maxcpus, **broker_kw), 1):
+            store.append({k: row[k] for k in defaults}, row)
+            if i % 100 == 0:
+                print(f"  已完成 {i}/{len(todo)}")
+    return store.load()
+
+
+if __name__ == '__main__':
+    # 用 第20天 的 MACD 网格演示：第一次全部运行，第二次运行时会全部跳过
+    from 第14天 import MACD_strategy
+    from 回测工具 import load_csv
+
+    grid = dict(fast=range(10, 17, 2), slow=range(20, 31, 5), signal=range(6, 13, 3))
+    datas = {'BABA': load_csv('./BABA_year_data.csv')}
+
+    for _ in range(2):
+        store = SweepStore('./results', sweep='第20天_MACD')
+        df = run_sweep(MACD_strategy, grid, datas, store, cash=10000, commission=0.01, stake=10)
+    store.compact()
+
+    # sharpe 是 回测工具.DailySharpe 的日频年化夏普，一年以内的数据也有值
+    print(query('./results', where='sharpe > 0', columns=['fast', 'slow', 'signal', 'sharpe', 'final_value'],
+                sort_by='sharpe', top=5))
@@ -0,0 +1,109 @@
+'''
+逐步减半搜索（Successive Halving）：
+
+网格太大的时候（多因子学习 第5天 有 3645 组，第14天 有 1890 组），全部跑完整段历史太慢。
+做法：
+    1. 所有候选参数先只在一小段历史前缀上回测；
+    2. 按夏普/收益排名，只保留前 1/eta；
+    3. 留下来的参数换更长的历史窗口再跑，如此重复，最后一轮用完整历史。
+这样大部分差参数只在很短的数据上跑过，总计算量只有全网格的一小部分。
+
+说明：
+    Backtrader 不能把跑到一半的回测保存下来接着跑，所以每一轮都从头回测新的窗口。
+    能复用的是数据本身：窗口是同一个 DataFrame 的切片视图，进程池里的数据每个进程只传一次；
+    已经在完整历史上跑过的参数不会重复跑。
+'''
+
+import math
+import time
+
+import numpy as np
+import pandas as pd
+
+from 回测工具 import load_csv, slice_datas, expand_grid, run_many
+
+
+def successive_halving(strategy, grid, datas, min_bars=60, eta=3, metric='sharpe',
+                       maxcpus=None, **broker_kw):
+    """
+    - strategy: 策略类（和 optstrategy 一样传类本身）
+    - grid: {参数名: 候选值}，写法与 cerebro.optstrategy 的关键字参数相同
+    - datas: {股票代码: DataFrame}
+    - min_bars: 第一轮使用的K线数量，需要大于指标的预热期
+    - eta: 每轮保留 1/eta 的候选
+    - metric: 排名指标，'sharpe' / 'rnorm100' / 'final_value' 等 extract_metrics 里的列
+              默认分析器的 sharpe 是日频年化夏普（DailySharpe），短前缀上也有值
+    - broker_kw: cash / commission / stake / analyzers，传给 build_cerebro
+    返回:
+    - best: 最后一轮的结果（完整历史），按 metric 从高到低排序
+    - history: 每一轮每个候选的结果，带 round 与 bars 列
+    """
+    candidates = expand_grid(grid)
+    total_bars = len(next(iter(datas.values())))
+
+    # 轮数：让最后一轮大约只剩 eta 个以内的候选
+    rounds = max(1, math.ceil(math.log(len(candidates), eta)))
+    # 每轮的窗口长度：从 min_bars 按几何级数增长到完整历史
+    # 历史很短时取整会出现重复的窗口长度，去重后轮数相应减少
+    budgets = np.geomspace(min(min_bars, total_bars), total_bars, rounds).astype(int)
+    budgets[-1] = total_bars
+    budgets = np.unique(budgets)
+    rounds = len(budgets)
+
+    history = []
+    full_runs = {}      # 已经在完整历史上跑过的参数 -> 结果
+    for r, bars in enumerate(budgets):
+        start = time.time()
+        todo = [p for p in candidates if bars < total_bars or _key(p) not in full_runs]
+        rows = run_many(strategy, todo, slice_datas(datas, bars), maxcpus=maxcpus, **broker_kw)
+        if bars == total_bars:
+            full_runs.update({_key(p): row for p, row in zip(todo, rows)})
+            rows = [full_runs[_key(p)] for p in candidates]
+
+        df = pd.DataFrame(rows)
+        df['round'] = r
+        df['bars'] = bars
+        df['param_index'] = range(len(candidates))
+        if df[metric].nunique() == 1 and df['final_value'].nunique() > 1:
+            # 指标在这段前缀上全部相同（例如都没有交易）但结果不同，排名实际只靠 final_value
+            print(f"警告: 第{r + 1}轮所有候选的 {metric} 都等于 {df[metric].iloc[0]}，排名退化为按 final_value")
+        df = df.sort_values(by=[metric, 'final_value'], ascending=False)
+        history.append(df)
+        print(f"第{r + 1}/{rounds}轮: {len(candidates)}组参数 x {bars}根K线, 用时 {time.time() - start:.2f}秒")
+
+        if r == len(budgets) - 1:
+            break
+        # 保留前 1/eta，至少留 1 个
+        keep = max(1, math.ceil(len(candidates) / eta))
+        candidates = [candidates[i] for i in df['param_index'].iloc[:keep]]
+
+    history = pd.concat(history, ignore_index=True)
+    best = history[history['round'] == history['round'].max()].reset_index(drop=True)
+    return best, history
+
+
+def _key(params):
+    """参数字典 -> 可以做字典键的元组"""
+    return tuple(sorted(params.items()))
+
+
+if __name__ == '__main__':
+    # 用 第14天 的 MACD 策略和参数网格（5*6*7*3*3 = 1890 组）做演示
+    from 第14天 import MACD_strategy
+
+    grid = dict(
+        fast=range(10, 15, 1),
+        slow=range(24, 30, 1),
+        signal=range(8, 15, 1),
+        take_profit=[0.05, 0.1, 0.5],
+        stop_loss=[0.02, 0.1, 0.2],
+    )
+    datas = {'BABA': load_csv('./BABA_year_data.csv')}
+
+    start = time.time()
+    best, history = successive_halving(MACD_strategy, grid, datas, min_bars=60, eta=3,
+                                       metric='sharpe', cash=10000, commission=0.01, stake=100)
+    print(f"\n逐步减半搜索完成, 总用时 {time.time() - start:.2f}秒, "
+          f"共回测 {history['bars'].sum()} 根K线 (全网格需要 {len(expand_grid(grid)) * len(datas['BABA'])} 根)")
+    print(best.head())
+    history.to_csv('./BABA_MACD_逐步减半结果.csv', index=False, encoding='utf-8-sig')
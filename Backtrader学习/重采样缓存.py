@@ -0,0 +1,174 @@
+'''
+多周期数据预计算（代替 cerebro.resampledata）：
+
+第17天 用 cerebro.resampledata(data, timeframe=bt.TimeFrame.Weeks) 生成周线，
+Backtrader 在 filter 链里一根一根日线地合成周线，每次回测、参数优化的每一组参数都要重新合成一遍。
+
+这里的做法：
+    1. 按周期边界（周 / 月 / 季 / 年，或者分钟线 -> 日线）分组，用 pandas groupby 一次算出 OHLCV；
+    2. 结果存到源数据旁边的 .resample_cache/ 目录（.npy 格式，源文件更新后自动重算），
+       同一个进程里还有一份内存缓存；
+    3. 直接作为 NumpyData 数据源加进 Cerebro，回测时不再有合成的开销。
+
+对齐方式 align：
+    - 'next'（默认）：和 resampledata 一样，一周的K线要等到下一周第一根日线才出现
+      （Backtrader 看到下一根K线才知道这一周结束了），回测结果和 resampledata 相同；
+      这时周线的日期是下一周第一个交易日，最后一周在最后一根日线之后 1 秒出现。
+    - 'close'：在这一周最后一根日线收盘时就出现，日期就是最后一个交易日，比 resampledata 早一根K线。
+
+用法：
+    cerebro.adddata(NumpyData.from_dataframe(df))
+    add_resampled(cerebro, './ALHC_year_data.csv', bt.TimeFrame.Weeks)    # 代替 resampledata
+'''
+
+import os
+import time
+
+import numpy as np
+import pandas as pd
+import backtrader as bt
+
+from 数组数据源 import NumpyData, frame_to_arrays, save_arrays, load_arrays
+
+
+# Backtrader 周期 -> pandas 的周期代码
+PERIODS = {
+    bt.TimeFrame.Days: 'D',
+    bt.TimeFrame.Weeks: 'W',
+    bt.TimeFrame.Months: 'M',
+    bt.TimeFrame.Years: 'Y',
+}
+# 季度在 Backtrader 里没有单独的周期，用字符串 'Q' 表示
+TIMEFRAMES = {v: k for k, v in PERIODS.items()}
+TIMEFRAMES['Q'] = bt.TimeFrame.Months
+
+_memory = {}
+
+
+def _period_code(timeframe):
+    return timeframe if isinstance(timeframe, str) else PERIODS[timeframe]
+
+
+def resample_frame(df, timeframe=bt.TimeFrame.Weeks, align='next'):
+    """
+    把日线（或分钟线）DataFrame 合成成大周期K线
+    - timeframe: bt.TimeFrame.Days / Weeks / Months / Years，或者 'D' / 'W' / 'M' / 'Q' / 'Y'
+    - align: 见模块说明
+    返回以K线出现时间为索引的 DataFrame（open/high/low/close/volume，有 openinterest 时也保留）
+    """
+    df = df.sort_index()
+    cols = {str(c).lower(): c for c in df.columns}
+    keys = df.index.to_period(_period_code(timeframe))
+    groups = df.groupby(keys, sort=True)
+
+    agg = {'open': 'first', 'high': 'max', 'low': 'min', 'close': 'last', 'volume': 'sum', 'openinterest': 'last'}
+    out = groups.agg({cols[k]: how for k, how in agg.items() if k in cols})
+    out.columns = [str(c).lower() for c in out.columns]
+
+    # 每组最后一根K线的时间，以及它在原数据里的位置
+    last_pos = np.flatnonzero(np.r_[keys[1:] != keys[:-1], True])
+    if align == 'close':
+        out.index = df.index[last_pos]
+    elif align == 'next':
+        nxt = last_pos[:-1] + 1
+        stamps = list(df.index[nxt]) + [df.index[-1] + pd.Timedelta(seconds=1)]
+        out.index = pd.DatetimeIndex(stamps)
+    else:
+        raise ValueError(f"不支持的 align: {align}")
+    out.index.name = df.index.name
+    return out
+
+
+def _cache_dir(path, timeframe, align):
+    folder, name = os.path.split(os.path.abspath(path))
+    stem = os.path.splitext(name)[0]
+    return os.path.join(folder, '.resample_cache', f"{stem}.{_period_code(timeframe)}.{align}")
+
+
+def _frame_key(df):
+    """
+    DataFrame 的内容指纹：逐行哈希（含索引）求和，再加上行数和首尾时间
+    不用 id(df)：对象释放后 id 会被新的 DataFrame 复用，会取到别的数据的缓存
+    """
+    if df.empty:
+        return (0, 0)
+    return (int(pd.util.hash_pandas_object(df, index=True).sum()), len(df), df.index[0], df.index[-1])
+
+
+def load_resampled(source, timeframe=bt.TimeFrame.Weeks, align='next', loader=None):
+    """
+    返回 {line 名: 数组}，可以直接交给 NumpyData
+    - source: 数据文件路径（结果缓存到磁盘）或 DataFrame（只在内存里缓存，按内容识别）
+    - loader: 读取 source 文件的函数，默认 回测工具.load_csv
+    """
+    if isinstance(source, pd.DataFrame):
+        key = (_frame_key(source), _period_code(timeframe), align)
+        if key not in _memory:
+            _memory[key] = frame_to_arrays(resample_frame(source, timeframe, align))
+        return _memory[key]
+
+    cache = _cache_dir(source, timeframe, align)
+    mtime = os.path.getmtime(source)
+    key = (os.path.abspath(source), mtime, _period_code(timeframe), align)
+    if key in _memory:
+        return _memory[key]
+
+    if os.path.isdir(cache) and os.path.getmtime(cache) >= mtime:
+        arrays = load_arrays(cache, mmap=False)
+    else:
+        if loader is None:
+            from 回测工具 import load_csv as loader
+        resampled = resample_frame(loader(source), timeframe, align)
+        save_arrays(resampled, cache)
+        os.utime(cache)     # 目录时间作为缓存生成时间
+        arrays = frame_to_arrays(resampled)
+    _memory[key] = arrays
+    return arrays
+
+
+def resampled_feed(source, timeframe=bt.TimeFrame.Weeks, align='next', loader=None, **kwargs):
+    """返回已经合成好的大周期数据源（NumpyData），kwargs 传给数据源，例如 name、fromdate"""
+    timeframe_bt = TIMEFRAMES[timeframe] if isinstance(timeframe, str) else timeframe
+    compression = 3 if timeframe == 'Q' else 1
+    return NumpyData(dataname=load_resampled(source, timeframe, align, loader),
+                     timeframe=timeframe_bt, compression=compression, **kwargs)
+
+
+def add_resampled(cerebro, source, timeframe=bt.TimeFrame.Weeks, align='next', loader=None, name=None):
+    """代替 cerebro.resampledata(data, timeframe=...)，返回加进去的数据源"""
+    data = resampled_feed(source, timeframe, align, loader)
+    cerebro.adddata(data, name=name)
+    return data
+
+
+if __name__ == '__main__':
+    from 回测工具 import load_csv
+    from 第17天 import MultiTimeFrameStrategy
+
+    path = './ALHC_year_data.csv'
+    df = load_csv(path)
+
+    # 第17天 的多周期策略：resampledata 和 预计算周线 对比
+    def run(use_cache, align='next'):
+        cerebro = bt.Cerebro(stdstats=False)
+        cerebro.addstrategy(MultiTimeFrameStrategy)
+        data = NumpyData.from_dataframe(df)
+        cerebro.adddata(data)
+        if use_cache:
+            add_resampled(cerebro, path, bt.TimeFrame.Weeks, align=align)
+        else:
+            cerebro.resampledata(data, timeframe=bt.TimeFrame.Weeks)
+        cerebro.broker.setcash(100000)
+        cerebro.broker.setcommission(commission=0.01)
+        cerebro.addsizer(bt.sizers.FixedSize, stake=10)
+        start = time.time()
+        for _ in range(20):             # 模拟 20 组参数
+            cerebro.run()
+        return cerebro.broker.getvalue(), time.time() - start
+
+    for label, args in [('resampledata', (False,)), ("预计算 align='next'", (True, 'next')),
+                        ("预计算 align='close'", (True, 'close'))]:
+        value, seconds = run(*args)
+        print(f"{label}: 最终资金 {value:.2f}, 20 次回测用时 {seconds:.3f}秒")
+
+    print(resample_frame(df, bt.TimeFrame.Months, align='close').tail())
@@ -0,0 +1,208 @@
+'''
+流式分位数草图（VaR / CVaR 用）：
+
+第6天 的 calculate_risk 和 第7天 的 risk_analysis 都是把全部损益放进一个数组再 np.percentile，
+情景数受内存限制（1 亿个 float64 就是 800MB），多个进程各自模拟的结果也只能把数组传回来拼起来。
+
+QuantileSketch 是一个按对数分桶的直方图（和 DDSketch 的思路一样）：
+    - 桶 i 覆盖 |x| ∈ (γ^(i-1), γ^i]，γ = (1 + α) / (1 - α)；正数、负数各一组桶，绝对值太小的记在零桶
+      每个桶内任何值和桶的代表值相对误差不超过 α（默认 0.1%），所以分位数的相对误差 <= α
+    - 桶的范围固定（默认 |x| 在 1e-9 ~ 1e12），数组大小固定，内存和数据量无关；超出范围的值记在两端的桶
+    - 每个桶同时记录个数和数值之和：均值精确，CVaR（尾部均值）只有跨界那一个桶有误差
+    - 合并两个草图就是桶数组相加，不同进程、不同块的结果可以随意合并，和一次性处理的结果完全一样
+    - update 一次处理一整块数据（np.bincount），1 亿个数据点几秒钟
+
+用法：
+    sketch = QuantileSketch()
+    for chunk in pnl_chunks:
+        sketch.update(chunk)
+    sketch.merge(other_sketch)                     # 其它进程的结果
+    sketch.quantile([0.01, 0.05])
+    sketch.var_cvar((0.95, 0.99, 0.999))           # 和 风险引擎.var_cvar 的格式一样
+'''
+
+import time
+
+import numpy as np
+
+
+class QuantileSketch:
+    """
+    - relative_accuracy: 分位数的相对误差上限 α
+    - value_range: 能区分的绝对值范围 (最小, 最大)；绝对值小于最小值的记为 0
+    """
+
+    def __init__(self, relative_accuracy=0.001, value_range=(1e-9, 1e12)):
+        self.relative_accuracy = relative_accuracy
+        self.value_range = value_range
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = np.log(self.gamma)
+        self._offset = int(np.ceil(np.log(value_range[0]) / self._log_gamma))
+        size = int(np.ceil(np.log(value_range[1]) / self._log_gamma)) - self._offset + 1
+        # 正数、负数两组桶：[个数, 和]；零桶单独记
+        self._counts = np.zeros((2, size))
+        self._sums = np.zeros((2, size))
+        self._zero = np.zeros(2)                       # [个数, 和]
+        self.count = 0
+        self.min = np.inf
+        self.max = -np.inf
+
+    def __len__(self):
+        return int(self.count)
+
+    def __repr__(self):
+        return f"QuantileSketch(α={self.relative_accuracy}, {self.count:,.0f} 个数据, {self.nbytes / 1024:.0f}KB)"
+
+    @property
+    def nbytes(self):
+        return self._counts.nbytes + self._sums.nbytes
+
+    # ---------- 写入 ----------
+    def _keys(self, magnitude):
+        keys = np.ceil(np.log(magnitude) / self._log_gamma).astype(np.int64) - self._offset
+        return np.clip(keys, 0, self._counts.shape[1] - 1)
+
+    def update(self, values):
+        """加入一块数据（数组），返回自己，可以链式调用"""
+        values = np.asarray(values, float).ravel()
+        values = values[~np.isnan(values)]
+        if not len(values):
+            return self
+        size = self._counts.shape[1]
+        magnitude = np.abs(values)
+        small = magnitude < self.value_range[0]
+        self._zero += [small.sum(), values[small].sum()]
+        for side, mask in enumerate((values > 0, values < 0)):
+            mask &= ~small
+            keys = self._keys(magnitude[mask])
+            self._counts[side] += np.bincount(keys, minlength=size)
+            self._sums[side] += np.bincount(keys, weights=values[mask], minlength=size)
+        self.count += len(values)
+        self.min = min(self.min, values.min())
+        self.max = max(self.max, values.max())
+        return self
+
+    def merge(self, other):
+        """合并另一个草图（参数必须相同），返回自己"""
+        if (other.relative_accuracy, other.value_range) != (self.relative_accuracy, self.value_range):
+            raise ValueError('只能合并参数相同的 QuantileSketch')
+        self._counts += other._counts
+        self._sums += other._sums
+        self._zero += other._zero
+        self.count += other.count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+
+    @classmethod
+    def merged(cls, sketches):
+        """把一组草图合并成一个新的"""
+        sketches = list(sketches)
+        result = cls(sketches[0].relative_accuracy, sketches[0].value_range)
+        for sketch in sketches:
+            result.merge(sketch)
+        return result
+
+    # ---------- 查询 ----------
+    def _buckets(self):
+        """按数值从小到大排列的所有非空桶：(代表值, 个数, 和)"""
+        keys = np.arange(self._counts.shape[1]) + self._offset
+        # 桶 (γ^(i-1), γ^i] 的代表值 2γ^i / (γ + 1)，和桶内任何值的相对误差都不超过 α
+        values = 2 * self.gamma ** keys / (self.gamma + 1)
+        rep = np.concatenate([-values[::-1], [0.0], values])
+        counts = np.concatenate([self._counts[1][::-1], [self._zero[0]], self._counts[0]])
+        sums = np.concatenate([self._sums[1][::-1], [self._zero[1]], self._sums[0]])
+        keep = counts > 0
+        return np.clip(rep[keep], self.min, self.max), counts[keep], sums[keep]
+
+    def quantile(self, q):
+        """分位数（q 可以是数组），按排名 q * (count - 1) 所在的桶取代表值"""
+        q = np.asarray(q, float)
+        if not self.count:
+            return np.full(q.shape, np.nan) if q.ndim else np.nan
+        rep, counts, _ = self._buckets()
+        rank = q * (self.count - 1)
+        result = rep[np.minimum(np.searchsorted(np.cumsum(counts), rank, side='right'), len(rep) - 1)]
+        return result if result.ndim else float(result)
+
+    def mean(self):
+        return (self._sums.sum() + self._zero[1]) / self.count if self.count else np.nan
+
+    def tail_mean(self, q):
+        """最小的 q 比例数据的均值（CVaR 用）：整桶用精确的和，跨界的桶按桶内均值折算"""
+        if not self.count:
+            return np.nan
+        _, counts, sums = self._buckets()
+        k = max(q * self.count, 1.0)
+        cum = np.cumsum(counts)
+        i = min(int(np.searchsorted(cum, k, side='left')), len(counts) - 1)
+        before = cum[i - 1] if i else 0.0
+        total = sums[:i].sum() + (k - before) * sums[i] / counts[i]
+        return total / k
+
+    def var_cvar(self, levels=(0.95, 0.99)):
+        """各个置信水平的 VaR 和 CVaR（正数表示损失），格式和 风险引擎.var_cvar 一样"""
+        metrics = {}
+        for level in levels:
+            label = f"{level * 100:g}%"
+            metrics[f"{label} VaR"] = -self.quantile(1 - level)
+            metrics[f"{label} CVaR"] = -self.tail_mean(1 - level)
+        return metrics
+
+    def histogram(self, bins=50, limits=None):
+        """按桶计数近似的直方图：(各区间个数, 区间边界)，可以直接画图"""
+        rep, counts, _ = self._buckets()
+        lo, hi = limits if limits is not None else (self.quantile(0.0005), self.quantile(0.9995))
+        return np.histogram(rep, bins=bins, range=(lo, hi), weights=counts)
+
+
+def _simulate_part(args):
+    """进程池里的任务：用一个种子模拟 n 个厚尾损益，只把草图传回去"""
+    n, seed, chunk = args
+    rng = np.random.default_rng(seed)
+    sketch = QuantileSketch()
+    for start in range(0, n, chunk):
+        sketch.update(rng.standard_t(4, min(chunk, n - start)) * 1000)
+    return sketch
+
+
+if __name__ == '__main__':
+    from concurrent.futures import ProcessPoolExecutor
+    from scipy.stats import t as student_t
+
+    # 1. 和精确计算对照：1000 万个 t 分布损益
+    rng = np.random.default_rng(0)
+    pnl = rng.standard_t(4, 10_000_000) * 1000
+    sketch = QuantileSketch()
+    start = time.time()
+    for chunk in np.array_split(pnl, 10):
+        sketch.update(chunk)
+    print(f"{sketch}, 写入用时 {time.time() - start:.2f}秒")
+    levels = (0.95, 0.99, 0.999, 0.9999)
+    exact = {}
+    for level in levels:
+        q = np.quantile(pnl, 1 - level)
+        exact[f"{level * 100:g}% VaR"], exact[f"{level * 100:g}% CVaR"] = -q, -pnl[pnl <= q].mean()
+    for name, value in sketch.var_cvar(levels).items():
+        print(f"  {name}: 草图 {value:,.2f}, 精确 {exact[name]:,.2f}, 相对误差 {value / exact[name] - 1:+.4%}")
+
+    # 2. 多进程各自模拟，草图合并
+    parts = [(2_000_000, seed, 1_000_000) for seed in range(4)]
+    with ProcessPoolExecutor(2) as pool:
+        merged = QuantileSketch.merged(pool.map(_simulate_part, parts))
+    single = QuantileSketch()
+    for part in parts:
+        single.merge(_simulate_part(part))
+    print(f"多进程合并 {merged.count:,.0f} 个数据, 和单进程结果相同: "
+          f"{np.array_equal(merged.quantile([0.001, 0.01, 0.5]), single.quantile([0.001, 0.01, 0.5]))}")
+
+    # 3. 1 亿个情景，内存不变，尾部估计随情景数收敛到理论值
+    true_var = -student_t.ppf(0.0001, 4) * 1000
+    sketch = QuantileSketch()
+    rng = np.random.default_rng(1)
+    start = time.time()
+    for i in range(100):
+        sketch.update(rng.standard_t(4, 1_000_000) * 1000)
+        if i + 1 in (1, 10, 100):
+            print(f"{sketch.count:>12,.0f} 个情景: 99.99% VaR {-sketch.quantile(0.0001):,.1f} "
+                  f"(理论值 {true_var:,.1f}), 草图 {sketch.nbytes / 1024:.0f}KB, 累计用时 {time.time() - start:.1f}秒")
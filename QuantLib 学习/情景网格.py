@@ -0,0 +1,401 @@
+'''
+情景网格（现价 x 波动率 x 利率 x 时间）：
+
+第5天 的敏感性分析是两个 for 循环：波动率取 [0.1, 0.2, 0.3, 0.5]、到期时间取 [0.25, 0.5, 1, 2]，
+每个点单独调用一次 black_scholes，而且只看一个合约、一次只动一个因子。
+期权簿.OptionBook.scenario_grid 也是一个情景一个情景地改报价、取 NPV，只有现价和波动率两个维度。
+
+ScenarioGrid 对整个组合（期权 + 债券）一次算完四个维度的笛卡尔积：
+    - spot: 标的价格相对变化（-0.1 即跌 10%，每个标的同比例变化）
+    - vol: 波动率绝对变化（0.05 即上升 5 个百分点）
+    - rate: 无风险利率绝对变化（0.01 即 +100bp，期权和债券一起动）
+    - days: 经过的自然日（整数，时间衰减；期权剩余期限减少、债券持有期内的现金流按现金计；负数表示往回推）
+结果是带坐标的 4 维数组 LabeledGrid（sel 按标签取切片，to_frame 转成表格）
+
+计算方式：
+    - 欧式期权：Black-Scholes 按 (现价, 波动率, 利率, 时间) 广播，逐个合约累加，临时数组只有一个网格大小
+      ln(S/K)、σ√T、贴现因子都先在低维上算好，高维上只剩几次乘加和两次 N(x)；
+      网格时间超过到期日的部分只有内在价值，直接跳过
+      相同 (标的, 执行价, 期限, 波动率) 的看涨看跌合并：看跌按平价公式 P = C - S·e^(-qT) + K·e^(-rT)，
+      平价那两项只和 (现价, 时间)、(利率, 时间) 有关，所以看跌期权几乎不增加计算量
+    - 债券：和 风险引擎.RiskEngine 一样，由价格反解收益率，情景下收益率 + 利率变化，只和 (利率, 时间) 有关
+    - 奇异期权（障碍期权、美式期权、或者任何 QuantLib 合约）：没有解析的广播公式，回退到 QuantLib，
+      报价都是 SimpleQuote，逐个情景 setValue 再取 NPV（和 期权簿 一样不重建对象），时间维度改 evaluationDate；
+      这部分的耗时和情景数成正比，网格大时应该放到更小的网格上单独算
+50 x 20 x 10 x 10 的网格（10 万个情景）、300 个欧式期权加一组债券，1 秒左右；耗时基本都在 N(x) 上，和合约数成正比
+
+用法：
+    grid = ScenarioGrid(r=0.04, today=ql.Date(26, 11, 2025))
+    grid.add_underlying('AAPL', spot=277.0)
+    grid.add_chain('AAPL', chain)
+    grid.add_bond('Note 5-Year', *treasury_cashflows('2025-09-30', '2030-09-30', 0.0363), price=99.6, notional=1000)
+    pnl = grid.pnl(spot=np.linspace(-0.3, 0.3, 50), vol=np.linspace(-0.1, 0.1, 20),
+                   rate=np.linspace(-0.02, 0.02, 10), days=range(0, 50, 5))
+    pnl.sel(rate=0, days=0).to_frame()             # 现价 x 波动率 的损益表
+    pnl.worst()                                    # 最差的情景
+'''
+
+import time
+
+import numpy as np
+import pandas as pd
+import QuantLib as ql
+from scipy.special import ndtr
+
+from 期权分析 import is_call
+from 期权簿 import to_ql_date
+from 风险引擎 import bond_yield
+
+AXES = ('spot', 'vol', 'rate', 'days')
+
+
+# ================= 带坐标的数组 =================
+class LabeledGrid:
+    """
+    带坐标的 N 维数组（xarray.DataArray 的简化版）
+    - values: ndarray；coords: {维度名: 坐标数组}，顺序和 values 的维度一致
+    """
+
+    def __init__(self, values, coords, name='PnL'):
+        self.values = np.asarray(values, float)
+        self.coords = {dim: np.asarray(c) for dim, c in coords.items()}
+        self.name = name
+        if self.values.shape != tuple(len(c) for c in self.coords.values()):
+            raise ValueError(f"数组形状 {self.values.shape} 和坐标 {self.dims} 不一致")
+
+    def __repr__(self):
+        axes = ', '.join(f"{dim}: {len(c)}" for dim, c in self.coords.items())
+        return f"LabeledGrid({self.name}, {axes})"
+
+    @property
+    def dims(self):
+        return tuple(self.coords)
+
+    @property
+    def shape(self):
+        return self.values.shape
+
+    def _position(self, dim, label):
+        """离 label 最近的坐标的下标"""
+        return int(np.abs(self.coords[dim].astype(float) - label).argmin())
+
+    def isel(self, **indices):
+        """按下标取切片：整数下标的维度去掉，slice 的维度保留；所有维度都取完时返回 float"""
+        index = tuple(indices.get(dim, slice(None)) for dim in self.dims)
+        values = self.values[index]
+        if values.ndim == 0:
+            return float(values)
+        coords = {dim: c[i] for (dim, c), i in zip(self.coords.items(), index) if isinstance(i, slice)}
+        return LabeledGrid(values, coords, self.name)
+
+    def sel(self, **labels):
+        """按坐标取切片（取最近的坐标）：grid.sel(rate=0, days=0)"""
+        return self.isel(**{dim: self._position(dim, label) for dim, label in labels.items()})
+
+    def sum(self, dim):
+        axis = self.dims.index(dim)
+        return LabeledGrid(self.values.sum(axis=axis), {d: c for d, c in self.coords.items() if d != dim}, self.name)
+
+    def worst(self):
+        """最小值和它所在的坐标"""
+        index = np.unravel_index(self.values.argmin(), self.shape)
+        return float(self.values[index]), {dim: c[i].item() for (dim, c), i in zip(self.coords.items(), index)}
+
+    def to_series(self):
+        index = pd.MultiIndex.from_product(list(self.coords.values()), names=self.dims)
+        return pd.Series(self.values.ravel(), index=index, name=self.name)
+
+    def to_frame(self):
+        """2 维的网格转成表格：行是第一个维度，列是第二个维度"""
+        if len(self.dims) != 2:
+            raise ValueError(f"to_frame 只支持 2 维，现在是 {self.dims}，先用 sel 取切片")
+        (rows, row_labels), (columns, column_labels) = self.coords.items()
+        return pd.DataFrame(self.values, index=pd.Index(row_labels, name=rows),
+                            columns=pd.Index(column_labels, name=columns))
+
+
+# ================= 奇异期权（QuantLib 回退） =================
+class _Exotic:
+    """一个用 QuantLib 定价的头寸：自己的波动率报价，共用标的的现价 / 股息率报价和网格的利率曲线"""
+
+    def __init__(self, name, symbol, instrument, sigma, units, vol_quote):
+        self.name, self.symbol = name, symbol
+        self.instrument, self.sigma, self.units = instrument, sigma, units
+        self.vol = vol_quote
+
+    def npv(self):
+        try:
+            return self.instrument.NPV() * self.units
+        except RuntimeError:
+            return np.nan
+
+
+# ================= 情景网格 =================
+class ScenarioGrid:
+    """
+    - r: 无风险利率（连续复利，期权和奇异期权贴现用；债券用各自价格反解的收益率）
+    - today: 估值日（奇异期权的到期日和时间衰减用），默认 QuantLib 的 evaluationDate
+    """
+
+    def __init__(self, r, today=None, day_counter=None, calendar=None):
+        self.r = float(r)
+        self.today = to_ql_date(today) if today is not None else ql.Settings.instance().evaluationDate
+        self.day_counter = day_counter or ql.Actual365Fixed()
+        self.calendar = calendar or ql.NullCalendar()
+        self.underlyings = {}
+        self.options = []
+        self.bonds = []
+        self.exotics = []
+        # 奇异期权共用的利率曲线（settlementDays = 0，随 evaluationDate 移动）
+        self._rate = ql.SimpleQuote(self.r)
+        self._rate_curve = ql.YieldTermStructureHandle(
+            ql.FlatForward(0, self.calendar, ql.QuoteHandle(self._rate), self.day_counter))
+
+    def __repr__(self):
+        return (f"ScenarioGrid({len(self.underlyings)} 个标的, {len(self.options)} 个欧式期权, "
+                f"{len(self.bonds)} 只债券, {len(self.exotics)} 个奇异期权)")
+
+    # ---------- 头寸 ----------
+    def add_underlying(self, symbol, spot, q=0.0):
+        spot_quote, dividend = ql.SimpleQuote(spot), ql.SimpleQuote(q)
+        self.underlyings[symbol] = {
+            'spot': float(spot), 'q': float(q), 'spot_quote': spot_quote,
+            'dividend_curve': ql.YieldTermStructureHandle(
+                ql.FlatForward(0, self.calendar, ql.QuoteHandle(dividend), self.day_counter))}
+
+    def add_option(self, symbol, strike, T, sigma, option_type='call', quantity=1.0, multiplier=100, name=None):
+        """欧式期权：T 到期年数（实际天数 / 365）；quantity 手数（每手 multiplier 股，负数是卖出）"""
+        self.options.append({'name': name or f"{symbol} {option_type} {strike:g} {T:.2f}y", 'symbol': symbol,
+                             'strike': float(strike), 'T': float(T), 'sigma': float(sigma),
+                             'is_call': bool(is_call(option_type)), 'units': quantity * multiplier})
+
+    def add_chain(self, symbol, chain, quantity=1.0, multiplier=100, sigma='impliedVolatility'):
+        """整条期权链（load_chain 的结果）：每个合约 quantity 手，quantity 也可以是和 chain 等长的数组"""
+        quantity = np.broadcast_to(np.asarray(quantity, float), len(chain))
+        for (_, row), qty in zip(chain.iterrows(), quantity):
+            self.add_option(symbol, row['strike'], row['T'], row[sigma], bool(row['is_call']), qty, multiplier,
+                            row.get('contractSymbol'))
+
+    def add_bond(self, name, times, cashflows, price, notional):
+        """times / cashflows: 每 100 面值的现金流；price: 每 100 面值的价格；notional: 面值"""
+        times, cashflows = np.asarray(times, float), np.asarray(cashflows, float)
+        self.bonds.append({'name': name, 'times': times, 'cashflows': cashflows, 'notional': notional,
+                           'yield': bond_yield(times, cashflows, price)})
+
+    def _expiry(self, T):
+        return self.today + int(round(T * 365))
+
+    def _process(self, symbol, vol_quote):
+        underlying = self.underlyings[symbol]
+        vol = ql.BlackVolTermStructureHandle(
+            ql.BlackConstantVol(0, self.calendar, ql.QuoteHandle(vol_quote), self.day_counter))
+        return ql.BlackScholesMertonProcess(ql.QuoteHandle(underlying['spot_quote']),
+                                            underlying['dividend_curve'], self._rate_curve, vol)
+
+    def add_exotic(self, symbol, instrument, engine, sigma, quantity=1.0, multiplier=100, name=None):
+        """
+        任意 QuantLib 合约：engine 是 process -> PricingEngine 的函数，process 挂在网格的报价上
+        sigma: 这个合约的（常数）波动率，波动率维度在它上面平移
+        """
+        vol_quote = ql.SimpleQuote(sigma)
+        instrument.setPricingEngine(engine(self._process(symbol, vol_quote)))
+        self.exotics.append(_Exotic(name or f"{symbol} {type(instrument).__name__}", symbol, instrument,
+                                    float(sigma), quantity * multiplier, vol_quote))
+
+    def add_barrier(self, symbol, strike, T, sigma, option_type, barrier, barrier_type='DownOut', rebate=0.0,
+                    quantity=1.0, multiplier=100, name=None):
+        """欧式障碍期权（解析公式）：barrier_type 是 'DownOut' / 'DownIn' / 'UpOut' / 'UpIn'"""
+        payoff = ql.PlainVanillaPayoff(ql.Option.Call if is_call(option_type) else ql.Option.Put, strike)
+        option = ql.BarrierOption(getattr(ql.Barrier, barrier_type), barrier, rebate, payoff,
+                                  ql.EuropeanExercise(self._expiry(T)))
+        self.add_exotic(symbol, option, ql.AnalyticBarrierEngine, sigma, quantity, multiplier,
+                        name or f"{symbol} {barrier_type} {option_type} {strike:g}/{barrier:g}")
+
+    def add_american(self, symbol, strike, T, sigma, option_type='put', quantity=1.0, multiplier=100, steps=200,
+                     name=None):
+        """美式期权（CRR 二叉树）"""
+        payoff = ql.PlainVanillaPayoff(ql.Option.Call if is_call(option_type) else ql.Option.Put, strike)
+        option = ql.VanillaOption(payoff, ql.AmericanExercise(self.today, self._expiry(T)))
+        self.add_exotic(symbol, option, lambda process: ql.BinomialVanillaEngine(process, 'crr', steps),
+                        sigma, quantity, multiplier, name or f"{symbol} 美式 {option_type} {strike:g}")
+
+    # ---------- 各类头寸的网格价值 ----------
+    def _option_arrays(self):
+        """同一 (标的, 执行价, 期限, 波动率) 的合约合并，看跌期权的单位单独记（平价公式用）"""
+        frame = pd.DataFrame(self.options)
+        frame['put_units'] = np.where(frame['is_call'], 0.0, frame['units'])
+        frame = frame.groupby(['symbol', 'strike', 'T', 'sigma'], sort=False)[['units', 'put_units']].sum()
+        frame = frame.reset_index()
+        spot = frame['symbol'].map(lambda s: self.underlyings[s]['spot']).to_numpy(float)
+        q = frame['symbol'].map(lambda s: self.underlyings[s]['q']).to_numpy(float)
+        return (spot, q, *(frame[c].to_numpy(float) for c in ('strike', 'T', 'sigma', 'units', 'put_units')))
+
+    def _option_values(self, spot_shifts, vol_shifts, rate_shifts, days):
+        """欧式期权组合在网格上的价值，形状 (现价, 波动率, 利率, 时间)"""
+        ns, nv, nr, nt = len(spot_shifts), len(vol_shifts), len(rate_shifts), len(days)
+        if not self.options:
+            return np.zeros((ns, nv, nr, nt))
+        # 内部按 (时间, 波动率, 利率, 现价) 排列：最长的现价维度在最里层，广播运算的内层循环长；
+        # 时间维度先排序，每个合约还没到期的是前面连续的一段，到期以后只剩内在价值，不用再算 N(x)
+        order = np.argsort(days, kind='stable')
+        days = days[order]
+        value = np.zeros((nt, nv, nr, ns))
+        S0, q, K, T, sigma, units, put_units = self._option_arrays()
+        S = S0[:, None] * (1 + spot_shifts)                                  # (合约, 现价)
+        log_moneyness = np.log(S / K[:, None])
+        remaining = T[:, None] - days / 365                                  # (合约, 时间)
+        live = (remaining > 0).sum(axis=1)
+        remaining = np.maximum(remaining, 0.0)
+        vols = np.maximum(sigma[:, None] + vol_shifts, 1e-8)                 # (合约, 波动率)
+        rates = self.r + rate_shifts
+        spot_carry = S[:, None, :] * np.exp(-q[:, None, None] * remaining[:, :, None])      # (合约, 时间, 现价)
+        strike_discount = K[:, None, None] * np.exp(-rates[None, None, :] * remaining[:, :, None])  # (合约, 时间, 利率)
+
+        # 看跌期权按平价公式当作看涨期权算，平价项只有 (时间, 现价)、(时间, 利率) 两个维度
+        value -= np.einsum('c,cts->ts', put_units, spot_carry)[:, None, None, :]
+        value += np.einsum('c,ctr->tr', put_units, strike_discount)[:, None, :, None]
+
+        d1_buffer = np.empty(value.shape)
+        d2_buffer = np.empty(value.shape)
+        for i in np.flatnonzero(units):
+            n = live[i]
+            if n < nt:                                                       # 到期以后：看涨期权的内在价值
+                value[n:] += units[i] * np.maximum(S[i] - K[i], 0.0)
+            if n == 0:
+                continue
+            d1, d2 = d1_buffer[:n], d2_buffer[:n]
+            total_vol = np.sqrt(remaining[i, :n, None]) * vols[i]                          # (时间, 波动率)
+            inverse = 1 / total_vol
+            drift = (rates - q[i]) * remaining[i, :n, None]                                # (时间, 利率)
+            # d1 = ln(S/K) / σ√T + [(r - q)T / σ√T + σ√T / 2]，d2 = d1 - σ√T
+            np.multiply(inverse[:, :, None, None], log_moneyness[i], out=d1)
+            d1 += (drift[:, None, :] * inverse[:, :, None] + 0.5 * total_vol[:, :, None])[..., None]
+            np.subtract(d1, total_vol[:, :, None, None], out=d2)
+            ndtr(d1, out=d1)
+            ndtr(d2, out=d2)
+            # 看涨期权价格 S·e^(-qT)·N(d1) - K·e^(-rT)·N(d2)
+            d1 *= (units[i] * spot_carry[i, :n])[:, None, None, :]
+            d2 *= (units[i] * strike_discount[i, :n])[:, None, :, None]
+            d1 -= d2
+            value[:n] += d1
+        result = np.empty((ns, nv, nr, nt))
+        result[..., order] = value.transpose(3, 1, 2, 0)
+        return result
+
+    def _bond_values(self, rate_shifts, days):
+        """债券组合在 (利率, 时间) 上的价值：未支付的现金流按 收益率 + 利率变化 贴现，已支付的按现金计"""
+        value = np.zeros((len(rate_shifts), len(days)))
+        horizon = days / 365
+        for b in self.bonds:
+            remaining = b['times'][:, None] - horizon                                # (现金流, 时间)
+            discount = np.exp(-(b['yield'] + rate_shifts)[:, None, None] * np.maximum(remaining, 0.0))
+            flows = np.where(remaining > 0, b['cashflows'][:, None] * discount, b['cashflows'][:, None])
+            value += flows.sum(axis=1) * b['notional'] / 100
+        return value
+
+    def _exotic_values(self, spot_shifts, vol_shifts, rate_shifts, days):
+        """奇异期权逐个情景改报价取 NPV；时间在最外层，evaluationDate 改的次数最少"""
+        value = np.zeros((len(spot_shifts), len(vol_shifts), len(rate_shifts), len(days)))
+        if not self.exotics:
+            return value
+        settings = ql.Settings.instance()
+        original = settings.evaluationDate
+        try:
+            for l, d in enumerate(days):
+                settings.evaluationDate = self.today + int(d)
+                for k, dr in enumerate(rate_shifts):
+                    self._rate.setValue(self.r + dr)
+                    for j, dv in enumerate(vol_shifts):
+                        for exotic in self.exotics:
+                            exotic.vol.setValue(max(exotic.sigma + dv, 1e-8))
+                        for i, ds in enumerate(spot_shifts):
+                            for underlying in self.underlyings.values():
+                                underlying['spot_quote'].setValue(underlying['spot'] * (1 + ds))
+                            value[i, j, k, l] = sum(exotic.npv() for exotic in self.exotics)
+        finally:
+            settings.evaluationDate = original
+            self._rate.setValue(self.r)
+            for exotic in self.exotics:
+                exotic.vol.setValue(exotic.sigma)
+            for underlying in self.underlyings.values():
+                underlying['spot_quote'].setValue(underlying['spot'])
+        return value
+
+    # ---------- 网格 ----------
+    def value(self, spot=(0.0,), vol=(0.0,), rate=(0.0,), days=(0,)):
+        """整个组合在 现价 x 波动率 x 利率 x 时间 网格上的价值，返回 LabeledGrid"""
+        axes = [np.asarray(spot, float), np.asarray(vol, float), np.asarray(rate, float),
+                np.asarray(days, float).round().astype(int)]
+        spot, vol, rate, days = axes
+        value = self._option_values(spot, vol, rate, days)
+        value += self._bond_values(rate, days)[None, None]
+        value += self._exotic_values(spot, vol, rate, days)
+        return LabeledGrid(value, dict(zip(AXES, axes)), name='Value')
+
+    def base_value(self):
+        """当前（所有变化都是 0）的组合价值"""
+        return self.value().values.item()
+
+    def pnl(self, spot=(0.0,), vol=(0.0,), rate=(0.0,), days=(0,)):
+        """网格上的损益 = 情景价值 - 当前价值"""
+        grid = self.value(spot, vol, rate, days)
+        return LabeledGrid(grid.values - self.base_value(), grid.coords, name='PnL')
+
+
+if __name__ == '__main__':
+    from 期权分析 import black_scholes, load_chain
+    from 风险引擎 import security_cashflows
+
+    prices = pd.read_excel('./AAPL_stock.xlsx')
+    spot = prices.sort_values('Date')['Close'].iloc[-1]
+    r = pd.read_excel('./US_Treasury_Yields.xlsx')['DGS10'].iloc[-1] / 100
+
+    # AAPL 期权链中执行价在现价 ±10% 以内、半个月以上到期的合约（约 300 个），买卖随机
+    chain = load_chain('./AAPL_options.xlsx')
+    chain = chain[(chain['T'] > 0.04) & chain['impliedVolatility'].between(0.05, 2.0)
+                  & (chain['strike'] / spot).between(0.9, 1.1)]
+    quantity = np.random.default_rng(0).integers(-5, 6, len(chain))
+
+    grid = ScenarioGrid(r, today=pd.Timestamp('2025-11-26'))
+    grid.add_underlying('AAPL', spot)
+    grid.add_chain('AAPL', chain, quantity)
+    securities = pd.read_csv('./Securities.csv').dropna(subset=['Price per $100'])
+    for _, bond in securities.drop_duplicates('Security Term').head(10).iterrows():
+        kind, times, cashflows = security_cashflows(bond)
+        if times is None:
+            print(f"跳过 {bond['CUSIP']} {bond['Security Term']}: 疑似 TIPS，不能按名义利率重估")
+            continue
+        grid.add_bond(f"{bond['Security Type']} {bond['Security Term']}" + (' FRN' if kind == 'frn' else ''),
+                      times, cashflows, bond['Price per $100'], 10_000)
+    print(grid, f"组合价值 ${grid.base_value():,.0f}")
+
+    # 1. 50 x 20 x 10 x 10 的网格
+    axes = dict(spot=np.linspace(-0.3, 0.3, 50), vol=np.linspace(-0.1, 0.1, 20),
+                rate=np.linspace(-0.02, 0.02, 10), days=np.arange(0, 50, 5))
+    start = time.time()
+    pnl = grid.pnl(**axes)
+    print(f"{pnl}, {pnl.values.size:,} 个情景, 用时 {time.time() - start:.2f}秒")
+    worst, where = pnl.worst()
+    print(f"最差情景 ${worst:,.0f}: {where}")
+    table = pnl.sel(rate=0, days=0).isel(spot=slice(None, None, 7), vol=slice(None, None, 5)).to_frame()
+    print(table.rename(index='{:+.0%}'.format, columns='{:+.1%}'.format).round(0))
+
+    # 2. 和逐个合约、逐个情景调用 black_scholes 对照
+    check = dict(spot=axes['spot'][7], vol=axes['vol'][3], rate=axes['rate'][8], days=axes['days'][4])
+    T = np.maximum(chain['T'].to_numpy() - check['days'] / 365, 0)
+    direct = black_scholes(spot * (1 + check['spot']), chain['strike'].to_numpy(), T, r + check['rate'],
+                           np.maximum(chain['impliedVolatility'].to_numpy() + check['vol'], 1e-8),
+                           chain['is_call'].to_numpy()) @ (quantity * 100.0)
+    direct += grid._bond_values(np.array([check['rate']]), np.array([check['days']])).item()
+    print(f"单点对照: 网格 ${pnl.sel(**check) + grid.base_value():,.4f}, 逐个计算 ${direct:,.4f}")
+
+    # 3. 奇异期权回退到 QuantLib（小网格）
+    exotic = ScenarioGrid(r, today=pd.Timestamp('2025-11-26'))
+    exotic.add_underlying('AAPL', spot)
+    exotic.add_barrier('AAPL', spot, 0.5, 0.3, 'call', spot * 1.3, 'UpOut', quantity=10)
+    exotic.add_american('AAPL', spot * 0.95, 0.5, 0.3, 'put', quantity=-5)
+    exotic.add_option('AAPL', spot, 0.5, 0.3, 'call', quantity=-10)
+    start = time.time()
+    small = exotic.pnl(spot=np.linspace(-0.2, 0.2, 9), vol=[-0.05, 0, 0.05], days=[0, 30])
+    print(f"{exotic}: {small.values.size} 个情景, 用时 {time.time() - start:.2f}秒")
+    print(small.sel(rate=0, days=0).to_frame().rename(index='{:+.0%}'.format, columns='{:+.0%}'.format).round(0))
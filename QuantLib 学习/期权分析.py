@@ -0,0 +1,235 @@
+'''
+期权分析工具（向量化 Black-Scholes）：
+
+第5天 的 black_scholes 用 math.log / sqrt / exp 和标量 norm.cdf，一次只能算一个合约，
+Delta、Gamma、Vega、Theta、Rho 又在外面对 first_row 单独写了一遍（看跌期权那几个还是 ...）。
+
+这里的函数全部接受 NumPy 数组（或者可以广播的标量），一次算完整条期权链：
+    - black_scholes: 只算价格
+    - bs_greeks: 价格 + 全部一阶、二阶希腊值，d1 / d2 / N(d1) / n(d1) / 贴现因子只算一次
+      一阶: delta, vega, theta, rho, psi（对股息率）
+      二阶: gamma, vanna(dDelta/dσ), volga(dVega/dσ), charm(dDelta/dt), veta(dVega/dt)
+    - load_chain: 读取 *_options.xlsx 的 Calls / Puts 两个 sheet，合成一张表并算好到期年数 T
+
+单位（和 QuantLib 一致，都是"每 1 单位"）：
+    vega / rho / psi 是波动率、利率变化 1（即 100%）时的价格变化，第5天 的写法是再除以 100；
+    theta / charm / veta 是每年的变化（时间流逝方向），每天要再除以 365。
+到期（T <= 0）的合约按内在价值处理，波动率为 0 时按远期的内在价值贴现。
+
+用法：
+    chain = load_chain('./TSLA_options.xlsx')
+    g = bs_greeks(S, chain['strike'], chain['T'], r, chain['impliedVolatility'], chain['is_call'])
+    g['delta'], g['gamma'] ...
+'''
+
+import os
+import time
+
+import numpy as np
+import pandas as pd
+from scipy.special import ndtr       # 标准正态分布函数，比 norm.cdf 少了参数检查的开销
+
+_SQRT_2PI = np.sqrt(2.0 * np.pi)
+
+GREEKS = ('price', 'delta', 'gamma', 'vega', 'theta', 'rho', 'psi', 'vanna', 'volga', 'charm', 'veta')
+
+
+# ================= 输入整理 =================
+def is_call(option_type):
+    """
+    把各种写法的期权类型统一成布尔数组（True = 看涨）
+    支持 'call' / 'calls' / 'Call' / 'C'、'put' / 'puts' / 'P'，字符串数组，或者已经是布尔值
+    """
+    values = np.asarray(option_type)
+    if values.dtype == bool:
+        return values
+    if values.ndim == 0:
+        return np.asarray(str(values).strip().lower().startswith('c'))
+    return np.char.startswith(np.char.lower(np.char.strip(values.astype(str))), 'c')
+
+
+def _arrays(S, K, T, r, sigma, option_type, q):
+    S, K, T, r, sigma, q = (np.asarray(x, dtype=float) for x in (S, K, T, r, sigma, q))
+    w = np.where(is_call(option_type), 1.0, -1.0)      # 看涨 +1，看跌 -1
+    return np.broadcast_arrays(S, K, T, r, sigma, q, w)
+
+
+def _pdf(x):
+    return np.exp(-0.5 * x * x) / _SQRT_2PI
+
+
+# ================= 定价 =================
+def black_scholes(S, K, T, r, sigma, option_type='call', q=0.0):
+    """
+    欧式期权 Black-Scholes(-Merton) 价格，参数和 第5天 的 black_scholes 一样，多了连续股息率 q
+    所有参数都可以是数组（互相广播），返回同样形状的价格数组；全是标量时返回 float
+    """
+    S, K, T, r, sigma, q, w = _arrays(S, K, T, r, sigma, option_type, q)
+    live = (T > 0) & (sigma > 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        tq, tr = np.exp(-q * T), np.exp(-r * T)
+        vol = sigma * np.sqrt(T)
+        d1 = (np.log(S / K) + (r - q) * T) / vol + 0.5 * vol
+        d1 = np.where(live, d1, 0.0)
+        price = w * (S * tq * ndtr(w * d1) - K * tr * ndtr(w * (d1 - vol)))
+    price = np.where(live, price, _intrinsic(S, K, T, r, q, w))
+    return price if price.ndim else float(price)
+
+
+def _intrinsic(S, K, T, r, q, w):
+    """到期或零波动率时的价值：远期内在价值贴现（T <= 0 时就是普通内在价值）"""
+    T = np.maximum(T, 0.0)
+    return np.maximum(w * (S * np.exp(-q * T) - K * np.exp(-r * T)), 0.0)
+
+
+def bs_greeks(S, K, T, r, sigma, option_type='call', q=0.0):
+    """
+    价格和全部一阶、二阶希腊值，返回 {名称: 数组}（名称见 GREEKS），全是标量时是 {名称: float}
+    到期或零波动率的合约：delta 取 0 / ±贴现因子（实值），其它希腊值为 0
+    """
+    S, K, T, r, sigma, q, w = _arrays(S, K, T, r, sigma, option_type, q)
+    live = (T > 0) & (sigma > 0)
+    # 无效的位置先换成无害的值，最后再统一覆盖，避免除零和 NaN 警告
+    Ts = np.where(live, T, 1.0)
+    vs = np.where(live, sigma, 1.0)
+
+    sqrt_t = np.sqrt(Ts)
+    vol = vs * sqrt_t
+    tq, tr = np.exp(-q * Ts), np.exp(-r * Ts)
+    d1 = (np.log(S / K) + (r - q) * Ts) / vol + 0.5 * vol
+    d2 = d1 - vol
+    nd1 = _pdf(d1)
+    Nd1, Nd2 = ndtr(w * d1), ndtr(w * d2)
+    sq, kr = S * tq, K * tr
+
+    vega = sq * nd1 * sqrt_t
+    out = {
+        'price': w * (sq * Nd1 - kr * Nd2),
+        'delta': w * tq * Nd1,
+        'gamma': tq * nd1 / (S * vol),
+        'vega': vega,
+        'theta': -sq * nd1 * vs / (2 * sqrt_t) - w * r * kr * Nd2 + w * q * sq * Nd1,
+        'rho': w * Ts * kr * Nd2,
+        'psi': -w * Ts * sq * Nd1,
+        'vanna': -tq * nd1 * d2 / vs,
+        'volga': vega * d1 * d2 / vs,
+        'charm': w * q * tq * Nd1 - tq * nd1 * (2 * (r - q) * Ts - d2 * vol) / (2 * Ts * vol),
+        'veta': vega * (q + (r - q) * d1 / vol - (1 + d1 * d2) / (2 * Ts)),
+    }
+
+    if not live.all():
+        dead = ~live
+        value = _intrinsic(S, K, T, r, q, w)
+        itm = value > 0
+        out['price'] = np.where(dead, value, out['price'])
+        out['delta'] = np.where(dead, np.where(itm, w * np.exp(-q * np.maximum(T, 0)), 0.0), out['delta'])
+        for name in GREEKS[2:]:
+            out[name] = np.where(dead, 0.0, out[name])
+    if not live.ndim:
+        out = {name: float(value) for name, value in out.items()}
+    return out
+
+
+def greeks_frame(chain, S, r, q=0.0, sigma='impliedVolatility'):
+    """
+    对一张期权链（load_chain 的结果）逐行计算价格和希腊值，返回同样行索引的 DataFrame
+    - S: 标的价格（标量，或者每行一个）
+    - sigma: 波动率列名，或者直接给数组
+    """
+    vol = chain[sigma].to_numpy(dtype=float) if isinstance(sigma, str) else sigma
+    g = bs_greeks(S, chain['strike'].to_numpy(dtype=float), chain['T'].to_numpy(dtype=float),
+                  r, vol, chain['is_call'].to_numpy(), q)
+    return pd.DataFrame(g, index=chain.index)
+
+
+# ================= 期权链数据 =================
+def snapshot_date(chain):
+    """期权快照的日期：最后一笔成交的日期（文件名带日期时，外面直接传 valuation_date 更准确）"""
+    return pd.to_datetime(chain['lastTradeDate']).max().normalize()
+
+
+def load_chain(path, valuation_date=None):
+    """
+    读取一个 *_options.xlsx（Calls / Puts 两个 sheet），返回一张表，新增列：
+        is_call: 是否看涨
+        T: 到期年数（实际天数 / 365，和 第5天 一样）
+    valuation_date 默认用快照日期 snapshot_date
+    """
+    sheets = pd.read_excel(path, sheet_name=['Calls', 'Puts'])
+    chain = pd.concat([sheets['Calls'], sheets['Puts']], ignore_index=True)
+    chain['expiration'] = pd.to_datetime(chain['expiration'])
+    chain['is_call'] = is_call(chain['optionType'].to_numpy())
+    today = snapshot_date(chain) if valuation_date is None else pd.Timestamp(valuation_date).normalize()
+    chain['T'] = (chain['expiration'] - today).dt.days / 365
+    chain['source'] = os.path.basename(path)
+    return chain
+
+
+if __name__ == '__main__':
+    import glob
+    import QuantLib as ql
+    from math import log, sqrt, exp
+    from scipy.stats import norm
+
+    # 第5天 原来的标量版本，用来对照速度
+    def black_scholes_scalar(S, K, T, r, sigma, option_type='call'):
+        d1 = (log(S / K) + (r + 0.5 * sigma ** 2) * T) / (sigma * sqrt(T))
+        d2 = d1 - sigma * sqrt(T)
+        if option_type == 'call':
+            return S * norm.cdf(d1) - K * exp(-r * T) * norm.cdf(d2)
+        return K * exp(-r * T) * norm.cdf(-d2) - S * norm.cdf(-d1)
+
+    # 所有股票的期权链，标的价格用 *_stock.xlsx 最新收盘价，利率用 1 年期国债
+    start = time.time()
+    chains = []
+    for path in sorted(glob.glob('./*_options.xlsx')):
+        chain = load_chain(path)
+        symbol = os.path.basename(path).split('_')[0]
+        chain['spot'] = pd.read_excel(f'./{symbol}_stock.xlsx').sort_values('Date')['Close'].iloc[-1]
+        chains.append(chain)
+    chains = pd.concat(chains, ignore_index=True)
+    r = pd.read_excel('./US_Treasury_Yields.xlsx')['DGS1'].iloc[-1] / 100
+    print(f"读取 {len(chains)} 个合约, 用时 {time.time() - start:.1f}秒, 无风险利率 {r:.2%}")
+
+    live = chains[(chains['T'] > 0) & (chains['impliedVolatility'] > 0.01)]
+    S, K, T, vol, call = (live[c].to_numpy() for c in ('spot', 'strike', 'T', 'impliedVolatility', 'is_call'))
+
+    start = time.time()
+    g = bs_greeks(S, K, T, r, vol, call)
+    print(f"向量化: {len(live)} 个合约的价格 + 10 个希腊值, 用时 {(time.time() - start) * 1000:.1f}毫秒")
+
+    n = 2000
+    start = time.time()
+    scalar = [black_scholes_scalar(S[i], K[i], T[i], r, vol[i], 'call' if call[i] else 'put') for i in range(n)]
+    seconds = time.time() - start
+    print(f"第5天 的标量版本: {n} 个合约只算价格, 用时 {seconds * 1000:.1f}毫秒"
+          f"（全部合约约 {seconds / n * len(live):.1f}秒）, 最大误差 {np.max(np.abs(g['price'][:n] - scalar)):.2e}")
+
+    # 和 QuantLib AnalyticEuropeanEngine 对照几个合约（带股息率）
+    q = 0.01
+    g = bs_greeks(S, K, T, r, vol, call, q)
+    today = ql.Date(1, 1, 2025)
+    ql.Settings.instance().evaluationDate = today
+    rows = np.random.default_rng(0).choice(len(live), 5, replace=False)
+    for i in rows:
+        days = int(round(T[i] * 365))
+        option = ql.VanillaOption(ql.PlainVanillaPayoff(ql.Option.Call if call[i] else ql.Option.Put, K[i]),
+                                  ql.EuropeanExercise(today + days))
+        process = ql.BlackScholesMertonProcess(
+            ql.QuoteHandle(ql.SimpleQuote(S[i])),
+            ql.YieldTermStructureHandle(ql.FlatForward(today, q, ql.Actual365Fixed())),
+            ql.YieldTermStructureHandle(ql.FlatForward(today, r, ql.Actual365Fixed())),
+            ql.BlackVolTermStructureHandle(ql.BlackConstantVol(today, ql.NullCalendar(), vol[i], ql.Actual365Fixed())))
+        option.setPricingEngine(ql.AnalyticEuropeanEngine(process))
+        ours = np.array([g[k][i] for k in ('price', 'delta', 'gamma', 'vega', 'rho', 'theta')])
+        theirs = np.array([option.NPV(), option.delta(), option.gamma(), option.vega(), option.rho(), option.theta()])
+        print(f"{live['contractSymbol'].iloc[i]}: 和 QuantLib 的最大相对误差 "
+              f"{np.max(np.abs(ours - theirs) / np.maximum(np.abs(theirs), 1e-12)):.1e}")
+
+    # 二阶希腊值和差分对照
+    h = 1e-4
+    up = bs_greeks(S, K, T, r, vol + h, call, q)
+    down = bs_greeks(S, K, T, r, vol - h, call, q)
+    ok = T > 0.05
+    print(f"vanna 差分误差 {np.max(np.abs(g['vanna'] - (up['delta'] - down['delta']) / (2 * h))[ok]):.1e}, "
+          f"volga 差分误差 {np.max(np.abs(g['volga'] - (up['vega'] - down['vega']) / (2 * h))[ok] / S[ok]):.1e}")
@@ -0,0 +1,329 @@
+'''
+QuantLib 期权簿：
+
+第8天 / DEEPSEEK 的 calculate_option_greeks 每次都从头建 payoff、期限结构、BlackScholesMertonProcess 和定价引擎，
+只为了给一个期权定价；要做 "现价 -10% ~ +10%、波动率 ±5%" 这样的情景分析，就得把这些对象重建 合约数 x 情景数 次。
+
+QuantLib 本身是观察者模式：报价（SimpleQuote）变了，依赖它的期限结构、过程、合约会被标记为"需要重算"，
+下次取 NPV 时才重新计算。OptionBook 利用这一点：
+    - 每个标的只建一次：现价、无风险利率、股息率、波动率各是一个 SimpleQuote，
+      期限结构和 BlackScholesMertonProcess 都挂在这些报价上，同一个标的的所有合约共用一个定价引擎
+    - 情景分析只是 quote.setValue()，不重建任何对象
+    - scenario_grid 里常数波动率的欧式合约有解析解，直接用 期权分析.black_scholes 对 情景 x 合约 一次向量化定价；
+      美式合约和挂波动率曲面的合约仍然走 QuantLib 报价
+    - 标的可以用常数波动率，也可以用 波动率曲面.VolSurface（波动率平移时重新挂一个平移过的曲面，按平移量缓存）
+    - 美式期权（exercise='american'）共用同一个标的的 CRR 二叉树引擎
+
+用法：
+    book = OptionBook(ql.Date(26, 11, 2025))
+    book.add_underlying('TSLA', spot=426.7, r=0.036, vol_surface=surface)
+    book.add_chain('TSLA', chain)
+    book.greeks()                                  # 每个合约的价格和希腊值
+    with book.scenario('TSLA', spot_shift=-0.1, vol_shift=0.05):
+        book.value()                               # 跌 10%、波动率上升 5 个百分点时的组合价值
+    book.scenario_grid('TSLA', spot_shifts, vol_shifts)
+'''
+
+import time
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+import QuantLib as ql
+
+from 期权分析 import black_scholes
+
+GREEK_COLUMNS = ('price', 'delta', 'gamma', 'vega', 'theta', 'rho')
+
+
+def to_ql_date(date):
+    """pandas / datetime 日期转 ql.Date"""
+    if isinstance(date, ql.Date):
+        return date
+    date = pd.Timestamp(date)
+    return ql.Date(date.day, date.month, date.year)
+
+
+def _greek(option, name):
+    try:
+        return option.NPV() if name == 'price' else getattr(option, name)()
+    except RuntimeError:
+        return np.nan
+
+
+class _Underlying:
+    """一个标的的报价、期限结构和共用的定价引擎"""
+
+    def __init__(self, today, calendar, day_counter, spot, r, q, vol, vol_surface):
+        self.spot = ql.SimpleQuote(spot)
+        self.rate = ql.SimpleQuote(r)
+        self.dividend = ql.SimpleQuote(q)
+        self.vol = ql.SimpleQuote(vol)
+        self.vol_surface = vol_surface
+        self.vol_shift = 0.0
+        self._shifted = {}
+        self.vol_handle = ql.RelinkableBlackVolTermStructureHandle()
+        if vol_surface is None:
+            self.vol_handle.linkTo(ql.BlackConstantVol(today, calendar, ql.QuoteHandle(self.vol), day_counter))
+        else:
+            self.vol_handle.linkTo(self._surface(today, 0.0))
+        self.process = ql.BlackScholesMertonProcess(
+            ql.QuoteHandle(self.spot),
+            ql.YieldTermStructureHandle(ql.FlatForward(today, ql.QuoteHandle(self.dividend), day_counter)),
+            ql.YieldTermStructureHandle(ql.FlatForward(today, ql.QuoteHandle(self.rate), day_counter)),
+            self.vol_handle)
+        self.engine = ql.AnalyticEuropeanEngine(self.process)
+        self.american_engine = None
+        self.today = today
+
+    def _surface(self, today, shift):
+        key = round(shift, 10)
+        if key not in self._shifted:
+            self._shifted[key] = self.vol_surface.to_quantlib(today, shift=shift).currentLink()
+        return self._shifted[key]
+
+    def engine_for(self, exercise, steps):
+        """欧式用解析引擎；美式用 CRR 二叉树引擎（第一次用到时才建，之后共用）"""
+        if exercise == 'european':
+            return self.engine
+        if self.american_engine is None:
+            self.american_engine = ql.BinomialVanillaEngine(self.process, 'crr', steps)
+        return self.american_engine
+
+    def shift_vol(self, shift):
+        """整体平移波动率：常数波动率直接改报价，曲面则换成平移过的曲面"""
+        if self.vol_surface is None:
+            self.vol.setValue(self.vol.value() - self.vol_shift + shift)
+        elif shift != self.vol_shift:
+            self.vol_handle.linkTo(self._surface(self.today, shift))
+        self.vol_shift = shift
+
+
+class OptionBook:
+    """
+    - today: 估值日（ql.Date 或日期），默认今天；会设置为 QuantLib 的全局估值日
+    - day_counter / calendar: 默认 Actual365Fixed / NullCalendar（和 期权分析 的 T = 天数 / 365 一致）
+    - steps: 美式期权 CRR 二叉树的步数
+    希腊值单位：vega、rho 是波动率、利率变化 1.0 的价格变化，theta 是每年（和 期权分析.bs_greeks 相同）
+    """
+
+    def __init__(self, today=None, day_counter=None, calendar=None, steps=200):
+        self.today = ql.Date.todaysDate() if today is None else to_ql_date(today)
+        ql.Settings.instance().evaluationDate = self.today
+        self.day_counter = day_counter or ql.Actual365Fixed()
+        self.calendar = calendar or ql.NullCalendar()
+        self.steps = steps            # 美式期权二叉树步数
+        self.underlyings = {}
+        self.options = []             # QuantLib VanillaOption
+        self.positions = []           # 每个合约一行的描述
+
+    def __len__(self):
+        return len(self.options)
+
+    def __repr__(self):
+        return f"OptionBook({self.today}, {len(self.underlyings)} 个标的, {len(self)} 个合约)"
+
+    # ---------- 建簿 ----------
+    def add_underlying(self, symbol, spot, r, q=0.0, vol=0.3, vol_surface=None):
+        """登记一个标的：vol_surface（VolSurface）给出时用曲面，否则用常数波动率 vol"""
+        self.underlyings[symbol] = _Underlying(self.today, self.calendar, self.day_counter,
+                                               spot, r, q, vol, vol_surface)
+        return self
+
+    def _expiry(self, expiry):
+        if isinstance(expiry, (int, float, np.floating)):
+            return self.today + max(int(round(expiry * 365)), 1)
+        return to_ql_date(expiry)
+
+    def add_option(self, symbol, strike, expiry, option_type='call', quantity=1.0, name=None, exercise='european'):
+        """
+        加入一个期权，返回它在簿里的序号
+        - expiry: 到期日（日期 / ql.Date），或者到期时间（年）
+        - quantity: 持仓数量（负数为卖出）
+        - exercise: 'european' 或 'american'
+        """
+        underlying = self.underlyings[symbol]
+        is_call = str(option_type).lower().startswith('c')
+        exercise_date = self._expiry(expiry)
+        payoff = ql.PlainVanillaPayoff(ql.Option.Call if is_call else ql.Option.Put, float(strike))
+        if exercise == 'american':
+            option = ql.VanillaOption(payoff, ql.AmericanExercise(self.today, exercise_date))
+        else:
+            option = ql.VanillaOption(payoff, ql.EuropeanExercise(exercise_date))
+        option.setPricingEngine(underlying.engine_for(exercise, self.steps))
+        self.options.append(option)
+        self.positions.append({'name': name, 'symbol': symbol, 'strike': float(strike),
+                               'expiration': pd.Timestamp(exercise_date.to_date()),
+                               'is_call': is_call, 'exercise': exercise, 'quantity': float(quantity)})
+        return len(self.options) - 1
+
+    def add_chain(self, symbol, chain, quantity=1.0, exercise='european'):
+        """把一张期权链（期权分析.load_chain 的结果）里未到期的合约都加进来"""
+        chain = chain[chain['expiration'] > pd.Timestamp(self.today.to_date())]
+        names = chain['contractSymbol'] if 'contractSymbol' in chain else [None] * len(chain)
+        for strike, expiration, is_call, name in zip(chain['strike'], chain['expiration'],
+                                                     chain['is_call'], names):
+            self.add_option(symbol, strike, expiration, 'call' if is_call else 'put', quantity, name, exercise)
+        return self
+
+    # ---------- 估值 ----------
+    def frame(self):
+        return pd.DataFrame(self.positions)
+
+    def npv(self):
+        """每个合约的单价（ndarray）"""
+        return np.array([option.NPV() for option in self.options])
+
+    def value(self):
+        """按持仓数量加总的组合价值"""
+        quantity = np.array([p['quantity'] for p in self.positions])
+        return float(quantity @ self.npv())
+
+    def greeks(self):
+        """每个合约的价格和希腊值 DataFrame（单价，未乘持仓数量）；二叉树引擎不提供 vega、rho，记为 NaN"""
+        rows = [[_greek(o, g) for g in GREEK_COLUMNS] for o in self.options]
+        return pd.concat([self.frame(), pd.DataFrame(rows, columns=GREEK_COLUMNS)], axis=1)
+
+    # ---------- 情景 ----------
+    def set_market(self, symbol, spot=None, r=None, q=None, vol=None):
+        """直接修改一个标的的市场数据（只改报价，依赖它的合约下次取价时重算）"""
+        underlying = self.underlyings[symbol]
+        for quote, value in ((underlying.spot, spot), (underlying.rate, r), (underlying.dividend, q)):
+            if value is not None:
+                quote.setValue(value)
+        if vol is not None:
+            if underlying.vol_surface is not None:
+                raise ValueError(f"{symbol} 使用波动率曲面，请用 vol_shift 平移")
+            underlying.vol.setValue(vol + underlying.vol_shift)
+
+    @contextmanager
+    def scenario(self, symbol, spot_shift=0.0, vol_shift=0.0, rate_shift=0.0, dividend_shift=0.0):
+        """
+        临时情景：spot_shift 是现价的相对变化（-0.1 即跌 10%），其它是绝对变化；退出时恢复原值
+        """
+        underlying = self.underlyings[symbol]
+        saved = (underlying.spot.value(), underlying.rate.value(), underlying.dividend.value(), underlying.vol_shift)
+        try:
+            underlying.spot.setValue(saved[0] * (1 + spot_shift))
+            underlying.rate.setValue(saved[1] + rate_shift)
+            underlying.dividend.setValue(saved[2] + dividend_shift)
+            underlying.shift_vol(saved[3] + vol_shift)
+            yield self
+        finally:
+            underlying.spot.setValue(saved[0])
+            underlying.rate.setValue(saved[1])
+            underlying.dividend.setValue(saved[2])
+            underlying.shift_vol(saved[3])
+
+    def scenario_grid(self, symbol, spot_shifts=(0.0,), vol_shifts=(0.0,), vectorized=True):
+        """
+        现价 x 波动率 情景下组合价值相对当前的变化，行是 spot_shift，列是 vol_shift
+        只有 symbol 的合约会变，其它标的的合约在相减时抵消，不参与计算
+        - vectorized: 常数波动率的欧式合约用 black_scholes 一次算完所有情景（和解析引擎结果一致）；
+          False 时所有合约都逐个情景改报价重新取 NPV
+        """
+        underlying = self.underlyings[symbol]
+        positions = self.frame()
+        mine = (positions['symbol'] == symbol).to_numpy()
+        analytic = mine & (positions['exercise'] == 'european').to_numpy() & (underlying.vol_surface is None)
+        if not vectorized:
+            analytic[:] = False
+        spot_shifts, vol_shifts = np.asarray(spot_shifts, float), np.asarray(vol_shifts, float)
+        grid = np.zeros((len(spot_shifts), len(vol_shifts)))
+
+        if analytic.any():
+            fast = positions[analytic]
+            T = (fast['expiration'] - pd.Timestamp(self.today.to_date())).dt.days.to_numpy() / 365
+            args = (fast['strike'].to_numpy(), T, underlying.rate.value())
+            kw = dict(option_type=fast['is_call'].to_numpy(), q=underlying.dividend.value())
+            spot, vol = underlying.spot.value(), underlying.vol.value()
+            values = black_scholes(spot * (1 + spot_shifts)[:, None, None], *args,
+                                   vol + vol_shifts[None, :, None], **kw)
+            quantity = fast['quantity'].to_numpy()
+            grid += values @ quantity - black_scholes(spot, *args, vol, **kw) @ quantity
+
+        slow = np.flatnonzero(mine & ~analytic)
+        if len(slow):
+            options = [self.options[i] for i in slow]
+            quantity = positions['quantity'].to_numpy()[slow]
+            base = quantity @ np.array([o.NPV() for o in options])
+            for j, dv in enumerate(vol_shifts):
+                for i, ds in enumerate(spot_shifts):
+                    with self.scenario(symbol, spot_shift=ds, vol_shift=dv):
+                        grid[i, j] += quantity @ np.array([o.NPV() for o in options]) - base
+        return pd.DataFrame(grid, index=pd.Index(spot_shifts, name='spot_shift'),
+                            columns=pd.Index(vol_shifts, name='vol_shift'))
+
+
+def rebuild_price(today, spot, r, q, vol, strike, expiry, is_call):
+    """对照用：每个期权都从头建一遍 payoff、期限结构、过程和引擎（原来 calculate_option_greeks 的做法）"""
+    day_counter = ql.Actual365Fixed()
+    payoff = ql.PlainVanillaPayoff(ql.Option.Call if is_call else ql.Option.Put, strike)
+    option = ql.VanillaOption(payoff, ql.EuropeanExercise(expiry))
+    process = ql.BlackScholesMertonProcess(
+        ql.QuoteHandle(ql.SimpleQuote(spot)),
+        ql.YieldTermStructureHandle(ql.FlatForward(today, q, day_counter)),
+        ql.YieldTermStructureHandle(ql.FlatForward(today, r, day_counter)),
+        ql.BlackVolTermStructureHandle(ql.BlackConstantVol(today, ql.NullCalendar(), vol, day_counter)))
+    option.setPricingEngine(ql.AnalyticEuropeanEngine(process))
+    return option.NPV()
+
+
+if __name__ == '__main__':
+    from 期权分析 import load_chain, snapshot_date, bs_greeks
+
+    r = pd.read_excel('./US_Treasury_Yields.xlsx')['DGS1'].iloc[-1] / 100
+    chain = load_chain('./TSLA_options.xlsx')
+    chain = chain[chain['T'] > 0].reset_index(drop=True)
+    today = snapshot_date(chain)
+    spot, vol = 426.7, 0.55
+
+    book = OptionBook(today)
+    book.add_underlying('TSLA', spot, r, vol=vol)
+    start = time.time()
+    book.add_chain('TSLA', chain)
+    print(f"{book}, 建簿用时 {time.time() - start:.2f}秒")
+
+    # 和 期权分析.bs_greeks 对照
+    greeks = book.greeks()
+    expect = bs_greeks(spot, greeks['strike'], chain['T'], r, vol, greeks['is_call'].to_numpy())
+    print('和 bs_greeks 的最大差异:',
+          {g: float(np.max(np.abs(greeks[g] - expect[g]))) for g in ('price', 'delta', 'gamma', 'vega', 'rho')})
+
+    # 情景分析：现价 x 波动率，三种做法用同一组情景计时
+    spot_shifts = np.round(np.linspace(-0.2, 0.2, 9), 3)
+    vol_shifts = (-0.1, -0.05, 0.0, 0.05, 0.1)
+    n_scenarios = len(spot_shifts) * len(vol_shifts)
+    start = time.time()
+    grid = book.scenario_grid('TSLA', spot_shifts, vol_shifts)
+    vectorized = time.time() - start
+    print(f"向量化解析定价: {n_scenarios} 个情景 x {len(book)} 个合约, 用时 {vectorized:.3f}秒")
+    print(grid.round(0))
+
+    start = time.time()
+    shared = book.scenario_grid('TSLA', spot_shifts, vol_shifts, vectorized=False)
+    elapsed = time.time() - start
+    print(f"共享报价重新定价: 用时 {elapsed:.2f}秒, 和向量化结果的最大差异 {np.abs(shared - grid).to_numpy().max():.2e}")
+
+    # 对照：每个情景、每个合约都重建对象
+    today_ql = to_ql_date(today)
+    quantity = book.frame()['quantity'].to_numpy()
+    start = time.time()
+    base = quantity @ [rebuild_price(today_ql, spot, r, 0.0, vol, p['strike'], to_ql_date(p['expiration']), p['is_call'])
+                       for p in book.positions]
+    rebuild_grid = np.empty((len(spot_shifts), len(vol_shifts)))
+    for j, dv in enumerate(vol_shifts):
+        for i, ds in enumerate(spot_shifts):
+            rebuild_grid[i, j] = quantity @ [
+                rebuild_price(today_ql, spot * (1 + ds), r, 0.0, vol + dv, p['strike'],
+                              to_ql_date(p['expiration']), p['is_call']) for p in book.positions] - base
+    rebuild = time.time() - start
+    print(f"每次重建对象: 用时 {rebuild:.2f}秒, 和向量化结果的最大差异 {np.abs(rebuild_grid - grid.to_numpy()).max():.2e}")
+    print(f"共享报价比重建快 {rebuild / elapsed:.1f} 倍, 向量化比重建快 {rebuild / vectorized:.0f} 倍")
+
+    # 用波动率曲面
+    from 波动率曲面 import surface_from_file
+    surface = surface_from_file('./TSLA_options.xlsx', r)
+    book_surface = OptionBook(today).add_underlying('TSLA', surface.spot, r, vol_surface=surface)
+    book_surface.add_chain('TSLA', chain)
+    print(book_surface.scenario_grid('TSLA', (-0.1, 0.0, 0.1), (-0.05, 0.0, 0.05)).round(0))
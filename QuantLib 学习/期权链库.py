@@ -0,0 +1,377 @@
+'''
+期权链库（按索引查询的期权快照）：
+
+第6天 的 create_option_portfolio 每次都对整张表做 str.contains('call') 和 strike < 170 这样的全表扫描，
+获取期权数据.py 每个股票每天一个 Excel（{symbol}_options_{日期}.xlsx），要比较不同日期只能一个个文件读。
+
+OptionChainStore 把任意多个标的、任意多天的快照放进一张表：
+    - 列都是固定类型：underlying、optionType（call / put）是 Categorical，
+      snapshot、expiration 是 int32（1970-01-01 起的天数），strike 是 float64，其它列原样保留
+    - 行按 (underlying, snapshot, expiration, optionType, strike) 排序：同一标的同一天的期权链是连续的一段，
+      里面再按 (到期日, 类型, 执行价) 排列；每个 (标的, 快照, 到期日, 类型) 是一组，组内执行价有序
+    - 组的位置记在一张小索引表里（组键是把四个字段拼成的 int64），查询先在索引表上二分找到到期日范围内的组，
+      再在每组的执行价上二分，不扫描整张表
+    - 每个快照记一个标的价格（默认由平价关系反推），按 moneyness（执行价 / 标的价格）查询
+    - 同一标的同一天重复加入时替换旧数据；save / load 用 Parquet
+
+用法：
+    store = OptionChainStore()
+    store.add_file('./AAPL_options.xlsx')                          # 或者 store.add(chain, 'AAPL', snapshot, spot)
+    store.nearest('AAPL', 'call', min_days=90)                     # 90 天以上最近到期日的平值看涨期权
+    store.select('AAPL', 'put', moneyness=(0.9, 1.1))              # 所有 ±10% 以内的看跌期权
+    store.history('TSLA', '2026-06-18', 'call', 450)               # 一个合约在各个快照的报价
+    store.save('./option_chains.parquet')
+'''
+
+import os
+import re
+import glob
+import time
+
+import numpy as np
+import pandas as pd
+
+from 期权分析 import is_call, load_chain, snapshot_date
+from 隐含波动率 import implied_forward
+
+_EPOCH = np.datetime64('1970-01-01', 'D')
+_DAY_BITS = 17                      # 天数最多 2^17（到 2328 年）
+OPTION_TYPES = ('call', 'put')      # Categorical 的顺序：组内看涨在前
+
+
+def to_days(dates):
+    """日期（标量或数组）-> 1970-01-01 起的天数"""
+    days = (np.asarray(pd.to_datetime(dates), dtype='datetime64[D]') - _EPOCH).astype(np.int64)
+    return days if days.ndim else int(days)
+
+
+def from_days(days):
+    """天数 -> 日期（数组是 datetime64，标量是 pd.Timestamp）"""
+    dates = _EPOCH + np.asarray(days, dtype='timedelta64[D]')
+    return dates if dates.ndim else pd.Timestamp(dates)
+
+
+def _group_key(code, snapshot, expiration, put):
+    """(标的编码, 快照, 到期日, 是否看跌) -> int64，排序和按字段依次排序一致"""
+    code, snapshot, expiration, put = (np.asarray(x, np.int64) for x in (code, snapshot, expiration, put))
+    return ((code << _DAY_BITS | snapshot) << _DAY_BITS | expiration) << 1 | put
+
+
+def parse_file_name(path):
+    """{symbol}_options.xlsx / {symbol}_options_{YYYY-MM-DD}.xlsx -> (symbol, 日期或 None)"""
+    match = re.match(r'(.+?)_options(?:_(\d{4}-\d{2}-\d{2}))?\.xlsx$', os.path.basename(path))
+    if match is None:
+        raise ValueError(f"不是期权数据文件: {path}")
+    return match.group(1), (pd.Timestamp(match.group(2)) if match.group(2) else None)
+
+
+def parity_spot(chain, r, n_expiries=3):
+    """平价关系反推的标的价格：最近几个到期日的远期折回现在，取中位数（和 波动率曲面 一样）"""
+    spot = pd.Series(implied_forward(chain, r), index=chain.index) * np.exp(-r * chain['T'])
+    spot = spot[chain['T'] > 0].groupby(chain['expiration']).first().dropna()       # 当天到期的不用
+    return float(spot.head(n_expiries).median()) if len(spot) else np.nan
+
+
+class OptionChainStore:
+    """多标的、多快照的期权链，按 (标的, 快照, 到期日, 类型, 执行价) 排序并建索引"""
+
+    def __init__(self, frame=None):
+        self.frame = pd.DataFrame()
+        self._pending = [] if frame is None or frame.empty else [frame]
+        self._index = None
+
+    def __len__(self):
+        return len(self._table())
+
+    def __repr__(self):
+        frame = self._table()
+        if frame.empty:
+            return 'OptionChainStore(空)'
+        snapshots = len(np.unique(self._index[0] >> (_DAY_BITS + 1)))        # 不同的 (标的, 快照)
+        return f"OptionChainStore({len(frame):,} 个合约, {len(self._codes)} 个标的, {snapshots} 个快照)"
+
+    # ---------- 写入 ----------
+    def add(self, chain, underlying=None, snapshot=None, spot=None, r=0.04):
+        """
+        加入一个标的一天的期权链（load_chain 的结果，或者 Calls / Puts 两个 sheet 合在一起的表）
+        - underlying: 默认用 chain['symbol']
+        - snapshot: 快照日期，默认用 期权分析.snapshot_date（最后一笔成交的日期）
+        - spot: 标的价格，默认用 parity_spot 由平价关系反推（r 只在这里用到）
+        返回自己，可以链式调用
+        """
+        chain = chain.copy()
+        underlying = underlying or str(chain['symbol'].iloc[0])
+        snapshot = pd.Timestamp(snapshot if snapshot is not None else snapshot_date(chain)).normalize()
+        chain['expiration'] = pd.to_datetime(chain['expiration'])
+        chain['is_call'] = is_call(chain['optionType'].to_numpy())
+        chain['T'] = (chain['expiration'] - snapshot).dt.days / 365
+        if spot is None:
+            spot = parity_spot(chain, r)
+
+        chain['underlying'] = underlying
+        chain['snapshot'] = to_days(snapshot)
+        chain['expiration'] = to_days(chain['expiration'])
+        chain['optionType'] = np.where(chain['is_call'], 'call', 'put')
+        chain['underlying_price'] = float(spot)
+        chain = chain.drop(columns=['T'] + [c for c in ('symbol', 'days', 'moneyness') if c in chain])
+        # 同一标的同一天重新加入：替换旧数据
+        def keep(frame):
+            return frame[~((frame['underlying'] == underlying) & (frame['snapshot'] == to_days(snapshot))).to_numpy()]
+
+        self._pending = [keep(p) for p in self._pending] + [chain]
+        if not self.frame.empty:
+            self.frame = keep(self.frame)
+        self._index = None
+        return self
+
+    def add_file(self, path, r=0.04, spot=None):
+        """加入一个 {symbol}_options[_{日期}].xlsx 文件：文件名里有日期就用它当快照日期"""
+        symbol, date = parse_file_name(path)
+        chain = load_chain(path, date)
+        return self.add(chain, symbol, date if date is not None else snapshot_date(chain), spot, r)
+
+    @classmethod
+    def from_files(cls, paths, r=0.04):
+        store = cls()
+        for path in paths:
+            store.add_file(path, r)
+        return store
+
+    # ---------- 排序和索引 ----------
+    def _table(self):
+        """把新加入的数据合并、排序，重建索引（只在有新数据后的第一次查询时做）"""
+        if self._index is not None:
+            return self.frame
+        frames = [f for f in [self.frame] + self._pending if not f.empty]
+        if not frames:
+            self._index = (np.zeros(0, np.int64), np.zeros(1, np.int64))
+            return self.frame
+        frame = pd.concat([f.astype({'underlying': str, 'optionType': str}) for f in frames], ignore_index=True)
+        frame['underlying'] = pd.Categorical(frame['underlying'])
+        frame['optionType'] = pd.Categorical(frame['optionType'], categories=OPTION_TYPES)
+        frame['snapshot'] = frame['snapshot'].astype(np.int32)
+        frame['expiration'] = frame['expiration'].astype(np.int32)
+        frame['strike'] = frame['strike'].astype(np.float64)
+        keys = _group_key(frame['underlying'].cat.codes, frame['snapshot'], frame['expiration'],
+                          frame['optionType'].cat.codes)
+        order = np.lexsort((frame['strike'].to_numpy(), keys))
+        self.frame = frame.iloc[order].reset_index(drop=True)
+        keys = keys[order]
+        starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+        # 索引表：每组的键和起止行
+        self._index = (keys[starts], np.r_[starts, len(keys)])
+        # 查询时直接从这些数组取值，不经过 DataFrame 的索引
+        self._columns = {c: self.frame[c].array if isinstance(self.frame[c].dtype, pd.CategoricalDtype)
+                         else self.frame[c].to_numpy() for c in self.frame.columns}
+        self._codes = {name: i for i, name in enumerate(self.frame['underlying'].cat.categories)}
+        self._strike = self._columns['strike']
+        self._price = self._columns['underlying_price']
+        self._pending = []
+        return self.frame
+
+    def _code(self, underlying):
+        self._table()
+        if underlying not in self._codes:
+            raise KeyError(f"没有 {underlying} 的数据")
+        return self._codes[underlying]
+
+    def _groups(self, underlying, snapshot, first, last, option_type=None):
+        """到期日在 [first, last]（天数）之间的组的下标"""
+        group_keys, _ = self._index
+        code = self._code(underlying)
+        lo = np.searchsorted(group_keys, _group_key(code, snapshot, first, 0), 'left')
+        hi = np.searchsorted(group_keys, _group_key(code, snapshot, last, 1), 'right')
+        groups = np.arange(lo, hi)
+        if option_type is not None:
+            groups = groups[(group_keys[groups] & 1) == (0 if is_call(option_type) else 1)]
+        return groups
+
+    def _snapshot(self, underlying, snapshot):
+        """快照日期 -> 天数；None 时取这个标的最新的快照"""
+        if snapshot is not None:
+            return to_days(snapshot)
+        group_keys, _ = self._index
+        code = self._code(underlying)
+        last = np.searchsorted(group_keys, _group_key(code + 1, 0, 0, 0)) - 1
+        return int(group_keys[last] >> (_DAY_BITS + 1) & ((1 << _DAY_BITS) - 1))
+
+    def _derived(self, data):
+        """加上便于使用的列：日期、剩余天数、T、moneyness"""
+        days = data['expiration'] - data['snapshot']
+        data['snapshot'] = from_days(data['snapshot'])
+        data['expiration'] = from_days(data['expiration'])
+        data['days'] = days
+        data['T'] = days / 365
+        data['moneyness'] = data['strike'] / data['underlying_price']
+        return data
+
+    def _rows(self, rows):
+        """按行号取出结果（DataFrame）"""
+        rows = np.arange(len(self.frame))[rows] if isinstance(rows, slice) else np.asarray(rows, np.int64)
+        return pd.DataFrame(self._derived({c: col.take(rows) for c, col in self._columns.items()}), index=rows)
+
+    def _row(self, i):
+        """一行（Series）"""
+        return pd.Series(self._derived({c: col[i] for c, col in self._columns.items()}), name=i)
+
+    # ---------- 查询 ----------
+    def underlyings(self):
+        self._table()
+        return list(self._codes)
+
+    def snapshots(self, underlying):
+        """这个标的所有快照的日期"""
+        self._table()
+        group_keys, _ = self._index
+        code = self._code(underlying)
+        lo, hi = np.searchsorted(group_keys, [_group_key(code, 0, 0, 0), _group_key(code + 1, 0, 0, 0)])
+        days = np.unique(group_keys[lo:hi] >> (_DAY_BITS + 1) & ((1 << _DAY_BITS) - 1))
+        return pd.DatetimeIndex(from_days(days))
+
+    def spot(self, underlying, snapshot=None):
+        """快照的标的价格"""
+        self._table()
+        snapshot = self._snapshot(underlying, snapshot)
+        groups = self._groups(underlying, snapshot, 0, (1 << _DAY_BITS) - 1)
+        if not len(groups):
+            raise KeyError(f"没有 {underlying} 在 {from_days(snapshot)} 的快照")
+        return float(self._price[self._index[1][groups[0]]])
+
+    def expirations(self, underlying, snapshot=None):
+        self._table()
+        snapshot = self._snapshot(underlying, snapshot)
+        groups = self._groups(underlying, snapshot, 0, (1 << _DAY_BITS) - 1)
+        days = np.unique(self._index[0][groups] >> 1 & ((1 << _DAY_BITS) - 1))
+        return pd.DatetimeIndex(from_days(days))
+
+    def chain(self, underlying, snapshot=None):
+        """一个标的一天的整条期权链（连续的一段行）"""
+        self._table()
+        snapshot = self._snapshot(underlying, snapshot)
+        groups = self._groups(underlying, snapshot, 0, (1 << _DAY_BITS) - 1)
+        if not len(groups):
+            return self._rows(slice(0, 0))
+        _, bounds = self._index
+        return self._rows(slice(bounds[groups[0]], bounds[groups[-1] + 1]))
+
+    def select(self, underlying, option_type=None, snapshot=None, min_days=0, max_days=None,
+               strikes=None, moneyness=None):
+        """
+        按条件查询：
+        - option_type: 'call' / 'put'，None 表示都要
+        - min_days / max_days: 剩余天数范围（包含两端）
+        - strikes: (最低, 最高) 执行价；moneyness: (最低, 最高) 执行价 / 标的价格，两个都给时取交集
+        """
+        self._table()
+        snapshot = self._snapshot(underlying, snapshot)
+        last = snapshot + max_days if max_days is not None else (1 << _DAY_BITS) - 1
+        groups = self._groups(underlying, snapshot, snapshot + min_days, last, option_type)
+        low, high = strikes if strikes is not None else (-np.inf, np.inf)
+        if moneyness is not None and len(groups):
+            spot = self._price[self._index[1][groups[0]]]
+            low, high = max(low, moneyness[0] * spot), min(high, moneyness[1] * spot)
+        _, bounds = self._index
+        rows = []
+        for g in groups:
+            start, end = bounds[g], bounds[g + 1]
+            lo = start + np.searchsorted(self._strike[start:end], low, 'left')
+            hi = start + np.searchsorted(self._strike[start:end], high, 'right')
+            rows.append(np.arange(lo, hi))
+        return self._rows(np.concatenate(rows) if rows else np.zeros(0, np.int64))
+
+    def nearest(self, underlying, option_type='call', snapshot=None, min_days=0, max_days=None,
+                strike=None, moneyness=1.0):
+        """
+        剩余天数 >= min_days 的最近一个到期日里，执行价最接近目标的合约（一行 Series）
+        目标执行价: strike，或者 moneyness x 标的价格（默认 1.0 即平值）；没有符合条件的合约时返回 None
+        """
+        self._table()
+        snapshot = self._snapshot(underlying, snapshot)
+        last = snapshot + max_days if max_days is not None else (1 << _DAY_BITS) - 1
+        groups = self._groups(underlying, snapshot, snapshot + min_days, last, option_type)
+        if not len(groups):
+            return None
+        _, bounds = self._index
+        start, end = bounds[groups[0]], bounds[groups[0] + 1]
+        target = strike if strike is not None else moneyness * self._price[start]
+        i = start + np.searchsorted(self._strike[start:end], target)
+        candidates = [j for j in (i - 1, i) if start <= j < end]
+        best = min(candidates, key=lambda j: abs(self._strike[j] - target))
+        return self._row(best)
+
+    def history(self, underlying, expiration, option_type, strike):
+        """一个合约（标的, 到期日, 类型, 执行价）在所有快照里的数据，每个快照一行"""
+        self._table()
+        expiration, put = to_days(expiration), 0 if is_call(option_type) else 1
+        group_keys, bounds = self._index
+        code = self._code(underlying)
+        rows = []
+        for snapshot in to_days(self.snapshots(underlying)):
+            g = np.searchsorted(group_keys, _group_key(code, snapshot, expiration, put))
+            if g == len(group_keys) or group_keys[g] != _group_key(code, snapshot, expiration, put):
+                continue
+            start, end = bounds[g], bounds[g + 1]
+            i = start + np.searchsorted(self._strike[start:end], strike)
+            if i < end and self._strike[i] == strike:
+                rows.append(i)
+        return self._rows(np.array(rows, np.int64)).set_index('snapshot')
+
+    # ---------- 存取 ----------
+    def save(self, path):
+        """整张表写成一个 Parquet 文件（先写临时文件再改名）"""
+        frame = self._table()
+        frame.to_parquet(path + '.tmp', index=False)
+        os.replace(path + '.tmp', path)
+
+    @classmethod
+    def load(cls, path):
+        return cls(pd.read_parquet(path))
+
+
+if __name__ == '__main__':
+    # 1. 读入目录里所有期权文件（带日期的文件是同一标的另一天的快照）
+    r = pd.read_excel('./US_Treasury_Yields.xlsx')['DGS1'].iloc[-1] / 100
+    paths = sorted(glob.glob('./*_options*.xlsx'))
+    start = time.time()
+    store = OptionChainStore.from_files(paths, r)
+    print(f"{store}, 读取 {len(paths)} 个文件用时 {time.time() - start:.1f}秒")
+    print(f"TSLA 快照: {[d.date().isoformat() for d in store.snapshots('TSLA')]}, "
+          f"最新标的价格 {store.spot('TSLA'):.2f}")
+
+    # 2. 查询
+    atm = store.nearest('AAPL', 'call', min_days=90)
+    print(f"AAPL 90 天以上平值看涨: {atm['contractSymbol']} 到期 {atm['expiration'].date()} "
+          f"执行价 {atm['strike']} ({atm['moneyness']:.3f}), 价格 {atm['lastPrice']}")
+    puts = store.select('AAPL', 'put', moneyness=(0.9, 1.1))
+    print(f"AAPL ±10% 以内的看跌期权: {len(puts)} 个, {puts['expiration'].nunique()} 个到期日")
+    tsla = store.nearest('TSLA', 'call', min_days=30)
+    history = store.history('TSLA', tsla['expiration'], 'call', tsla['strike'])
+    print(f"TSLA {tsla['expiration'].date()} {tsla['strike']} 看涨在各快照:\n"
+          f"{history[['lastPrice', 'bid', 'ask', 'days', 'underlying_price']]}")
+
+    # 3. 和全表扫描对照：结果一样，速度
+    print(f"AAPL 最新快照整条链: {len(store.chain('AAPL'))} 个合约")
+    all_rows = store._rows(slice(None))
+    spot = store.spot('AAPL')
+    latest = all_rows['snapshot'] == all_rows.loc[all_rows['underlying'] == 'AAPL', 'snapshot'].max()
+
+    def scan():
+        mask = ((all_rows['underlying'] == 'AAPL') & latest & all_rows['optionType'].astype(str).str.contains('put')
+                & all_rows['strike'].between(0.9 * spot, 1.1 * spot))
+        return all_rows[mask]
+
+    assert np.array_equal(np.sort(scan()['contractSymbol'].to_numpy()), np.sort(puts['contractSymbol'].to_numpy()))
+    for name, query in [('全表扫描', scan), ('二分查找', lambda: store.select('AAPL', 'put', moneyness=(0.9, 1.1))),
+                        ('平值看涨', lambda: store.nearest('AAPL', 'call', min_days=90))]:
+        start = time.time()
+        for _ in range(200):
+            query()
+        print(f"{name}: 每次 {(time.time() - start) / 200 * 1000:.2f}毫秒")
+
+    # 4. 存成 Parquet，下次直接读
+    path = './option_chains.parquet'
+    store.save(path)
+    start = time.time()
+    loaded = OptionChainStore.load(path)
+    print(f"Parquet {os.path.getsize(path) / 1e6:.1f}MB, 读取用时 {time.time() - start:.2f}秒, {loaded}")
+    os.remove(path)
@@ -0,0 +1,309 @@
+'''
+隐含波动率曲面：
+
+第8天 / DEEPSEEK 的 analyze_options 把整条期权链压成一个 np.median(vols)，
+再用 BlackConstantVol 给所有期权定价——不同行权价、不同到期日的波动率差别（波动率微笑、期限结构）都丢了。
+
+VolSurface 对一个标的的期权快照：
+    1. 用 隐含波动率.chain_implied_vol 反解每个合约的隐含波动率（标的用平价关系反推的远期价格）
+    2. 每个到期日取虚值一侧、近期有成交的合约，在 对数虚实值 k = ln(K/F) 上拟合一条 SVI 微笑：
+           总方差 w(k) = a + b * (ρ(k - m) + sqrt((k - m)² + σ²))
+       合约太少的到期日用一条平的微笑（只有平值方差）
+    3. 5 个参数就是这个到期日的"插值系数"，查询时不用再拟合；
+       不同到期日之间在同一个 k 上对总方差按时间线性插值，最后一个到期日之后按波动率不变外推
+    4. vol(K, T) 接受数组，一次查任意多个点；to_quantlib() 导出 QuantLib BlackVarianceSurface
+    5. surface_from_file 按快照文件和拟合参数缓存（内存 + 文件旁边的 .surface_cache/），文件没变就不重新拟合
+
+用法：
+    surface = surface_from_file('./TSLA_options.xlsx', r=0.036)
+    surface.vol([400, 450], [0.25, 0.5])
+    vol_ts = surface.to_quantlib(ql.Date(26, 11, 2025))     # BlackVolTermStructureHandle
+'''
+
+import os
+import json
+import time
+import hashlib
+
+import numpy as np
+import pandas as pd
+import QuantLib as ql
+from scipy.optimize import least_squares
+
+from 期权分析 import load_chain, black_scholes
+from 隐含波动率 import chain_implied_vol
+
+SVI_PARAMS = ('a', 'b', 'rho', 'm', 'sigma')
+
+_memory = {}
+
+
+# ================= SVI =================
+def svi_total_variance(k, a, b, rho, m, sigma):
+    """SVI 原始参数化的总方差 w(k)，参数可以是数组（和 k 广播）"""
+    d = k - m
+    return a + b * (rho * d + np.sqrt(d * d + sigma * sigma))
+
+
+def fit_svi(k, w, weights=None):
+    """
+    对一个到期日的 (k, 总方差 w) 拟合 SVI，返回 (a, b, rho, m, sigma) 和拟合误差（总方差的 RMSE）
+    用 soft_l1 损失，个别成交价过期、明显偏离的点影响小一些
+    """
+    k, w = np.asarray(k, float), np.asarray(w, float)
+    weights = np.ones_like(w) if weights is None else np.asarray(weights, float)
+    atm = np.interp(0.0, k, w) if k.min() <= 0 <= k.max() else np.median(w)
+    x0 = [max(atm * 0.5, 1e-6), 0.1, -0.3, 0.0, 0.1]
+    lower = [-np.inf, 0.0, -0.999, k.min() - 1.0, 1e-4]
+    upper = [np.inf, 10.0, 0.999, k.max() + 1.0, 5.0]
+    scale = max(atm, 1e-6)
+
+    def residual(p):
+        return (svi_total_variance(k, *p) - w) / scale * weights
+
+    fit = least_squares(residual, x0, bounds=(lower, upper), loss='soft_l1', f_scale=0.05)
+    a, b, rho, m, sigma = fit.x
+    # 最低点的总方差不能小于 0
+    a = max(a, -b * sigma * np.sqrt(1 - rho * rho) + 1e-8)
+    params = (a, b, rho, m, sigma)
+    rmse = float(np.sqrt(np.mean((svi_total_variance(k, *params) - w) ** 2)))
+    return params, rmse
+
+
+# ================= 曲面 =================
+class VolSurface:
+    """
+    - slices: 每个到期日一行，列 expiration, T, forward, a, b, rho, m, sigma, points, rmse
+    - spot: 标的现价（由最近几个到期日的远期折回现在）
+    - r: 无风险利率
+    """
+
+    def __init__(self, slices, spot, r, valuation_date=None, symbol=None):
+        self.slices = slices.sort_values('T').reset_index(drop=True)
+        self.spot = float(spot)
+        self.r = float(r)
+        self.valuation_date = valuation_date
+        self.symbol = symbol
+        # 查询时用到的数组只准备一次
+        self._T = self.slices['T'].to_numpy(float)
+        self._params = self.slices[list(SVI_PARAMS)].to_numpy(float).T
+        self._log_forward = np.log(self.slices['forward'].to_numpy(float))
+
+    def __repr__(self):
+        return f"VolSurface({self.symbol}, 现价 {self.spot:.2f}, {len(self.slices)} 个到期日)"
+
+    # ---------- 拟合 ----------
+    @classmethod
+    def fit(cls, chain, r, min_points=5, max_moneyness=1.0, max_age_days=5, min_price=0.05, symbol=None):
+        """
+        从一张期权链（期权分析.load_chain 的结果）拟合曲面
+        - min_points: 一个到期日至少要有这么多有效合约才拟合 SVI，否则用平的微笑
+        - max_moneyness: 只用 |ln(K/F)| 不超过这个值的合约
+        - max_age_days: 最后成交距离快照超过这么多天的合约不用（价格过期）
+        - min_price: 价格低于这个值（最小报价单位附近）的合约不用
+        """
+        solved = chain_implied_vol(chain, r)
+        T = chain['T'].to_numpy(float)
+        forward = solved['spot'].to_numpy(float) * np.exp(r * T)
+        k = np.log(chain['strike'].to_numpy(float) / forward)
+        snapshot = pd.to_datetime(chain['lastTradeDate']).max()
+        age = (snapshot - pd.to_datetime(chain['lastTradeDate'])).dt.days.to_numpy()
+        otm = np.where(chain['is_call'].to_numpy(), k >= 0, k < 0)
+        use = (solved['converged'].to_numpy() & otm & (np.abs(k) <= max_moneyness) & (T > 0)
+               & (age <= max_age_days) & (solved['price'].to_numpy() >= min_price))
+        data = pd.DataFrame({'expiration': chain['expiration'], 'T': T, 'forward': forward, 'k': k,
+                             'w': solved['iv'].to_numpy() ** 2 * T})[use]
+
+        rows = []
+        for expiration, group in data.groupby('expiration'):
+            group = group.sort_values('k')
+            if len(group) >= min_points:
+                params, rmse = fit_svi(group['k'], group['w'])
+            else:
+                # 点太少：平的微笑，只保留平值附近的总方差
+                params, rmse = (float(group['w'].median()), 0.0, 0.0, 0.0, 0.1), float(group['w'].std(ddof=0))
+            rows.append(dict(zip(SVI_PARAMS, params), expiration=expiration, T=group['T'].iloc[0],
+                             forward=group['forward'].iloc[0], points=len(group), rmse=rmse))
+        if not rows:
+            raise ValueError('没有可以用来拟合波动率曲面的合约')
+        slices = pd.DataFrame(rows)[['expiration', 'T', 'forward', *SVI_PARAMS, 'points', 'rmse']]
+        near = slices.nsmallest(3, 'T')
+        spot = float(np.median(near['forward'] * np.exp(-r * near['T'])))
+        return cls(slices, spot, r, snapshot.normalize(), symbol)
+
+    # ---------- 查询 ----------
+    def forward(self, T):
+        """任意到期时间的远期价格：在各到期日的远期之间对 ln F 线性插值，最后一个到期日之后按 r 增长"""
+        T = np.asarray(T, float)
+        knots_t = np.r_[0.0, self._T]
+        knots_f = np.r_[np.log(self.spot), self._log_forward]
+        log_f = np.interp(T, knots_t, knots_f)
+        beyond = T > knots_t[-1]
+        log_f = np.where(beyond, knots_f[-1] + self.r * (T - knots_t[-1]), log_f)
+        return np.exp(log_f)
+
+    def total_variance(self, k, T):
+        """对数虚实值 k、到期时间 T 处的总方差（k、T 可以是互相广播的数组）"""
+        k, T = np.broadcast_arrays(np.asarray(k, float), np.asarray(T, float))
+        Ts, n = self._T, len(self._T)
+        i = np.clip(np.searchsorted(Ts, T, side='left'), 1, max(n - 1, 1))
+        lo, hi = i - 1, np.minimum(i, n - 1)
+        w_lo = svi_total_variance(k, *(p[lo] for p in self._params))
+        w_hi = svi_total_variance(k, *(p[hi] for p in self._params))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            frac = np.where(hi > lo, (T - Ts[lo]) / (Ts[hi] - Ts[lo]), 0.0)
+        w = w_lo + frac * (w_hi - w_lo)
+        # 第一个到期日之前 / 最后一个到期日之后：波动率不变，总方差和时间成正比
+        w = np.where(T < Ts[0], w_lo * T / Ts[0], w)
+        w = np.where(T > Ts[-1], w_hi * T / Ts[-1], w)
+        return np.maximum(w, 0.0)
+
+    def vol(self, K, T):
+        """行权价 K、到期时间 T（年）的隐含波动率，K、T 可以是数组"""
+        T = np.asarray(T, float)
+        k = np.log(np.asarray(K, float) / self.forward(T))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            vol = np.sqrt(self.total_variance(k, T) / T)
+        return vol if vol.ndim else float(vol)
+
+    def atm_vol(self, T):
+        """平值（K = 远期）的隐含波动率"""
+        return self.vol(self.forward(T), T)
+
+    def grid(self, moneyness=np.linspace(0.7, 1.3, 13), expiries=None):
+        """波动率表：行是 K / 现价，列是到期时间（默认所有到期日）"""
+        expiries = self._T if expiries is None else np.asarray(expiries, float)
+        K = self.spot * np.asarray(moneyness, float)[:, None]
+        return pd.DataFrame(self.vol(K, expiries[None, :]), index=np.round(moneyness, 4),
+                            columns=np.round(expiries, 4))
+
+    # ---------- QuantLib ----------
+    def to_quantlib(self, today=None, strikes=None, calendar=None, day_counter=None, shift=0.0):
+        """
+        导出 QuantLib BlackVarianceSurface（返回 BlackVolTermStructureHandle）
+        - today: 估值日，默认快照日期
+        - strikes: 行权价网格，默认现价的 50% ~ 200%（对数等距 41 个）
+        - shift: 整个曲面的波动率平移（情景分析用，0.01 即上移 1 个百分点）
+        日期用各个到期日，天数按 Actual365Fixed 换算
+        """
+        if today is None:
+            d = self.valuation_date
+            today = ql.Date(d.day, d.month, d.year)
+        calendar = calendar or ql.NullCalendar()
+        day_counter = day_counter or ql.Actual365Fixed()
+        if strikes is None:
+            strikes = self.spot * np.exp(np.linspace(np.log(0.5), np.log(2.0), 41))
+        strikes = np.asarray(strikes, float)
+        days = np.unique(np.maximum(np.round(self._T * 365).astype(int), 1))
+        T = days / 365
+        vols = np.maximum(self.vol(strikes[:, None], T[None, :]) + shift, 1e-4)
+        matrix = ql.Matrix(len(strikes), len(T))
+        for i in range(len(strikes)):
+            for j in range(len(T)):
+                matrix[i][j] = float(vols[i, j])
+        surface = ql.BlackVarianceSurface(today, calendar, [today + int(d) for d in days],
+                                          [float(s) for s in strikes], matrix, day_counter)
+        surface.enableExtrapolation()
+        return ql.BlackVolTermStructureHandle(surface)
+
+    # ---------- 保存 ----------
+    def save(self, path):
+        meta = {'spot': self.spot, 'r': self.r, 'symbol': self.symbol or '',
+                'valuation_date': str(self.valuation_date.date()) if self.valuation_date is not None else ''}
+        frame = self.slices.copy()
+        frame['expiration'] = frame['expiration'].astype('datetime64[ns]').astype('int64')
+        np.savez(path, **{c: frame[c].to_numpy() for c in frame.columns}, **{f'_{k}': v for k, v in meta.items()})
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path, allow_pickle=False)
+        columns = [c for c in data.files if not c.startswith('_')]
+        slices = pd.DataFrame({c: data[c] for c in columns})
+        slices['expiration'] = pd.to_datetime(slices['expiration'])
+        valuation = str(data['_valuation_date'])
+        return cls(slices, float(data['_spot']), float(data['_r']),
+                   pd.Timestamp(valuation) if valuation else None, str(data['_symbol']) or None)
+
+
+# ================= 按快照文件缓存 =================
+def _fit_hash(fit_kwargs):
+    """拟合参数的短哈希（按参数名排序），不同参数拟合出来的曲面分开缓存；没有参数时为空字符串"""
+    if not fit_kwargs:
+        return ''
+    text = json.dumps(fit_kwargs, sort_keys=True, default=str)
+    return hashlib.md5(text.encode()).hexdigest()[:10]
+
+
+def _cache_path(path, r, fit_kwargs=None):
+    folder, name = os.path.split(os.path.abspath(path))
+    stem = os.path.splitext(name)[0]
+    fit = _fit_hash(fit_kwargs)
+    return os.path.join(folder, '.surface_cache', f"{stem}.r{r:.6f}{'.' + fit if fit else ''}.npz")
+
+
+def surface_from_file(path, r, **fit_kwargs):
+    """
+    读取一个 *_options.xlsx 快照并拟合曲面；同一个文件（修改时间没变）、同一个利率只拟合一次：
+    进程内存里缓存一份，磁盘上缓存到文件旁边的 .surface_cache/
+    fit_kwargs 传给 VolSurface.fit；缓存键和缓存文件名都带上它的哈希，换一组参数会重新拟合
+    """
+    mtime = os.path.getmtime(path)
+    key = (os.path.abspath(path), mtime, round(r, 6), _fit_hash(fit_kwargs))
+    if key in _memory:
+        return _memory[key]
+    cache = _cache_path(path, r, fit_kwargs)
+    if os.path.exists(cache) and os.path.getmtime(cache) >= mtime:
+        surface = VolSurface.load(cache)
+    else:
+        symbol = os.path.basename(path).split('_')[0]
+        surface = VolSurface.fit(load_chain(path), r, symbol=symbol, **fit_kwargs)
+        os.makedirs(os.path.dirname(cache), exist_ok=True)
+        surface.save(cache)
+    _memory[key] = surface
+    return surface
+
+
+if __name__ == '__main__':
+    r = pd.read_excel('./US_Treasury_Yields.xlsx')['DGS1'].iloc[-1] / 100
+    path = './TSLA_options.xlsx'
+
+    chain = load_chain(path)
+    start = time.time()
+    surface = VolSurface.fit(chain, r, symbol='TSLA')
+    print(f"{surface}, 拟合用时 {time.time() - start:.2f}秒")
+    print(surface.slices[['expiration', 'T', 'forward', 'points', 'rmse']].to_string())
+    print(surface.grid(expiries=[1 / 12, 0.25, 0.5, 1.0, 2.0]).round(3))
+
+    # 缓存：第一次拟合并写入 .surface_cache，之后直接读
+    for label in ('第一次', '第二次（内存缓存）'):
+        start = time.time()
+        surface_from_file(path, r)
+        print(f"surface_from_file {label}: {(time.time() - start) * 1000:.1f}毫秒")
+    _memory.clear()
+    start = time.time()
+    cached = surface_from_file(path, r)
+    print(f"surface_from_file 新进程（磁盘缓存）: {(time.time() - start) * 1000:.1f}毫秒")
+
+    # 批量查询
+    n = 1_000_000
+    rng = np.random.default_rng(0)
+    K = surface.spot * rng.uniform(0.6, 1.5, n)
+    T = rng.uniform(0.02, 2.0, n)
+    start = time.time()
+    vols = cached.vol(K, T)
+    print(f"vol(K, T) 批量查询 {n} 个点, 用时 {(time.time() - start) * 1000:.0f}毫秒")
+
+    # 和市场价格对照：用曲面波动率重新给链上合约定价
+    solved = chain_implied_vol(chain, r)
+    liquid = solved['converged'] & (solved['price'] >= 1.0) & (chain['T'] > 7 / 365)
+    sub = chain[liquid]
+    model = black_scholes(solved['spot'][liquid], sub['strike'], sub['T'], r,
+                          surface.vol(sub['strike'], sub['T']), sub['is_call'].to_numpy())
+    error = np.abs(model - solved['price'][liquid]) / solved['price'][liquid]
+    print(f"{liquid.sum()} 个价格 >= $1 的合约, 曲面定价的相对误差中位数 {np.median(error):.2%}")
+
+    # QuantLib 曲面和自己的查询对照
+    handle = surface.to_quantlib()
+    for strike, t in [(surface.spot, 0.25), (surface.spot * 0.9, 0.5), (surface.spot * 1.2, 1.0)]:
+        print(f"K={strike:.1f}, T={t}: VolSurface {surface.vol(strike, t):.4f}, "
+              f"QuantLib BlackVarianceSurface {handle.blackVol(t, float(strike)):.4f}")
@@ -15,8 +15,9 @@ import pandas as pd
 import numpy as np
 import datetime as dt
 from yahooquery import Ticker
-from math import log, sqrt, exp
-from scipy.stats import norm
+
+from 期权分析 import black_scholes, bs_greeks
+from 情景网格 import ScenarioGrid
 
 # =========Black-Scholes 定价函数===========
 '''black-scholes是用于定价欧式期权的数学模型'''
@@ -28,14 +29,8 @@ r = 无风险利率
 sigma = 波动率
 option_type = 看涨/看跌
 '''
-def black_scholes(S, K, T, r, sigma, option_type='call'):
-    d1 = (log(S/K) + (r + 0.5*sigma**2)* T) / (sigma*sqrt(T))
-    d2 = d1 - sigma*sqrt(T)
-    if option_type == "call":
-        price = S*norm.cdf(d1) - K*exp(-r*T)*norm.cdf(d2)
-    else: # put
-        price = K*exp(-r*T)*norm.cdf(-d2) - S*norm.cdf(-d1)
-    return price
+# black_scholes(S, K, T, r, sigma, option_type) 移到了 期权分析.py：
+# 参数不变，但每个参数都可以是数组，一次给整条期权链定价；option_type 写 'call' 或 'calls' 都可以
 
 # 获取期权数据
 symbol = 'AAPL'
@@ -77,26 +72,36 @@ print(f"市场价格: {first_row['lastPrice']}")
 
 
 # ==========计算Greeks(敏感性)==================
-d1 = (log(S0/K) + (r + 0.5*sigma**2)*T) / (sigma*sqrt(T))
-d2 = d1 - sigma*sqrt(T)
-
-Delta = norm.cdf(d1) if option_type=="calls" else norm.cdf(d1) -1
-Gamma = norm.pdf(d1) / (S0*sigma*sqrt(T))
-Vega = S0 * norm.pdf(d1) * sqrt(T) / 100
-Theta = (-S0*norm.pdf(d1)*sigma/(2*sqrt(T)) - r*K*exp(-r*T)*norm.cdf(d2)) / 365 if option_type=='calls' else ...
-Rho = K*T*exp(-r*T)*norm.cdf(d2)/100 if option_type=='calls' else ...
+# d1 / d2 只算一次, 看涨看跌都有; 二阶希腊值 (vanna, volga, charm, veta) 也在里面
+greeks = bs_greeks(S0, K, T, r, sigma, option_type)
+Delta = greeks['delta']
+Gamma = greeks['gamma']
+Vega = greeks['vega'] / 100     # 波动率变化 1% 的价格变化
+Theta = greeks['theta'] / 365   # 每天的时间损耗
+Rho = greeks['rho'] / 100       # 利率变化 1% 的价格变化
+print(f"Delta={Delta:.4f}, Gamma={Gamma:.6f}, Vega={Vega:.4f}, Theta={Theta:.4f}, Rho={Rho:.4f}")
 
 # =======敏感性分析 ( 波动率 和 到期时间)
+# black_scholes 的参数可以是数组，一次算完所有波动率 / 所有到期时间
 print(f"=====波动率敏感性分析 (Vega)=====")
-for vol in [0.1, 0.2, 0.3, 0.5]:
-    price = black_scholes(S0, K, T, r, vol, option_type)
+vols = np.array([0.1, 0.2, 0.3, 0.5])
+for vol, price in zip(vols, black_scholes(S0, K, T, r, vols, option_type)):
     print(f"波动率{vol*100:.0f}% -> 价格: {price:.4f}")
 
 print(f"=====到期时间敏感性分析 (Theta)===== ")
-for t_year in [0.25, 0.5, 1, 2]:
-    price = black_scholes(S0, K, t_year, r, sigma, option_type)
+maturities = np.array([0.25, 0.5, 1, 2])
+for t_year, price in zip(maturities, black_scholes(S0, K, maturities, r, sigma, option_type)):
     print(f"到期: {t_year:.2f}年 -> 价格: {price:.4f}")
 
+# 情景网格.ScenarioGrid 一次算完 现价 x 波动率（相对 sigma 的变化）的所有组合
+grid = ScenarioGrid(r)
+grid.add_underlying(symbol, S0)
+grid.add_option(symbol, K, T, sigma, option_type, quantity=1, multiplier=1)   # 一股的价格
+
+print(f"=====现价 x 波动率 情景表=====")
+table = grid.value(spot=np.linspace(-0.2, 0.2, 5), vol=[-0.1, 0.0, 0.1]).sel(rate=0, days=0).to_frame()
+print(table.round(4))
+
 
 '''             我们用明天的来计算吧. '''
 
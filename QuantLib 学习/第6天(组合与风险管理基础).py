@@ -9,10 +9,17 @@ Day 6：组合与风险管理基础
 输出：完整的组合风险分析脚本
 '''
 
+import time
+
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
-from scipy.stats import norm
+
+from 期权分析 import load_chain, bs_greeks, snapshot_date
+from 隐含波动率 import chain_implied_vol, STATUS_NAMES
+from 风险引擎 import RiskEngine, security_cashflows, shock_parameters
+from 分位数草图 import QuantileSketch
+from 期权链库 import OptionChainStore
 
 # 设置中文字体显示
 plt.rcParams['font.sans-serif'] = ['SimHei']  # 使用黑体显示中文
@@ -32,7 +39,7 @@ class InteractivePortfolioRiskAnalyzer:
     def load_data(self):
         '''
         加载真实市场数据
-        从三个文件读取：国债收益率、债券信息、AAPL期权数据
+        从四个文件读取：国债收益率、债券信息、AAPL期权数据、AAPL股价（估计风险因子参数）
         '''
         print("加载真实数据中.....")
         try:
@@ -43,16 +50,31 @@ class InteractivePortfolioRiskAnalyzer:
             # 加载债券数据
             securities = pd.read_csv('./Securities.csv')
 
-            # 加载AAPL期权数据，分别读取看涨和看跌期权
-            calls = pd.read_excel('AAPL_options.xlsx', sheet_name='Calls')
-            puts = pd.read_excel('AAPL_options.xlsx', sheet_name='Puts')
-            # 合并看涨和看跌期权数据
-            options = pd.concat([calls, puts], ignore_index=True)
+            # 加载AAPL期权数据，看涨和看跌期权合并成一张表（带到期年数 T）
+            options = load_chain('AAPL_options.xlsx')
+            # 数据商的 impliedVolatility 不可靠，用期权价格自己反解隐含波动率
+            solved = chain_implied_vol(options, r=latest_yield)
+            options['iv'] = solved['iv']
+            options['iv_converged'] = solved['converged']
+            options['spot'] = solved['spot']            # 平价关系反推的标的价格
+
+            # AAPL 历史股价：和国债收益率一起估计股价、利率冲击的波动率和相关系数
+            self.stock_prices = pd.read_excel('AAPL_stock.xlsx')
+            self.treasury = treasury
+            self.rate = latest_yield
+            self.spot = options.loc[options['iv_converged'], 'spot'].median()
+
+            # 反解收敛、价格有效的合约放进期权链库：按 (到期日, 类型, 执行价) 排序建索引，后面按条件二分查找
+            usable = options.dropna(subset=['lastPrice', 'strike', 'iv'])
+            self.chain_store = OptionChainStore().add(usable[usable['iv_converged']], 'AAPL',
+                                                      snapshot_date(options), spot=self.spot)
 
             # 打印数据加载信息
             print(f"10年期国债收益率: {latest_yield * 100:.2f}%")
             print(f"证券数据: {len(securities)} 条记录")
             print(f"期权数量: {len(options)} 个合约")
+            print(f"隐含波动率反解: " + ", ".join(
+                f"{STATUS_NAMES[k]} {v} 个" for k, v in solved['status'].value_counts().sort_index().items()))
 
             return treasury, securities, options, latest_yield
 
@@ -86,6 +108,13 @@ class InteractivePortfolioRiskAnalyzer:
             for i, bond in valid_bonds.head(num_bonds).iterrows():
                 price = bond['Price per $100']  # 债券价格(每100面值)
 
+                # 每100面值的现金流：Bill 到期一次支付，Note / Bond 按票面利率每半年付息，
+                # 浮息票据（FRN）按下一个重置日偿付面值；TIPS 按实际收益率定价，名义利率情景下无法重估，跳过
+                kind, times, cashflows = security_cashflows(bond)
+                if times is None:
+                    print(f"跳过债券 {i + 1}: {bond['Security Type']} {bond.get('Security Term', '')} 疑似 TIPS")
+                    continue
+
                 # 让用户输入每个债券的投资金额
                 try:
                     notional = float(input(
@@ -98,22 +127,14 @@ class InteractivePortfolioRiskAnalyzer:
                 # 计算债券实际价值: 价格 × 面值 / 100
                 value = price * notional / 100
 
-                # 根据债券类型估计波动率
-                bond_type = bond['Security Type']
-                if "Bill" in bond_type:     # 短期票据波动率较低
-                    vol = 0.05
-                elif "Note" in bond_type:   # 中期票据波动率中等
-                    vol = 0.08
-                else:                       # 其他类型债券
-                    vol = 0.07
-
                 # 将债券信息添加到列表
                 bonds.append({
-                    'name': f"{bond['Security Type']} {bond.get('Security Term', '')}",
+                    'name': f"{bond['Security Type']} {bond.get('Security Term', '')}" + (' FRN' if kind == 'frn' else ''),
                     'value': value,             # 债券价值
                     'price': price,             # 债券价格
                     'notional': notional,       # 投资面值
-                    'vol': vol                  # 估计波动率
+                    'times': times,             # 现金流时间（距发行日的年数）
+                    'cashflows': cashflows      # 每100面值的现金流
                 })
 
         # 处理无数据情况
@@ -137,9 +158,9 @@ class InteractivePortfolioRiskAnalyzer:
 
         if options is not None and not options.empty:
             # 过滤有效的期权数据（有价格、行权价、隐含波动率）
-            valid_options = options.dropna(subset=['lastPrice', 'strike', 'impliedVolatility'])
-            # 过滤掉异常高的隐含波动率（>100%）
-            valid_options = valid_options[valid_options['impliedVolatility'] <= 1.0]
+            valid_options = options.dropna(subset=['lastPrice', 'strike', 'iv'])
+            # 只保留反解收敛的合约（代替原来按数据商 IV <= 100% 过滤）
+            valid_options = valid_options[valid_options['iv_converged']]
 
             print(f"\n找到 {len(valid_options)} 个有效的期权数据")
 
@@ -153,21 +174,16 @@ class InteractivePortfolioRiskAnalyzer:
 
             selected_options = []       # 存储选中的期权数据
 
-            # 分离看涨和看跌期权
-            calls = valid_options[valid_options['optionType'].str.contains('call', case=False, na=False)]
-            puts = valid_options[valid_options['optionType'].str.contains('put', case=False, na=False)]
-
-            # 选择实值看涨期权（行权价低于当前股价）
-            if not calls.empty:
-                itm_call = calls[calls['strike'] < 170].head(1)   # 假设股价$180
-                if not itm_call.empty:
-                    selected_options.append(itm_call.iloc[0])
+            # 从期权链库按条件查询（二分查找），不再对整张表做 str.contains 和写死股价的 strike < 170 筛选
+            # 选择实值看涨期权：90 天以上最近的到期日里，执行价最接近 现价 x 90% 的看涨期权
+            itm_call = self.chain_store.nearest('AAPL', 'call', min_days=90, moneyness=0.9)
+            if itm_call is not None:
+                selected_options.append(itm_call)
 
-            # 选择虚值看跌期权（行权价低于当前股价）
-            if not puts.empty:
-                otm_put = puts[puts['strike'] < 170].head(1)
-                if not otm_put.empty:
-                    selected_options.append(otm_put.iloc[0])
+            # 选择虚值看跌期权（行权价低于当前股价）：同一个到期日，执行价最接近 现价 x 90% 的看跌期权
+            otm_put = self.chain_store.nearest('AAPL', 'put', min_days=90, moneyness=0.9)
+            if otm_put is not None:
+                selected_options.append(otm_put)
 
             # 如果选择的期权数量不够，补充一些
             if len(selected_options) < num_options and not valid_options.empty:
@@ -191,20 +207,12 @@ class InteractivePortfolioRiskAnalyzer:
                 # 计算期权总价值：价格 × 数量 × 100（每手100股）
                 value = opt['lastPrice'] * quantity * 100
 
-                # 限制隐含波动率在合理范围内
-                volatility = min(opt['impliedVolatility'], 0.8)
-
-                # 计算期权Delta值（对股价变动的敏感度）
-                if opt_type == '看涨':
-                    moneyness = (180 - opt['strike']) / 180  # 虚实值程度
-                    delta = max(0.1, min(0.9, 0.5 + moneyness * 0.5))   # 看涨Delta在0.1-0.9之间
-                else:
-                    moneyness = (opt['strike'] - 180) / 180
-                    delta = min(-0.1, max(-0.9, -0.5 + moneyness * 0.5))    # 看跌Delta在-0.9到-0.1之间
+                # 用自己反解的隐含波动率，限制在合理范围内（快到期的深度虚值合约反解出来可能几百%）
+                volatility = min(opt['iv'], 0.8)
 
-                # 判断期权虚实值状态
-                moneyness_status = "实值" if (opt['strike'] < 180 and opt_type == '看涨') or (
-                    opt['strike'] > 180 and opt_type == "看跌") else '虚值'
+                # 计算期权Delta值（对股价变动的敏感度）：用平价关系反推的股价和反解的波动率，Black-Scholes 解析值
+                delta = bs_greeks(opt['spot'], opt['strike'], opt['T'], self.rate, volatility,
+                                  opt['is_call'])['delta']
 
                 # 创建期权信息字典
                 option_info = {
@@ -215,7 +223,9 @@ class InteractivePortfolioRiskAnalyzer:
                     'strike': opt['strike'],   # 行权价
                     'quantity': quantity,    # 购买手数
                     'delta': delta,          # Delta值
-                    'vol': volatility        # 波动率
+                    'vol': volatility,       # 波动率
+                    'spot': opt['spot'],     # 标的价格
+                    'T': opt['T']            # 剩余期限（年）
                 }
                 option_portfolio.append(option_info)
 
@@ -227,17 +237,19 @@ class InteractivePortfolioRiskAnalyzer:
             print("\n期权投资详情:")
             for option in option_portfolio:
                 # 重新计算虚实值状态用于显示
-                moneyness_status = '实值' if (option['strike'] < 180 and option['type'] == '看涨') or (
-                    option['strike'] > 180 and option['type'] == '看跌') else '虚值'
+                moneyness_status = '实值' if (option['strike'] < option['spot']) == (option['type'] == '看涨') else '虚值'
                 print(f"✓ {option['name']} ({moneyness_status}): 价格${option['price']:.2f}, "
                       f"{option['quantity']}手, 价值${option['value']:,.0f}")
 
         return option_portfolio
 
-    def monte_carlo_var(self, bonds, options, simulations=5000, days=10):
+    def monte_carlo_var(self, bonds, options, simulations=1_000_000, days=10):
         """
         蒙特卡洛模拟计算风险价值(VaR)
-        通过模拟市场情景来估计组合的未来价值分布
+        模拟股价和利率的相关冲击，每个情景下每只债券（现金流贴现）、每个期权（Black-Scholes）都全量重估，
+        情景按块生成和计算（风险引擎.RiskEngine），不再用 Delta 近似期权损益；
+        每块的损益直接写入分位数草图（分位数草图.QuantileSketch），不保留整个损益数组，情景数不受内存限制
+        返回 (当前组合价值, 损益草图)
         """
         # 计算当前组合价值
         bond_value = sum(b['value'] for b in bonds) if bonds else 0
@@ -247,7 +259,7 @@ class InteractivePortfolioRiskAnalyzer:
         # 检查组合价值是否有效
         if total_value == 0:
             print(f"组合总价值为0，无法进行风险分析")
-            return 0, np.array([0])
+            return 0, QuantileSketch()
 
         # 打印组合价值分析
         print(f"\n" + "=" * 50)
@@ -257,73 +269,36 @@ class InteractivePortfolioRiskAnalyzer:
         print(f"期权总价值: ${option_value:,.2f}")
         print(f"组合总价值: ${total_value:,.2f}")
 
-        # 计算平均波动率
-        bond_vol = np.mean([b['vol'] for b in bonds]) if bonds else 0
-        option_vols = [o['vol'] for o in options] if options else [0.25]
-        option_vol = np.mean(option_vols)
-
-        # 计算期权组合平均Delta值
-        option_deltas = [abs(o['delta']) for o in options] if options else [0.5]
-        avg_delta = np.mean(option_deltas)
-
-        print(f"债券波动率: {bond_vol:.1%}")
-        print(f"期权波动率: {option_vol:.1%}")
-        print(f"期权平均Delta: {avg_delta:.2f}")
-
-        # 设置随机数种子确保结果可重现
-        np.random.seed(42)
-        # 计算时间调整因子（将年波动率转换为指定天数的波动率）
-        time_factor = np.sqrt(days / 252)  # 252个交易日
-
-        # 生成相关的随机数（债券和股票收益的相关性为30%）
-        correlation = 0.3
-        z1 = np.random.normal(0, 1, simulations)  # 债券随机冲击
-        # 股票随机冲击（与债券相关）
-        z2 = correlation * z1 + np.sqrt(1 - correlation ** 2) * np.random.normal(0, 1, simulations)
-
-        # 计算债券和股票的收益率冲击
-        bond_returns = z1 * bond_vol * time_factor
-        stock_returns = z2 * option_vol * time_factor
-
-        # 模拟未来组合价值
-        future_values = []
-        for i in range(simulations):
-            # 债券价值变化
-            bond_change = bond_value * bond_returns[i] if bonds else 0
-            # 期权价值变化（考虑Delta暴露）
-            option_change = option_value * avg_delta * stock_returns[i] if options else 0
-            # 计算未来价值
-            future_value = total_value + bond_change + option_change
-            future_values.append(future_value)
-
-        return total_value, np.array(future_values)
-
-    def calculate_risk(self, current_value, future_values):
+        # 风险因子参数：最近一年 AAPL 日收益率、10年期国债收益率日变化的波动和相关系数
+        params = shock_parameters(self.stock_prices, self.treasury)
+        engine = RiskEngine(self.spot, self.rate, horizon_days=days, **params)
+        for b in bonds:
+            engine.add_bond(b['name'], b['times'], b['cashflows'], b['price'], b['notional'])
+        for o in options:
+            engine.add_option(o['name'], o['strike'], o['T'], o['vol'], 'call' if o['type'] == '看涨' else 'put',
+                              o['quantity'], market_value=o['value'])
+
+        print(f"股价波动率: {params['stock_vol']:.1%}")
+        print(f"利率波动: {params['rate_vol'] * 1e4:.0f}bp/年, 股价与利率相关系数: {params['correlation']:.2f}")
+        if options:
+            print(f"期权组合Delta: {sum(o['delta'] * o['quantity'] * 100 for o in options):,.1f} 股")
+
+        # 分块模拟 + 全量重估（随机数种子固定，结果可重现）
+        start = time.time()
+        pnl_sketch = engine.simulate_sketch(simulations, seed=42)
+        print(f"{simulations:,} 个情景全量重估, 用时 {time.time() - start:.2f}秒")
+
+        return total_value, pnl_sketch
+
+    def calculate_risk(self, pnl_sketch, levels=(0.95, 0.99, 0.999)):
         """
-        计算风险指标：VaR和CVaR
+        计算风险指标：各个置信水平的 VaR 和 CVaR（由损益草图得到，相对误差不超过 0.1%）
         VaR: 风险价值，在一定置信水平下的最大可能损失
         CVaR: 条件风险价值，超过VaR的期望损失
         """
-        # 计算损益分布
-        pnl = future_values - current_value
-
-        # 计算95%置信水平的VaR（取第5百分位数的负值）
-        var_95 = -np.percentile(pnl, 5)
-        # 计算99%置信水平的VaR（取第1百分位数的负值）
-        var_99 = -np.percentile(pnl, 1)
-
-        # 计算CVaR（超过VaR的所有损失的平均值）
-        cvar_95 = -pnl[pnl <= -var_95].mean()
-        cvar_99 = -pnl[pnl <= -var_99].mean()
-
-        return {
-            '95% VaR': var_95,   # 95%置信水平下的风险价值
-            '95% CVaR': cvar_95, # 95%置信水平下的条件风险价值
-            '99% VaR': var_99,   # 99%置信水平下的风险价值
-            '99% CVaR': cvar_99  # 99%置信水平下的条件风险价值
-        }, pnl
-
-    def plot_results(self, pnl, risk_metrics, bonds, options):
+        return pnl_sketch.var_cvar(levels)
+
+    def plot_results(self, pnl_sketch, risk_metrics, bonds, options):
         '''
         绘制风险分析结果图表
         包含4个子图：损益分布、风险指标比较、组合成分、风险指标汇总
@@ -331,8 +306,9 @@ class InteractivePortfolioRiskAnalyzer:
         # 创建2x2的子图布局
         fig, ((ax1, ax2), (ax3, ax4)) = plt.subplots(2, 2, figsize=(12, 10))
 
-        # 子图1：损益分布直方图
-        ax1.hist(pnl, bins=50, alpha=0.7, color='lightblue', edgecolor='black')
+        # 子图1：损益分布直方图（草图的桶计数汇总成 50 个区间）
+        counts, edges = pnl_sketch.histogram(50)
+        ax1.hist(edges[:-1], edges, weights=counts, alpha=0.7, color='lightblue', edgecolor='black')
         # 标记VaR水平线
         ax1.axvline(-risk_metrics['95% VaR'], color='red', linestyle='--', label='95% VaR')
         ax1.axvline(-risk_metrics['99% VaR'], color='darkred', linestyle='--', label='99% VaR')
@@ -406,8 +382,10 @@ class InteractivePortfolioRiskAnalyzer:
             return
 
         # 3. 蒙特卡洛模拟计算风险
-        current_value, future_values = self.monte_carlo_var(bonds, option_portfolio)
-        risk_metrics, pnl = self.calculate_risk(current_value, future_values)
+        current_value, pnl_sketch = self.monte_carlo_var(bonds, option_portfolio)
+        if current_value == 0:
+            return
+        risk_metrics = self.calculate_risk(pnl_sketch)
 
         # 4. 显示风险分析结果
         print(f"\n📊 风险分析结果 (10天持有期):")
@@ -416,7 +394,7 @@ class InteractivePortfolioRiskAnalyzer:
             print(f"  {metric}: ${value:,.2f} ({value / current_value * 100:.2f}%)")
 
         # 5. 绘制结果图表
-        self.plot_results(pnl, risk_metrics, bonds, option_portfolio)
+        self.plot_results(pnl_sketch, risk_metrics, bonds, option_portfolio)
 
         print("\n✅ 分析完成!")
 
@@ -17,8 +17,14 @@ import matplotlib.pyplot as plt
 import scipy.optimize as sco
 import QuantLib as ql
 import os
+import sys
 from datetime import datetime, timedelta
 
+# 滚动协方差引擎在 多因子学习 目录里
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '多因子学习'))
+from 滚动协方差 import RollingCovariance
+from 分位数草图 import QuantileSketch
+
 
 
 # 设置中文字体,
@@ -37,6 +43,7 @@ class SmartPortfolioOptimizer:
         '''
         self.risk_free_rate = 0.02  # 无风险利率, 默认2%
         self.max_stocks = max_stocks
+        self._cov_cache = (None, None, None)  # (收益率数据, (window, halflife), 年化协方差矩阵), 同一份数据只算一次
 
     def load_all_stock_data(self):
         '''
@@ -176,7 +183,7 @@ class SmartPortfolioOptimizer:
         print(f"\n 进行投资组合优化 - {method}...")
         # 计算年化统计量
         expected_returns = returns_df.mean() * 252  # 年化期望收益
-        cov_matrix = returns_df.cov() * 252         # 年化协方差矩阵
+        cov_matrix = self.annual_covariance(returns_df)     # 年化协方差矩阵
 
         n_assets = len(expected_returns)    # 资产数量
         print(f" 优化资产数量: {n_assets}")
@@ -215,6 +222,21 @@ class SmartPortfolioOptimizer:
             # 优化失败时使用等权重作为备选方案
             return self._equal_weight_fallback(returns_df, expected_returns, cov_matrix)
 
+    def annual_covariance(self, returns_df, window=None, halflife=None):
+        '''
+        年化协方差矩阵
+        功能: 用 RollingCovariance 计算 (结果和 returns_df.cov() 相同),
+            portfolio_optimization 和 efficient_frontier_analysis 共用同一份结果, 不再各算一遍
+        参数: window: 只用最近 window 个交易日; halflife: 按半衰期做 EWMA 加权; 都不给时用全部数据
+        '''
+        # 缓存里保留收益率数据本身并用 is 比较: 只比较 id 的话, 旧数据被释放后 id 可能被新的 DataFrame 复用
+        cached, params, cov = self._cov_cache
+        if cached is not returns_df or params != (window, halflife):
+            engine = RollingCovariance(returns_df, window=window, halflife=halflife)
+            cov = engine.cov() * 252
+            self._cov_cache = (returns_df, (window, halflife), cov)
+        return cov
+
     def _calculate_sharpe(self, weights, expected_returns, cov_matrix):
         '''
         计算夏普比率的辅助函数
@@ -280,25 +302,23 @@ class SmartPortfolioOptimizer:
         print("\n 生成有效前沿...")
 
         expected_returns = returns_df.mean() * 252
-        cov_matrix = returns_df.cov() * 252
+        cov_matrix = self.annual_covariance(returns_df)    # 和 portfolio_optimization 共用
         n_assets = len(expected_returns)
 
         n_portfolios = 5000 # 模拟的投资组合数量
         results = np.zeros((3, n_portfolios))   # 存储结果: 收益, 风险, 夏普比率
 
-        # 蒙特卡洛模拟：随机生成权重，计算组合表现
-        for i in range(n_portfolios):
-            # 生成随机权重
-            weights = np.random.random(n_assets)
-            weights /= weights.sum()    # 归一化权重
-            # 计算组合表现
-            port_return = np.sum(weights * expected_returns)
-            port_vol = self._calculate_volatility(weights, cov_matrix)
-            sharpe_ratio = self._calculate_sharpe(weights, expected_returns, cov_matrix)
-            # 存储结果
-            results[0, i] = port_return # 收益
-            results[1, i] = port_vol    # 风险
-            results[2, i] = sharpe_ratio    # 夏普比率
+        # 蒙特卡洛模拟：一次生成所有随机权重 (和逐个 np.random.random(n_assets) 的随机数顺序相同)
+        weights = np.random.random((n_portfolios, n_assets))
+        weights /= weights.sum(axis=1, keepdims=True)  # 每行归一化
+        # 一次矩阵运算算出所有组合的表现
+        cov = cov_matrix.to_numpy()
+        port_return = weights @ expected_returns.to_numpy()
+        port_vol = np.sqrt(np.einsum('ij,jk,ik->i', weights, cov, weights))
+        results[0] = port_return    # 收益
+        results[1] = port_vol       # 风险
+        # 夏普比率, 波动率为 0 时记为 0 (和 _calculate_sharpe 一样)
+        results[2] = np.where(port_vol == 0, 0, (port_return - self.risk_free_rate) / np.where(port_vol == 0, 1, port_vol))
         return results
 
     def plot_optimization_results(self, returns_df, weights, performance, efficient_frontier=None):
@@ -397,11 +417,13 @@ class SmartPortfolioOptimizer:
         # 计算投资组合的日收益率
         portfolio_returns = (returns_df * list(weights.values())).sum(axis=1)
 
-        # VaR计算 (Value at Risk)
+        # VaR / CVaR 计算：收益率写入分位数草图（数据再多内存也不变，多段数据的草图可以直接合并）
+        sketch = QuantileSketch().update(portfolio_returns)
+        risk = {name: value * 100 for name, value in sketch.var_cvar((0.95, 0.99)).items()}
         # 95% VaR: 有95% 的把握损失不会超过这个值
-        var_95 = -np.percentile(portfolio_returns, 5) * 100
+        var_95 = risk['95% VaR']
         # 99% VaR: 有99% 的把握损失不会超过这个值
-        var_99 = -np.percentile(portfolio_returns, 1) * 100
+        var_99 = risk['99% VaR']
 
         # 最大回撤计算
         cumulative = (1+ portfolio_returns).cumprod()   # 累积收益
@@ -411,6 +433,7 @@ class SmartPortfolioOptimizer:
 
         print(f"日VaR (95%): {var_95:.2f}%")
         print(f"日VaR (99%): {var_99:.2f}%")
+        print(f"日CVaR (95%): {risk['95% CVaR']:.2f}%, 日CVaR (99%): {risk['99% CVaR']:.2f}%")
         print(f"最大回撤: {max_drawdown:.2f}%")
 
     def run_complete_analysis(self):
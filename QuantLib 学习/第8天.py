@@ -15,6 +15,9 @@ import QuantLib as ql
 from scipy.optimize import minimize
 import glob, os
 
+from 波动率曲面 import surface_from_file
+from 期权簿 import OptionBook
+
 
 # ----------------------------
 # 定义投资组合分析类
@@ -29,6 +32,7 @@ class QuantitativePortfolioAnalyzer:
         self.optimal_weights = None    # 优化后的组合权重
         self.portfolio_metrics = {}    # 投资组合指标
         self.rf_rate = 0.04            # 默认无风险利率
+        self.option_book = None        # QuantLib 期权簿（只建一次）
 
     # ----------------------------
     # 加载数据
@@ -126,21 +130,28 @@ class QuantitativePortfolioAnalyzer:
     # 期权分析
     # ----------------------------
     def analyze_options(self):
-        vols =[]
-        strikes = []
-
-        # 提取隐含波动率和行权价
-        for idx, row in self.options.iterrows():
-            iv = pd.to_numeric(row.get('impliedVolatility', np.nan), errors='coerce')
-            strike=pd.to_numeric(row.get('strike', np.nan), errors='coerce')
-            if not pd.isna(iv) and iv>0:
-                vols.append(iv)
-            if not pd.isna(strike):
-                strikes.append(strike)
+        # 每个期权文件（标的）拟合一个隐含波动率曲面，按文件缓存；不再把整条期权链压成一个中位数
+        self.vol_surfaces = {}
+        for f in self.options['Source_File'].unique():
+            try:
+                surface = surface_from_file(os.path.join('.', f), self.rf_rate)
+                self.vol_surfaces[surface.symbol] = surface
+            except Exception as e:
+                print(f"{f} 波动率曲面拟合失败: {e}")
 
-        # 使用中位数波动率和平均行权价
-        self.avg_option_vol = np.median(vols)*100 if vols else 50
-        self.underlying_price = np.mean(strikes)*1.05 if strikes else 200
+        if self.vol_surfaces:
+            # 各标的 90 天平值波动率的中位数；希腊值用第一个标的的现价和曲面
+            atm_vols = {symbol: s.atm_vol(90/365) for symbol, s in self.vol_surfaces.items()}
+            self.vol_surface = next(iter(self.vol_surfaces.values()))
+            self.avg_option_vol = np.median(list(atm_vols.values()))*100
+            self.underlying_price = self.vol_surface.spot
+            print("90天平值波动率: " + ", ".join(f"{s} {v*100:.1f}%" for s, v in atm_vols.items()))
+        else:
+            self.vol_surface = None
+            vols = pd.to_numeric(self.options['impliedVolatility'], errors='coerce')
+            strikes = pd.to_numeric(self.options['strike'], errors='coerce').dropna()
+            self.avg_option_vol = vols[vols > 0].median()*100 if (vols > 0).any() else 50
+            self.underlying_price = strikes.mean()*1.05 if len(strikes) else 200
         print(f"平均期权隐含波动率: {self.avg_option_vol:.2f}%")
         return True
 
@@ -148,29 +159,20 @@ class QuantitativePortfolioAnalyzer:
     # 期权希腊值计算
     # ----------------------------
     def calculate_optino_greeks(self):
-        today=ql.Date.todaysDate()
-        ql.Settings.instance().evaluationDate=today
-
-        # 定义欧式看涨期权
-        payoff = ql.PlainVanillaPayoff(ql.Option.Call, self.underlying_price)
-        exercise = ql.EuropeanExercise(today+ql.Period(90, ql.Days))
-        option = ql.VanillaOption(payoff, exercise)
-
-        # 构建定价过程
-        spot = ql.QuoteHandle(ql.SimpleQuote(self.underlying_price))
-        flat_ts = ql.YieldTermStructureHandle(ql.FlatForward(today, self.rf_rate, ql.Actual365Fixed()))
-        div_ts = ql.YieldTermStructureHandle(ql.FlatForward(today, 0.01, ql.Actual365Fixed()))
-        vol_ts = ql.BlackVolTermStructureHandle(
-            ql.BlackConstantVol(today, ql.NullCalendar(), self.avg_option_vol/100, ql.Actual365Fixed()))
-        process = ql.BlackScholesMertonProcess(spot, div_ts, flat_ts, vol_ts)
-
-        option.setPricingEngine(ql.AnalyticEuropeanEngine(process))
+        # 期权簿只建一次：现价、利率、股息率、波动率都挂在 SimpleQuote 上，情景分析只需改报价
+        if self.option_book is None:
+            symbol = self.vol_surface.symbol if self.vol_surface is not None else 'underlying'
+            self.option_book = OptionBook(ql.Date.todaysDate())
+            self.option_book.add_underlying(symbol, self.underlying_price, self.rf_rate, q=0.01,
+                                            vol=self.avg_option_vol/100, vol_surface=self.vol_surface)
+            # 90 天平值欧式看涨期权
+            self.option_book.add_option(symbol, self.underlying_price, 90/365, 'call')
+        greeks = self.option_book.greeks().iloc[0]
 
-        # 计算希腊值
-        self.option_delta = option.delta()
-        self.option_gamma = option.gamma()
-        self.option_vega = option.vega()/100
-        self.option_theta = option.theta()/365
+        self.option_delta = greeks['delta']
+        self.option_gamma = greeks['gamma']
+        self.option_vega = greeks['vega']/100
+        self.option_theta = greeks['theta']/365
         print(f"期权希腊值计算完成: Delta={self.option_delta:.3f}, Gamma={self.option_gamma:.6f}")
         return True
 
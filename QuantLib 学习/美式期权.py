@@ -0,0 +1,264 @@
+'''
+美式期权定价：
+
+第5天 / 第6天 / 第8天 都按欧式期权（Black-Scholes、AnalyticEuropeanEngine）处理，
+但 *_options.xlsx 里是美股个股期权，都是美式的：看跌期权（以及有股息时的看涨期权）可以提前行权，比欧式贵。
+
+这里用 CRR 二叉树，一次对一批合约同时倒推（NumPy 数组一行一个合约，每个合约可以有不同的 K、T、σ）：
+    - 没有股息的看涨期权永远不会提前行权，直接用 Black-Scholes，不走二叉树
+    - 倒推时顺便记录每一步的提前行权边界（看跌：行权的最高股价；看涨：行权的最低股价）
+    - AmericanPricer 按 (标的, 到期日) 缓存提前行权边界和价格，输入没变时不重复计算
+    - price_files 把多个标的分给进程池，每个进程读一个期权文件、取波动率曲面、定价
+    - 每个到期日一批，记录这一批的用时，折算成每个合约的用时
+
+用法：
+    american_price(S, K, T, r, sigma, 'put')            # 单个或数组
+    pricer = AmericanPricer(r=0.036)
+    prices = pricer.price_chain(chain, spot, sigma, symbol='TSLA')
+    pricer.boundary('TSLA', '2026-06-18')              # 这个到期日每个合约的提前行权边界
+    prices, boundaries = price_files(['./TSLA_options.xlsx', './AAPL_options.xlsx'], r=0.036)
+'''
+
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from 期权分析 import black_scholes, is_call as _is_call, load_chain
+
+
+def crr_american(S, K, T, r, sigma, option_type='call', q=0.0, steps=200, boundary=False):
+    """
+    CRR 二叉树给美式期权定价，所有参数都可以是数组（一行一个合约同时倒推）
+    boundary=True 时同时返回提前行权边界：(合约数, steps + 1) 的股价数组，
+    第 i 列是第 i 步（时间 i * T / steps）的边界，NaN 表示这一步不会提前行权
+    T <= 0 或 sigma <= 0 的合约取内在价值；所有参数都是标量时返回 float（和边界的一维数组）
+    """
+    # 转成数组之前判断：atleast_1d 之后每个参数都是一维的
+    scalar = all(np.ndim(x) == 0 for x in (S, K, T, r, sigma, option_type, q))
+    S, K, T, sigma, call, r, q = np.broadcast_arrays(
+        *(np.atleast_1d(np.asarray(x, float)) for x in (S, K, T, sigma)),
+        np.atleast_1d(_is_call(option_type)), np.atleast_1d(np.asarray(r, float)), np.atleast_1d(np.asarray(q, float)))
+    sign = np.where(call, 1.0, -1.0)[:, None]
+    intrinsic = np.maximum(sign[:, 0] * (S - K), 0.0)
+    alive = (T > 0) & (sigma > 0)
+    prices = intrinsic.copy()
+    crit = np.full((len(S), steps + 1), np.nan)
+
+    if alive.any():
+        S_, K_, T_, v_, r_, q_, s_ = S[alive], K[alive], T[alive], sigma[alive], r[alive], q[alive], sign[alive]
+        dt = T_ / steps
+        log_u = (v_ * np.sqrt(dt))[:, None]
+        u = np.exp(log_u)
+        p = np.clip((np.exp((r_ - q_) * dt)[:, None] - 1 / u) / (u - 1 / u), 0.0, 1.0)
+        disc = np.exp(-r_ * dt)[:, None]
+        log_s, strike = np.log(S_)[:, None], K_[:, None]
+        j = np.arange(steps + 1)
+
+        values = np.maximum(s_ * (np.exp(log_s + (2 * j - steps) * log_u) - strike), 0.0)
+        sub_crit = np.full((len(S_), steps + 1), np.nan)
+        sub_crit[:, steps] = K_                             # 到期日：实值就行权
+        for i in range(steps - 1, -1, -1):
+            spot = np.exp(log_s + (2 * j[:i + 1] - i) * log_u)
+            hold = disc * (p * values[:, 1:i + 2] + (1 - p) * values[:, :i + 1])
+            exercise = s_ * (spot - strike)
+            early = exercise > hold
+            values = np.where(early, exercise, hold)
+            if boundary:
+                # 看跌：行权区域里最高的股价；看涨：最低的股价
+                edge = np.where(early, spot * -s_, -np.inf).max(axis=1) * -s_[:, 0]
+                sub_crit[:, i] = np.where(early.any(axis=1), edge, np.nan)
+        prices[alive] = values[:, 0]
+        crit[alive] = sub_crit
+
+    if boundary:
+        return (float(prices[0]), crit[0]) if scalar else (prices, crit)
+    return float(prices[0]) if scalar else prices
+
+
+def american_price(S, K, T, r, sigma, option_type='call', q=0.0, steps=200):
+    """
+    美式期权价格：没有股息（q <= 0）的看涨期权不会提前行权，等于欧式价格；其它用 CRR 二叉树
+    所有参数（包括 r、q）都可以是数组，互相广播
+    """
+    S, K, T, r, sigma, q, call = np.broadcast_arrays(*(np.asarray(x, float) for x in (S, K, T, r, sigma, q)),
+                                                     _is_call(option_type))
+    prices = np.asarray(black_scholes(S, K, T, r, sigma, call, q), float).copy()
+    lattice = ~(call & (q <= 0))
+    if lattice.any():
+        prices[lattice] = crr_american(S[lattice], K[lattice], T[lattice], r[lattice], sigma[lattice],
+                                       call[lattice], q[lattice], steps)
+    return prices if prices.ndim else float(prices)
+
+
+class AmericanPricer:
+    """
+    - r, q: 无风险利率、股息率（连续复利）
+    - steps: 二叉树步数
+    按 (标的, 到期日) 缓存：价格（输入的现价、K、σ 都没变时直接返回）和提前行权边界
+    """
+
+    def __init__(self, r, q=0.0, steps=200):
+        self.r, self.q, self.steps = r, q, steps
+        self.boundaries = {}
+        self._prices = {}
+
+    def __repr__(self):
+        return f"AmericanPricer(r={self.r:.4f}, q={self.q:.4f}, steps={self.steps}, 缓存 {len(self._prices)} 个到期日)"
+
+    def _fingerprint(self, spot, batch):
+        return hash((spot, self.r, self.q, self.steps, batch['strike'].to_numpy().tobytes(),
+                     batch['sigma'].to_numpy().tobytes(), batch['is_call'].to_numpy().tobytes(),
+                     batch['T'].to_numpy().tobytes()))
+
+    def price_chain(self, chain, spot, sigma, symbol=None):
+        """
+        给一张期权链（期权分析.load_chain 的结果）所有未到期合约定价
+        - spot: 标的现价；sigma: 每个合约的波动率（数组，和 chain 的行对应）或一个常数
+        返回 DataFrame：strike, expiration, is_call, T, sigma, european, american,
+                        premium（提前行权溢价）, exercise_now（现在就该行权）, seconds（每个合约的定价用时）
+        """
+        frame = chain[['strike', 'expiration', 'is_call', 'T']].copy()
+        if 'contractSymbol' in chain:
+            frame.insert(0, 'contractSymbol', chain['contractSymbol'])
+        frame['sigma'] = np.broadcast_to(np.asarray(sigma, float), len(frame))
+        frame = frame[(frame['T'] > 0) & (frame['sigma'] > 0)]
+
+        results = []
+        for expiration, batch in frame.groupby('expiration', sort=True):
+            key = (symbol, pd.Timestamp(expiration))
+            fingerprint = self._fingerprint(spot, batch)
+            cached = self._prices.get(key)
+            if cached is not None and cached[0] == fingerprint:
+                results.append(cached[1])
+                continue
+            start = time.perf_counter()
+            result = self._price_batch(key, spot, batch)
+            result['seconds'] = (time.perf_counter() - start) / len(batch)
+            self._prices[key] = (fingerprint, result)
+            results.append(result)
+        return pd.concat(results) if results else frame.assign(european=[], american=[])
+
+    def _price_batch(self, key, spot, batch):
+        """一个到期日的所有合约：看涨（无股息）用 BS，其它一起走二叉树，同时记录提前行权边界"""
+        K, T, sigma = (batch[c].to_numpy(float) for c in ('strike', 'T', 'sigma'))
+        call = batch['is_call'].to_numpy(bool)
+        european = black_scholes(spot, K, T, self.r, sigma, call, self.q)
+        american = np.array(european, float, copy=True)
+        crit = np.full((len(batch), self.steps + 1), np.nan)
+        lattice = ~(call & (self.q <= 0))
+        if lattice.any():
+            american[lattice], crit[lattice] = crr_american(spot, K[lattice], T[lattice], self.r, sigma[lattice],
+                                                            call[lattice], self.q, self.steps, boundary=True)
+        # 二叉树的离散误差可能让美式价格略低于欧式，取两者较大值
+        american = np.maximum(american, european)
+        intrinsic = np.maximum(np.where(call, spot - K, K - spot), 0.0)
+
+        self.boundaries[key] = pd.DataFrame(
+            crit, index=pd.MultiIndex.from_arrays([K, call], names=['strike', 'is_call']),
+            columns=pd.Index(np.round(np.linspace(0, T[0], self.steps + 1), 6), name='t'))
+        result = batch.copy()
+        result['european'] = european
+        result['american'] = american
+        result['premium'] = american - european
+        result['exercise_now'] = lattice & (american <= intrinsic + 1e-10) & (intrinsic > 0)
+        return result
+
+    def boundary(self, symbol, expiration):
+        """(标的, 到期日) 的提前行权边界：行是 (strike, is_call)，列是距今时间（年），值是临界股价"""
+        return self.boundaries[(symbol, pd.Timestamp(expiration))]
+
+
+def _price_file(path, r, q, steps):
+    """进程池里的任务：读一个期权文件，用它的波动率曲面取现价和每个合约的波动率，定价"""
+    from 波动率曲面 import surface_from_file
+
+    symbol = os.path.basename(path).split('_')[0]
+    chain = load_chain(path)
+    chain = chain[chain['T'] > 0].reset_index(drop=True)
+    surface = surface_from_file(path, r)
+    sigma = surface.vol(chain['strike'], chain['T'])
+    pricer = AmericanPricer(r, q, steps)
+    start = time.perf_counter()
+    prices = pricer.price_chain(chain, surface.spot, sigma, symbol)
+    prices.insert(0, 'symbol', symbol)
+    return symbol, prices, pricer.boundaries, time.perf_counter() - start
+
+
+def price_files(paths, r, q=0.0, steps=200, processes=None):
+    """
+    多个标的的期权文件分给进程池并行定价（processes=1 时在当前进程里依次计算）
+    返回 (所有合约的价格 DataFrame, {(标的, 到期日): 提前行权边界})
+    """
+    processes = processes or min(len(paths), os.cpu_count() or 1)
+    if processes <= 1:
+        results = [_price_file(path, r, q, steps) for path in paths]
+    else:
+        with ProcessPoolExecutor(processes) as pool:
+            results = list(pool.map(_price_file, paths, [r] * len(paths), [q] * len(paths), [steps] * len(paths)))
+    boundaries = {}
+    for symbol, prices, bounds, elapsed in results:
+        boundaries.update(bounds)
+        print(f"{symbol}: {len(prices)} 个合约, 定价用时 {elapsed:.2f}秒 "
+              f"(每个合约 {prices['seconds'].mean() * 1e6:.0f}微秒)")
+    return pd.concat([prices for _, prices, _, _ in results], ignore_index=True), boundaries
+
+
+if __name__ == '__main__':
+    import glob
+
+    import QuantLib as ql
+
+    r = pd.read_excel('./US_Treasury_Yields.xlsx')['DGS1'].iloc[-1] / 100
+
+    # 和 QuantLib 的二叉树、有限差分引擎对照
+    today = ql.Date(26, 11, 2025)
+    ql.Settings.instance().evaluationDate = today
+    S, sigma, q = 100.0, 0.4, 0.02
+    process = ql.BlackScholesMertonProcess(
+        ql.QuoteHandle(ql.SimpleQuote(S)),
+        ql.YieldTermStructureHandle(ql.FlatForward(today, q, ql.Actual365Fixed())),
+        ql.YieldTermStructureHandle(ql.FlatForward(today, r, ql.Actual365Fixed())),
+        ql.BlackVolTermStructureHandle(ql.BlackConstantVol(today, ql.NullCalendar(), sigma, ql.Actual365Fixed())))
+    print('K, 期限, 类型 | CRR(NumPy) | QuantLib CRR | QuantLib 有限差分')
+    for K, days, kind in [(80, 30, 'put'), (100, 182, 'put'), (120, 365, 'put'), (90, 365, 'call'), (130, 730, 'put')]:
+        option = ql.VanillaOption(ql.PlainVanillaPayoff(ql.Option.Call if kind == 'call' else ql.Option.Put, K),
+                                  ql.AmericanExercise(today, today + days))
+        option.setPricingEngine(ql.BinomialVanillaEngine(process, 'crr', 200))
+        binomial = option.NPV()
+        option.setPricingEngine(ql.FdBlackScholesVanillaEngine(process, 400, 400))
+        print(f"{K}, {days}天, {kind} | {american_price(S, K, days / 365, r, sigma, kind, q):.4f} | "
+              f"{binomial:.4f} | {option.NPV():.4f}")
+
+    # 单个标的：逐到期日定价、缓存、提前行权边界
+    pricer = AmericanPricer(r)
+    symbol, prices, _, elapsed = _price_file('./TSLA_options.xlsx', r, 0.0, 200)
+    print(f"\nTSLA 整条期权链 {len(prices)} 个合约, 用时 {elapsed:.2f}秒")
+    puts = prices[~prices['is_call']]
+    print(f"看跌期权提前行权溢价: 中位数 ${puts['premium'].median():.3f}, 最大 ${puts['premium'].max():.2f}, "
+          f"现在就该行权的 {puts['exercise_now'].sum()} 个")
+
+    from 波动率曲面 import surface_from_file
+    chain = load_chain('./TSLA_options.xlsx')
+    chain = chain[chain['T'] > 0].reset_index(drop=True)
+    surface = surface_from_file('./TSLA_options.xlsx', r)
+    sigma = surface.vol(chain['strike'], chain['T'])
+    for label in ('第一次', '第二次（缓存）'):
+        start = time.perf_counter()
+        pricer.price_chain(chain, surface.spot, sigma, 'TSLA')
+        print(f"price_chain {label}: {time.perf_counter() - start:.3f}秒")
+    expiration = sorted(chain['expiration'].unique())[10]
+    bound = pricer.boundary('TSLA', expiration)
+    put_bound = bound.xs(False, level='is_call')
+    near = put_bound.loc[put_bound.index[np.abs(put_bound.index - surface.spot).argmin()]]
+    print(f"{pd.Timestamp(expiration).date()} 平值看跌期权的提前行权边界（临界股价）:")
+    print(near.iloc[::40].round(2).to_string())
+
+    # 多个标的：进程池
+    paths = sorted(glob.glob('./*_options.xlsx'))[:6]
+    start = time.perf_counter()
+    all_prices, boundaries = price_files(paths, r)
+    print(f"{len(paths)} 个标的, {len(all_prices)} 个合约, 总用时 {time.perf_counter() - start:.2f}秒, "
+          f"缓存了 {len(boundaries)} 个 (标的, 到期日) 的提前行权边界")
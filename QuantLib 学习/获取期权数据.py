@@ -1,12 +1,20 @@
 """
 获取股票期权数据（Calls 和 Puts）
 支持多个股票代码，每个股票单独保存到 Excel 文件
+同时追加到期权链库（option_chains.parquet）：所有股票、所有日期的快照在一个文件里，可以按条件查询
 """
 
+import os
 import pandas as pd
 from yahooquery import Ticker
 import datetime as dt
 
+from 期权链库 import OptionChainStore
+
+# 期权链库：已有就接着往里加，同一股票同一天重新获取时替换旧数据
+STORE_PATH = './option_chains.parquet'
+store = OptionChainStore.load(STORE_PATH) if os.path.exists(STORE_PATH) else OptionChainStore()
+
 # ==============================
 # 1️⃣ 输入股票代码
 # ==============================
@@ -77,13 +85,19 @@ for symbol in symbols:
 
         print(f"✅ {symbol} 所有期权数据已保存到 {output_file}")
 
+        # 加入期权链库（标的价格由平价关系反推）
+        store.add(pd.concat([calls.reset_index(), puts.reset_index()], ignore_index=True), symbol, today)
+
     except Exception as e:
         print(f"❌ 获取 {symbol} 期权数据失败: {e}")
 
+store.save(STORE_PATH)
+print(f"\n期权链库: {store}, 保存到 {STORE_PATH}")
 
 '''
 =========================总结=================
 这段代码能批量获取用户输入股票的期权数据，
-分别提取 Calls 和 Puts，并保存到每个股票的独立 Excel 文件中。
+分别提取 Calls 和 Puts，并保存到每个股票的独立 Excel 文件中，
+同时追加到期权链库（每天运行一次，就积累了每天的快照，例如 store.history 看一个合约每天的价格）。
 同时，它会筛选未来 90 天以上的期权，并展示一个示例（到期日、执行价、市场价）。
 '''
\ No newline at end of file
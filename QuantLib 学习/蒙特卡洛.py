@@ -0,0 +1,349 @@
+'''
+蒙特卡洛路径引擎：
+
+项目里唯一的蒙特卡洛是 第6天 的 monte_carlo_var：抽两列相关的正态数，再在 Python 循环里用 Delta 近似算组合价值；
+第8天 的 optimize_portfolio 直接抽独立同分布的日收益。没有真正的路径，也没有办法给路径依赖的期权定价。
+
+这里把路径模拟拆成两部分：
+    模型（给定标准正态数，生成路径）
+        GBM     多资产几何布朗运动，资产之间用相关矩阵的 Cholesky 分解得到相关冲击，按精确解一步到位
+        Heston  随机波动率（完全截断 Euler），各资产价格冲击之间相关，每个资产的方差冲击和自己的价格冲击相关 ρ
+    MonteCarloEngine（决定抽哪些数、怎么估计误差）
+        - 按 chunk_size 条路径一块一块生成，每块算完收益就丢掉，内存和总路径数无关
+        - antithetic: 对偶变量，z 和 -z 各走一条路径，取平均
+        - control: 控制变量，(收益函数, 已知期望) ，回归系数在全部路径上估计
+        - sobol: Sobol 低差异序列（随机化扰动 replicates 组，用组间差异估计标准误差）
+
+收益函数接收一块路径 (路径数, 时间点数, 资产数)，返回每条路径的（未贴现）收益；引擎按最后一个时间点贴现。
+
+用法：
+    model = GBM(spot=[100, 50], vol=[0.3, 0.4], r=0.04, corr=[[1, 0.5], [0.5, 1]])
+    engine = MonteCarloEngine(model, times=np.linspace(0, 1, 13), antithetic=True, sobol=True)
+    engine.price(asian(100), n_paths=200_000,
+                 control=(asian(100, geometric=True), geometric_asian_price(100, 100, times, 0.04, 0.3)))
+'''
+
+import time
+
+import numpy as np
+from scipy.stats import norm, qmc
+
+from 期权分析 import black_scholes
+
+
+# ================= 模型 =================
+class GBM:
+    """
+    多资产几何布朗运动
+    - spot, vol, q: 每个资产一个值（标量表示只有一个资产）
+    - r: 无风险利率（风险中性漂移 r - q）
+    - corr: 资产收益的相关矩阵，默认互不相关
+    """
+
+    def __init__(self, spot, vol, r, q=0.0, corr=None):
+        self.spot = np.atleast_1d(np.asarray(spot, float))
+        n = len(self.spot)
+        self.vol = np.broadcast_to(np.asarray(vol, float), (n,))
+        self.q = np.broadcast_to(np.asarray(q, float), (n,))
+        self.r = float(r)
+        self.corr = np.eye(n) if corr is None else np.asarray(corr, float)
+        self.chol = np.linalg.cholesky(self.corr)
+        self.n_assets = n
+        self.factors = n                # 每一步需要的正态数个数
+
+    def evolve(self, z, times):
+        """z: (路径数, 步数, factors) 的标准正态数；返回 (路径数, 步数 + 1, 资产数) 的价格路径"""
+        dt = np.diff(times)[None, :, None]
+        eps = z @ self.chol.T
+        steps = (self.r - self.q - 0.5 * self.vol ** 2) * dt + self.vol * np.sqrt(dt) * eps
+        log_paths = np.log(self.spot) + np.cumsum(steps, axis=1)
+        return np.concatenate([np.broadcast_to(self.spot, (len(z), 1, self.n_assets)), np.exp(log_paths)], axis=1)
+
+
+class Heston:
+    """
+    Heston 随机波动率模型（每个资产一组参数）
+        dS/S = (r - q) dt + sqrt(v) dW_s
+        dv   = kappa (theta - v) dt + xi sqrt(v) dW_v,   corr(dW_s, dW_v) = rho
+    - corr: 各资产价格冲击之间的相关矩阵
+    离散化用完全截断（full truncation）Euler，时间网格就是 times，步长越小偏差越小
+    """
+
+    def __init__(self, spot, v0, kappa, theta, xi, rho, r, q=0.0, corr=None):
+        self.spot = np.atleast_1d(np.asarray(spot, float))
+        n = len(self.spot)
+        self.v0, self.kappa, self.theta, self.xi, self.rho, self.q = (
+            np.broadcast_to(np.asarray(x, float), (n,)) for x in (v0, kappa, theta, xi, rho, q))
+        self.r = float(r)
+        self.corr = np.eye(n) if corr is None else np.asarray(corr, float)
+        self.chol = np.linalg.cholesky(self.corr)
+        self.n_assets = n
+        self.factors = 2 * n            # 前 n 个给价格，后 n 个给方差的独立部分
+
+    def evolve(self, z, times):
+        n = self.n_assets
+        dt = np.diff(times)
+        z_s = z[:, :, :n] @ self.chol.T
+        z_v = self.rho * z_s + np.sqrt(1 - self.rho ** 2) * z[:, :, n:]
+        log_s = np.broadcast_to(np.log(self.spot), (len(z), n)).copy()
+        v = np.broadcast_to(self.v0, (len(z), n)).copy()
+        paths = np.empty((len(z), len(times), n))
+        paths[:, 0] = self.spot
+        for i, h in enumerate(dt):
+            vp = np.maximum(v, 0.0)
+            sq = np.sqrt(vp * h)
+            log_s += (self.r - self.q - 0.5 * vp) * h + sq * z_s[:, i]
+            v += self.kappa * (self.theta - vp) * h + self.xi * sq * z_v[:, i]
+            paths[:, i + 1] = np.exp(log_s)
+        return paths
+
+
+# ================= 收益函数 =================
+def _payoff(x, K, kind):
+    return np.maximum(x - K, 0.0) if kind == 'call' else np.maximum(K - x, 0.0)
+
+
+def european(K, kind='call', asset=0):
+    """欧式期权：到期价格"""
+    return lambda paths: _payoff(paths[:, -1, asset], K, kind)
+
+
+def asian(K, kind='call', asset=0, geometric=False):
+    """亚式期权：各观察时间（不含起点）的算术 / 几何平均价格"""
+    def payoff(paths):
+        fixings = paths[:, 1:, asset]
+        average = np.exp(np.log(fixings).mean(axis=1)) if geometric else fixings.mean(axis=1)
+        return _payoff(average, K, kind)
+    return payoff
+
+
+def up_and_out(K, barrier, kind='call', asset=0):
+    """向上敲出期权：任何观察时间价格达到 barrier 就作废（离散观察）"""
+    def payoff(paths):
+        alive = paths[:, :, asset].max(axis=1) < barrier
+        return np.where(alive, _payoff(paths[:, -1, asset], K, kind), 0.0)
+    return payoff
+
+
+def lookback(kind='call', asset=0):
+    """浮动行权价回望期权：看涨 S_T - min(S)，看跌 max(S) - S_T"""
+    def payoff(paths):
+        s = paths[:, :, asset]
+        return s[:, -1] - s.min(axis=1) if kind == 'call' else s.max(axis=1) - s[:, -1]
+    return payoff
+
+
+def basket(weights, K, kind='call'):
+    """一篮子期权：到期时各资产价格加权和"""
+    weights = np.asarray(weights, float)
+    return lambda paths: _payoff(paths[:, -1] @ weights, K, kind)
+
+
+def terminal(asset=0):
+    """到期价格本身（控制变量：贴现后的期望是 S0 * exp(-qT)）"""
+    return lambda paths: paths[:, -1, asset]
+
+
+def geometric_asian_price(S, K, times, r, sigma, q=0.0, kind='call'):
+    """
+    GBM 下离散几何平均亚式期权的解析价格（观察时间 times[1:]），常用作算术平均亚式期权的控制变量
+    ln G ~ N(mu, s²)：mu = ln S + (r - q - σ²/2) * mean(t)，s² = σ² * mean(min(t_i, t_j))
+    """
+    t = np.asarray(times, float)[1:]
+    T = float(times[-1])
+    mu = np.log(S) + (r - q - 0.5 * sigma ** 2) * t.mean()
+    s = sigma * np.sqrt(np.minimum.outer(t, t).mean())
+    d2 = (mu - np.log(K)) / s
+    d1 = d2 + s
+    forward = np.exp(mu + 0.5 * s * s)
+    if kind == 'call':
+        return np.exp(-r * T) * (forward * norm.cdf(d1) - K * norm.cdf(d2))
+    return np.exp(-r * T) * (K * norm.cdf(-d2) - forward * norm.cdf(-d1))
+
+
+# ================= 引擎 =================
+class _Stats:
+    """一组样本的累加量：收益 y、控制变量 c 的和、平方和、交叉乘积和"""
+
+    def __init__(self):
+        self.n = 0
+        self.sums = np.zeros(5)         # y, yy, c, cc, yc
+
+    def add(self, y, c=None):
+        c = np.zeros_like(y) if c is None else c
+        self.n += len(y)
+        self.sums += [y.sum(), y @ y, c.sum(), c @ c, y @ c]
+
+    def estimate(self, control_mean=None):
+        """(估计值, 标准误差, 回归系数)"""
+        n = self.n
+        y, yy, c, cc, yc = self.sums / n
+        var_y = (yy - y * y) * n / (n - 1)
+        if control_mean is None:
+            return y, np.sqrt(var_y / n), 0.0
+        var_c = (cc - c * c) * n / (n - 1)
+        cov = (yc - y * c) * n / (n - 1)
+        beta = cov / var_c if var_c > 0 else 0.0
+        return y - beta * (c - control_mean), np.sqrt(max(var_y - beta * cov, 0.0) / n), beta
+
+
+class MonteCarloEngine:
+    """
+    - model: GBM / Heston（任何有 evolve(z, times)、factors、r 的对象）
+    - times: 时间网格（年），从 0 开始，路径在每个时间点都有价格
+    - antithetic: 对偶变量
+    - sobol: 用随机化 Sobol 序列代替伪随机数，replicates 组独立扰动的序列估计标准误差
+    - chunk_size: 每块路径数（Sobol 时取不小于它的 2 的幂）
+    """
+
+    def __init__(self, model, times, antithetic=False, sobol=False, seed=None, chunk_size=20_000, replicates=16):
+        self.model = model
+        self.times = np.asarray(times, float)
+        self.antithetic = antithetic
+        self.sobol = sobol
+        self.seed = seed
+        self.chunk_size = int(2 ** np.ceil(np.log2(chunk_size))) if sobol else int(chunk_size)
+        self.replicates = replicates if sobol else 1
+        self.dimension = (len(self.times) - 1) * model.factors
+        if sobol and self.dimension > 21201:
+            raise ValueError(f"Sobol 序列最多 21201 维，当前 {self.dimension} 维")
+
+    def _normals(self, n_draws, rng_or_sobol):
+        """(n_draws, 步数, factors) 的标准正态数"""
+        if self.sobol:
+            u = rng_or_sobol.random(n_draws)
+            z = norm.ppf(np.clip(u, 1e-12, 1 - 1e-12))
+        else:
+            z = rng_or_sobol.standard_normal((n_draws, self.dimension))
+        return z.reshape(n_draws, len(self.times) - 1, self.model.factors)
+
+    def _generators(self, n_paths):
+        """每组（伪随机只有一组）一个随机数源，以及这一组要抽的正态数个数"""
+        seeds = np.random.SeedSequence(self.seed).spawn(self.replicates)
+        draws = -(-n_paths // (self.replicates * (2 if self.antithetic else 1)))
+        if self.sobol:
+            draws = int(2 ** np.ceil(np.log2(max(draws, 1))))
+            return [(qmc.Sobol(self.dimension, scramble=True, seed=np.random.default_rng(s)), draws) for s in seeds]
+        return [(np.random.default_rng(s), draws) for s in seeds]
+
+    def chunks(self, n_paths):
+        """
+        逐块生成路径：每次给出 (组号, 路径块)；对偶变量时路径块是 (z 的路径, -z 的路径)
+        """
+        for group, (source, draws) in enumerate(self._generators(n_paths)):
+            done = 0
+            while done < draws:
+                m = min(self.chunk_size, draws - done)
+                z = self._normals(m, source)
+                if self.antithetic:
+                    yield group, (self.model.evolve(z, self.times), self.model.evolve(-z, self.times))
+                else:
+                    yield group, self.model.evolve(z, self.times)
+                done += m
+
+    def simulate(self, n_paths):
+        """一次返回全部路径（路径数不大时用）"""
+        blocks = []
+        for _, block in self.chunks(n_paths):
+            blocks.extend(block if self.antithetic else [block])
+        return np.concatenate(blocks)[:n_paths]
+
+    def price(self, payoff, n_paths=100_000, control=None):
+        """
+        蒙特卡洛定价
+        - payoff: 收益函数 paths -> 每条路径的收益
+        - control: (控制变量收益函数, 它贴现后的已知期望)
+        返回 dict: price, stderr, paths（实际路径数）, seconds, beta（控制变量回归系数）
+        """
+        start = time.perf_counter()
+        discount = np.exp(-self.model.r * self.times[-1])
+        control_fn, control_mean = control if control is not None else (None, None)
+        stats = [_Stats() for _ in range(self.replicates)]
+
+        def evaluate(paths):
+            y = discount * payoff(paths)
+            return y, (discount * control_fn(paths) if control_fn else None)
+
+        for group, block in self.chunks(n_paths):
+            if self.antithetic:
+                (y1, c1), (y2, c2) = evaluate(block[0]), evaluate(block[1])
+                stats[group].add(0.5 * (y1 + y2), 0.5 * (c1 + c2) if control_fn else None)
+            else:
+                stats[group].add(*evaluate(block))
+
+        total = sum(s.n for s in stats) * (2 if self.antithetic else 1)
+        if self.sobol:
+            # 各组各自估计，用组间差异估计标准误差
+            estimates = np.array([s.estimate(control_mean) for s in stats])
+            price, stderr = estimates[:, 0].mean(), estimates[:, 0].std(ddof=1) / np.sqrt(self.replicates)
+            beta = estimates[:, 2].mean()
+        else:
+            price, stderr, beta = stats[0].estimate(control_mean)
+        return {'price': float(price), 'stderr': float(stderr), 'paths': total,
+                'seconds': time.perf_counter() - start, 'beta': float(beta)}
+
+
+if __name__ == '__main__':
+    import pandas as pd
+    import QuantLib as ql
+
+    S, K, r, sigma, T = 100.0, 100.0, 0.04, 0.3, 1.0
+    monthly = np.linspace(0, T, 13)
+
+    # 1. 欧式期权和 Black-Scholes 对照
+    result = MonteCarloEngine(GBM(S, sigma, r), [0, T], seed=1).price(european(K), 1_000_000)
+    print(f"欧式看涨: 蒙特卡洛 {result['price']:.4f} ± {result['stderr']:.4f}, "
+          f"Black-Scholes {black_scholes(S, K, T, r, sigma):.4f}")
+
+    # 2. 算术平均亚式期权：各种方差缩减方法的 误差 vs 用时
+    payoff = asian(K)
+    control = (asian(K, geometric=True), geometric_asian_price(S, K, monthly, r, sigma))
+    settings = [
+        ('普通蒙特卡洛', {}, None),
+        ('对偶变量', {'antithetic': True}, None),
+        ('控制变量(几何亚式)', {}, control),
+        ('Sobol', {'sobol': True}, None),
+        ('Sobol + 对偶 + 控制变量', {'sobol': True, 'antithetic': True}, control),
+    ]
+    rows = []
+    for name, kwargs, ctrl in settings:
+        result = MonteCarloEngine(GBM(S, sigma, r), monthly, seed=7, **kwargs).price(payoff, 200_000, ctrl)
+        rows.append({'方法': name, '价格': result['price'], '标准误差': result['stderr'],
+                     '路径数': result['paths'], '用时(秒)': result['seconds']})
+    table = pd.DataFrame(rows)
+    # 效率 = 达到同样误差需要的时间之比（误差² x 用时，越小越好）
+    cost = table['标准误差'] ** 2 * table['用时(秒)']
+    table['效率提升(倍)'] = cost.iloc[0] / cost
+    print('\n算术平均亚式看涨期权（12 个月度观察点）:')
+    print(table.round(5).to_string(index=False))
+
+    # 3. 误差随路径数的变化：普通 vs Sobol + 控制变量
+    print('\n路径数 | 普通: 误差 用时 | Sobol+控制变量: 误差 用时')
+    for n in (2_000, 20_000, 200_000):
+        plain = MonteCarloEngine(GBM(S, sigma, r), monthly, seed=3).price(payoff, n)
+        best = MonteCarloEngine(GBM(S, sigma, r), monthly, sobol=True, seed=3).price(payoff, n, control)
+        print(f"{n:>7} | {plain['stderr']:.5f} {plain['seconds']:.3f}秒 | {best['stderr']:.6f} {best['seconds']:.3f}秒")
+
+    # 4. Heston 欧式期权和 QuantLib 解析解对照
+    v0, kappa, theta, xi, rho = 0.09, 2.0, 0.09, 0.5, -0.7
+    today = ql.Date(26, 11, 2025)
+    ql.Settings.instance().evaluationDate = today
+    flat = lambda rate: ql.YieldTermStructureHandle(ql.FlatForward(today, rate, ql.Actual365Fixed()))
+    process = ql.HestonProcess(flat(r), flat(0.0), ql.QuoteHandle(ql.SimpleQuote(S)), v0, kappa, theta, xi, rho)
+    option = ql.VanillaOption(ql.PlainVanillaPayoff(ql.Option.Call, K), ql.EuropeanExercise(today + 365))
+    option.setPricingEngine(ql.AnalyticHestonEngine(ql.HestonModel(process)))
+    heston = Heston(S, v0, kappa, theta, xi, rho, r)
+    result = MonteCarloEngine(heston, np.linspace(0, T, 253), antithetic=True, seed=5).price(european(K), 200_000)
+    print(f"\nHeston 欧式看涨: 蒙特卡洛 {result['price']:.4f} ± {result['stderr']:.4f}, "
+          f"QuantLib 解析解 {option.NPV():.4f}, 用时 {result['seconds']:.2f}秒")
+
+    # 5. 三资产相关的一篮子期权和向上敲出期权，100 万条路径分块生成
+    corr = [[1, 0.6, 0.3], [0.6, 1, 0.4], [0.3, 0.4, 1]]
+    model = GBM([100, 50, 80], [0.3, 0.4, 0.25], r, corr=corr)
+    engine = MonteCarloEngine(model, np.linspace(0, T, 53), antithetic=True, seed=11, chunk_size=50_000)
+    result = engine.price(basket([0.4, 0.8, 0.5], 120), 1_000_000)
+    print(f"三资产一篮子看涨: {result['price']:.4f} ± {result['stderr']:.4f}, "
+          f"{result['paths']} 条路径 x 52 周, 用时 {result['seconds']:.2f}秒")
+    result = engine.price(up_and_out(100, 140), 1_000_000, control=(european(100), black_scholes(100, 100, T, r, 0.3)))
+    print(f"向上敲出看涨(障碍 140, 周度观察): {result['price']:.4f} ± {result['stderr']:.4f}")
+    print(f"回望看涨: {engine.price(lookback(), 200_000)['price']:.4f}")
@@ -0,0 +1,245 @@
+'''
+批量隐含波动率：
+
+*_options.xlsx 里的 impliedVolatility 是数据商给的，不活跃的行权价经常是 0.00001 或者几百%，
+第6天 / 第8天 只好把 IV > 1.0 的合约扔掉。这里直接用期权价格（lastPrice / bid / ask）
+反解 Black-Scholes，整条期权链所有合约同时求解：
+
+    1. 先把价格换成不贴现的远期价格，实值期权用平价关系换成同一行权价的虚值期权（数值上更稳定）；
+       价格不在无套利区间 [内在价值, 上限] 里的合约没有解，直接标记出来
+    2. 初始值用 Corrado-Miller 有理近似公式，一步就很接近答案
+    3. 向量化牛顿法：每一步对所有还没收敛的合约一起算价格和 vega；
+       同时维护每个合约的 [下界, 上界]，牛顿步跳出区间或者 vega 太小时改用二分（安全的二分兜底）
+    4. 返回每个合约的波动率、是否收敛、状态码、迭代次数
+
+数据快照里的股价（*_stock.xlsx）和期权不是同一天的，implied_forward 用同一到期日、同一行权价的
+看涨看跌价格按平价关系反推远期价格，比直接用过期的股价更准。
+
+用法：
+    result = solve_implied_vol(price, S, K, T, r, option_type)   # {'vol', 'converged', 'status', 'iterations'}
+    iv = implied_vol(price, S, K, T, r, option_type)             # 只要波动率，没有解的是 NaN
+    table = chain_implied_vol(load_chain('./TSLA_options.xlsx'), r=0.036)
+'''
+
+import time
+
+import numpy as np
+import pandas as pd
+from scipy.special import ndtr
+
+from 期权分析 import is_call, black_scholes, load_chain
+
+# 状态码
+NEWTON = 0          # 牛顿法收敛
+BISECTION = 1       # 用到了二分兜底，收敛
+NO_SOLUTION = 2     # 价格超出无套利区间（或者价格缺失），没有解
+NOT_CONVERGED = 3   # 达到最大迭代次数还没收敛
+
+STATUS_NAMES = {NEWTON: '牛顿法', BISECTION: '二分兜底', NO_SOLUTION: '无解', NOT_CONVERGED: '未收敛'}
+
+_SQRT_2PI = np.sqrt(2.0 * np.pi)
+
+
+def _undiscounted_otm(total_std, x, w):
+    """不贴现、行权价归一化（K=1，远期 F=e^x）的期权价格和对 总标准差 s=σ√T 的导数"""
+    d1 = x / total_std + 0.5 * total_std
+    d2 = d1 - total_std
+    price = w * (np.exp(x) * ndtr(w * d1) - ndtr(w * d2))
+    dprice = np.exp(x) * np.exp(-0.5 * d1 * d1) / _SQRT_2PI
+    return price, dprice
+
+
+def _corrado_miller(c, x):
+    """Corrado-Miller 有理近似：归一化看涨价格 c（K=1、F=e^x）的总标准差初始值"""
+    f = np.exp(x)
+    half = c - 0.5 * (f - 1.0)
+    root = np.sqrt(np.maximum(half * half - (f - 1.0) ** 2 / np.pi, 0.0))
+    return np.sqrt(2 * np.pi) / (f + 1.0) * (half + root)
+
+
+def solve_implied_vol(price, S, K, T, r, option_type='call', q=0.0, tol=1e-10, max_iter=100, max_vol=10.0):
+    """
+    批量反解隐含波动率，参数和 期权分析.black_scholes 一样（都可以是数组），price 是期权价格
+    - tol: 收敛标准（相对值）：总标准差 σ√T 的相对变化小于 tol，或者价格的相对误差小于 tol
+    - max_vol: 波动率上限，超过这个波动率的价格当作无解
+    返回 {'vol', 'converged', 'status', 'iterations'}，状态码见 STATUS_NAMES
+    """
+    price, S, K, T, r, q = (np.asarray(v, dtype=float) for v in (price, S, K, T, r, q))
+    price, S, K, T, r, q, call = np.broadcast_arrays(price, S, K, T, r, q, is_call(option_type))
+    shape = price.shape
+    price, S, K, T, r, q, call = (np.ravel(v) for v in (price, S, K, T, r, q, call))
+    n = price.size
+
+    vol = np.full(n, np.nan)
+    status = np.full(n, NO_SOLUTION, dtype=np.int8)
+    iterations = np.zeros(n, dtype=np.int16)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # 归一化：不贴现价格 / K，远期 F/K = e^x
+        x = np.log(S / K) + (r - q) * T
+        c = price * np.exp(r * T) / K
+        c = np.where(call, c, c + np.exp(x) - 1.0)          # 看跌换成看涨（平价关系）
+        intrinsic = np.maximum(np.exp(x) - 1.0, 0.0)
+        upper = np.exp(x)
+        # 统一用虚值那一边：行权价高于远期时用看涨，否则用看跌
+        w = np.where(x <= 0, 1.0, -1.0)
+        target = np.where(w > 0, c, c - (np.exp(x) - 1.0))
+        s_max = max_vol * np.sqrt(T)
+
+    # 虚值那一边的价格（时间价值）小到和舍入误差一个量级时，波动率已经无法确定
+    noise = 1e-12 * np.maximum(c, 1.0)
+    valid = (np.isfinite(price) & np.isfinite(x) & (T > 0) & (price > 0)
+             & (c > intrinsic) & (c < upper) & (target > noise))
+    # 超过 max_vol 的价格也算无解
+    hi_price, _ = _undiscounted_otm(np.where(valid, s_max, 1.0), np.where(valid, x, 0.0), w)
+    valid &= target < hi_price
+
+    idx = np.flatnonzero(valid)
+    xs, ws, tg = x[idx], w[idx], target[idx]
+    lo = np.zeros(idx.size)
+    hi = s_max[idx]
+    s = np.clip(_corrado_miller(c[idx], xs), 1e-4 * np.sqrt(T[idx]), hi)
+    s = np.where(np.isfinite(s), s, 0.5 * hi)
+    used_bisection = np.zeros(idx.size, dtype=bool)
+    done = np.zeros(idx.size, dtype=bool)
+    count = np.zeros(idx.size, dtype=np.int16)
+
+    active = np.arange(idx.size)
+    for _ in range(max_iter):
+        if active.size == 0:
+            break
+        sa = s[active]
+        f, df = _undiscounted_otm(sa, xs[active], ws[active])
+        f -= tg[active]
+        count[active] += 1
+
+        # 价格随波动率单调递增：更新区间
+        above = f > 0
+        hi[active] = np.where(above, sa, hi[active])
+        lo[active] = np.where(above, lo[active], sa)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            step = f / df
+        newton = sa - step
+        bad = ~np.isfinite(newton) | (newton <= lo[active]) | (newton >= hi[active])
+        mid = 0.5 * (lo[active] + hi[active])
+        new = np.where(bad, mid, newton)
+        used_bisection[active] |= bad
+
+        # 价格误差按相对值判断：深度虚值期权价格很小，绝对误差没有意义
+        exact = np.abs(f) <= tol * tg[active]
+        finished = exact | (np.abs(new - sa) <= tol * sa) | (hi[active] - lo[active] <= tol * sa)
+        s[active] = np.where(exact, sa, new)
+        done[active] = finished
+        active = active[~finished]
+
+    sqrt_t = np.sqrt(T[idx])
+    vol[idx] = s / sqrt_t
+    status[idx] = np.where(done, np.where(used_bisection, BISECTION, NEWTON), NOT_CONVERGED)
+    iterations[idx] = count
+    return {
+        'vol': vol.reshape(shape),
+        'converged': (status <= BISECTION).reshape(shape),
+        'status': status.reshape(shape),
+        'iterations': iterations.reshape(shape),
+    }
+
+
+def implied_vol(price, S, K, T, r, option_type='call', q=0.0, **kwargs):
+    """只返回隐含波动率数组，没有解或没有收敛的是 NaN"""
+    result = solve_implied_vol(price, S, K, T, r, option_type, q, **kwargs)
+    return np.where(result['converged'], result['vol'], np.nan)
+
+
+# ================= 期权链 =================
+def option_prices(chain, source='mid'):
+    """
+    每个合约用来反解的价格
+    - 'mid': bid、ask 都大于 0 时用中间价，否则用 lastPrice
+    - 'last' / 'bid' / 'ask': 直接用对应的列
+    """
+    if source != 'mid':
+        return chain[{'last': 'lastPrice'}.get(source, source)].to_numpy(dtype=float)
+    bid, ask = chain['bid'].to_numpy(dtype=float), chain['ask'].to_numpy(dtype=float)
+    last = chain['lastPrice'].to_numpy(dtype=float)
+    quoted = (bid > 0) & (ask > 0) & (ask >= bid)
+    return np.where(quoted, 0.5 * (bid + ask), last)
+
+
+def implied_forward(chain, r, source='mid', n_strikes=5):
+    """
+    按平价关系反推每个到期日的远期价格：F = K + e^{rT} (C - P)
+    每个到期日取 |C - P| 最小（最接近平值）的 n_strikes 个行权价，结果取中位数
+    返回每行一个远期价格的数组（没有成对看涨看跌的到期日是 NaN）
+    """
+    prices = pd.Series(option_prices(chain, source), index=chain.index)
+    frame = pd.DataFrame({'expiration': chain['expiration'], 'strike': chain['strike'], 'T': chain['T'],
+                          'call': chain['is_call'], 'price': prices})
+    frame = frame[frame['price'] > 0]
+    pairs = frame.pivot_table(index=['expiration', 'strike'], columns='call', values='price', aggfunc='first')
+    pairs = pairs.dropna()
+    if pairs.empty or pairs.shape[1] < 2:       # 只有看涨或只有看跌
+        return np.full(len(chain), np.nan)
+    pairs.columns = ['put' if not c else 'call' for c in pairs.columns]
+    pairs = pairs.reset_index()
+    pairs['T'] = pairs['expiration'].map(frame.groupby('expiration')['T'].first())
+    pairs['gap'] = (pairs['call'] - pairs['put']).abs()
+    pairs['forward'] = pairs['strike'] + np.exp(r * pairs['T']) * (pairs['call'] - pairs['put'])
+    nearest = pairs.sort_values('gap').groupby('expiration').head(n_strikes)
+    forward = nearest.groupby('expiration')['forward'].median()
+    return chain['expiration'].map(forward).to_numpy(dtype=float)
+
+
+def chain_implied_vol(chain, r, S=None, q=0.0, source='mid', **kwargs):
+    """
+    对一张期权链（期权分析.load_chain 的结果）反解所有合约的隐含波动率
+    - S: 标的价格；None 时用 implied_forward 反推的远期价格（股息也包含在远期里，此时 q 不用）
+    返回 DataFrame: price（用来反解的价格）、iv、converged、status、iterations，行索引和 chain 相同
+    """
+    price = option_prices(chain, source)
+    T = chain['T'].to_numpy(dtype=float)
+    if S is None:
+        forward = implied_forward(chain, r, source)
+        S, q = forward * np.exp(-r * T), 0.0          # 用远期折回现在，等价于 S e^{(r-q)T} = F
+    result = solve_implied_vol(price, S, chain['strike'].to_numpy(dtype=float), T, r,
+                               chain['is_call'].to_numpy(), q, **kwargs)
+    return pd.DataFrame({'price': price, 'spot': np.broadcast_to(S, price.shape), 'iv': result['vol'],
+                         'converged': result['converged'], 'status': result['status'],
+                         'iterations': result['iterations']}, index=chain.index)
+
+
+if __name__ == '__main__':
+    # 1. 随机合约：已知波动率 -> 价格 -> 反解，检查能不能还原
+    rng = np.random.default_rng(0)
+    n = 50_000
+    S = rng.uniform(50, 500, n)
+    K = S * np.exp(rng.normal(0, 0.3, n))
+    T = rng.uniform(1 / 365, 2.5, n)
+    sigma = rng.uniform(0.05, 2.0, n)
+    call = rng.random(n) < 0.5
+    r, q = 0.04, 0.01
+    price = black_scholes(S, K, T, r, sigma, call, q)
+
+    start = time.time()
+    result = solve_implied_vol(price, S, K, T, r, call, q)
+    seconds = time.time() - start
+    ok = result['converged']
+    # 时间价值太小（远低于最小报价单位）时波动率本身就不确定，只看时间价值有意义的合约
+    forward_intrinsic = np.maximum(np.where(call, 1, -1) * (S * np.exp(-q * T) - K * np.exp(-r * T)), 0)
+    meaningful = price - forward_intrinsic > 1e-6 * K
+    print(f"{n} 个合约, 用时 {seconds * 1000:.0f}毫秒, 收敛 {ok.mean():.2%}, "
+          f"最大迭代 {result['iterations'].max()} 次, 平均 {result['iterations'][ok].mean():.1f} 次")
+    print(f"有意义价格的合约: 收敛 {ok[meaningful].mean():.2%}, "
+          f"波动率最大误差 {np.max(np.abs(result['vol'] - sigma)[ok & meaningful]):.2e}")
+    print(pd.Series(result['status']).map(STATUS_NAMES).value_counts().to_string())
+
+    # 2. 真实期权链：TSLA 快照，标的用平价反推的远期
+    r = pd.read_excel('./US_Treasury_Yields.xlsx')['DGS1'].iloc[-1] / 100
+    chain = load_chain('./TSLA_options.xlsx')
+    start = time.time()
+    table = chain_implied_vol(chain, r)
+    print(f"\nTSLA {len(chain)} 个合约, 用时 {(time.time() - start) * 1000:.0f}毫秒")
+    print(table['status'].map(STATUS_NAMES).value_counts().to_string())
+    view = pd.concat([chain[['expiration', 'optionType', 'strike', 'lastPrice', 'impliedVolatility']], table], axis=1)
+    near = view[(view['expiration'] == view['expiration'].unique()[3]) & view['strike'].between(400, 450)]
+    print(near[['optionType', 'strike', 'lastPrice', 'spot', 'impliedVolatility', 'iv', 'status']].to_string())
@@ -0,0 +1,339 @@
+'''
+组合风险引擎（全量重估的蒙特卡洛 VaR / CVaR）：
+
+第6天 的 monte_carlo_var 在 Python 循环里一个情景一个情景地算组合价值，
+期权的损益用 期权总价值 x 平均 Delta x 股票收益 近似，Delta 又是按写死的股价 180 估出来的；
+债券的"波动率"是按类型猜的常数。这样期权的凸性、时间价值衰减、利率对债券的影响都没有。
+
+RiskEngine：
+    - 风险因子：标的价格（对数正态）和利率（平行移动，正态），相关系数由历史数据估计（shock_parameters）
+      情景由 蒙特卡洛.MonteCarloEngine 按块生成（可以用对偶变量），每块最多 chunk_size 个情景
+    - 债券现金流：security_cashflows 按 Securities.csv 的字段区分 Bill / 固定票息 / 浮息（FRN，按下一个重置日偿付）/ TIPS（跳过）
+    - 债券：按现金流贴现全量重估。每只债券先由市场价格反解连续复利收益率，情景下收益率 + 利率冲击，
+      持有期内已经支付的现金流按现金计；所有债券的现金流时间合并成一张网格，一块情景只算一次 exp，再做一次矩阵乘法
+    - 期权：期权分析.black_scholes 向量化重估（情景 x 合约），剩余期限减去持有期
+    - 损益 = 情景下的模型价值 - 当前的模型价值（当前价值本身用市场价格）
+    - var_cvar 一次算多个置信水平
+    - simulate_sketch 不保留损益数组，逐块写入 分位数草图.QuantileSketch，可以多进程模拟再合并，情景数不受内存限制
+
+用法：
+    engine = RiskEngine(spot=277.0, r=0.04, stock_vol=0.25, rate_vol=0.008, correlation=-0.1, horizon_days=10)
+    engine.add_bond('Note 5-Year', *treasury_cashflows('2025-09-30', '2030-09-30', 0.0363), price=99.6, notional=1000)
+    engine.add_option('AAPL 看跌 $250', strike=250, T=0.5, sigma=0.3, option_type='put', quantity=2)
+    pnl = engine.simulate(1_000_000)
+    var_cvar(pnl, (0.95, 0.99, 0.999))
+    engine.simulate_sketch(100_000_000, processes=4).var_cvar((0.95, 0.99, 0.999))
+'''
+
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from 分位数草图 import QuantileSketch
+from 期权分析 import black_scholes, is_call
+from 蒙特卡洛 import MonteCarloEngine
+
+
+# ================= 债券现金流 =================
+def treasury_cashflows(issue, maturity, coupon=None, frequency=2):
+    """
+    国债每 100 面值的现金流：(距发行日的年数, 金额)
+    - coupon: 年票息率（0.0363 即 3.63%）；None 表示贴现票据（Bill），到期一次支付 100
+      NaN 不再当作 Bill：Securities.csv 里浮息票据（FRN）也没有票息，要用 security_cashflows 区分
+    付息日从到期日往前每 12 / frequency 个月一次
+    """
+    issue, maturity = pd.Timestamp(issue), pd.Timestamp(maturity)
+    if coupon is not None and pd.isna(coupon):
+        raise ValueError("票息缺失：Bill 请传 coupon=None，Securities.csv 的记录用 security_cashflows")
+    if coupon is None or coupon <= 0:
+        return np.array([(maturity - issue).days / 365]), np.array([100.0])
+    dates = []
+    date = maturity
+    while date > issue:
+        dates.append(date)
+        date = maturity - pd.DateOffset(months=12 // frequency * len(dates))
+    dates = pd.DatetimeIndex(dates[::-1])
+    amounts = np.full(len(dates), 100 * coupon / frequency)
+    amounts[-1] += 100
+    return ((dates - issue).days / 365).to_numpy(float), amounts
+
+
+def _percent(value):
+    """'3.63%' -> 0.0363，空值返回 NaN"""
+    return pd.to_numeric(str(value).rstrip('%'), errors='coerce') / 100
+
+
+def treasury_kind(security, tips_yield=0.03):
+    """
+    Securities.csv 没有浮息、通胀保值的标记，按字段推断一行记录的类型：
+    - 'bill': Security Type 为 Bill
+    - 'frn': Note / Bond 但没有 Interest Rate（浮动利率票据，例如 91282CNQ0）
+    - 'tips': 有票息，但拍卖收益率 High Yield 低于 tips_yield（TIPS 按实际收益率拍卖，远低于同期名义收益率）
+    - 'fixed': 普通固定票息 Note / Bond
+    """
+    if security['Security Type'] == 'Bill':
+        return 'bill'
+    if pd.isna(_percent(security['Interest Rate'])):
+        return 'frn'
+    if _percent(security['High Yield']) < tips_yield:
+        return 'tips'
+    return 'fixed'
+
+
+def security_cashflows(security, frequency=2, reset_days=7):
+    """
+    Securities.csv 的一行 -> (类型, 距发行日的年数, 每 100 面值的现金流)
+    - Bill: 到期一次支付 100；固定票息: treasury_cashflows
+    - FRN: 票息每周按 13 周 Bill 的拍卖利率重置，利率风险只到下一个重置日，视为 reset_days 天后按 100 偿付
+    - TIPS: 本金按 CPI 调整、价格由实际收益率决定，不能用名义利率冲击重估，现金流返回 None，由调用方跳过
+    """
+    kind = treasury_kind(security)
+    if kind == 'tips':
+        return kind, None, None
+    if kind == 'frn':
+        return kind, np.array([reset_days / 365]), np.array([100.0])
+    coupon = None if kind == 'bill' else _percent(security['Interest Rate'])
+    return (kind, *treasury_cashflows(security['Issue Date'], security['Maturity Date'], coupon, frequency))
+
+
+def bond_yield(times, cashflows, price, guess=0.04, tol=1e-12, max_iter=50):
+    """由价格反解连续复利收益率（牛顿法）"""
+    y = guess
+    for _ in range(max_iter):
+        discount = cashflows * np.exp(-y * times)
+        step = (discount.sum() - price) / (times * discount).sum()
+        y += step
+        if abs(step) < tol:
+            break
+    return y
+
+
+# ================= 风险因子参数 =================
+def shock_parameters(prices, yields, price_column='Close', yield_column='DGS10', window=252):
+    """
+    由历史数据估计风险因子参数（最近 window 个共同交易日）：
+    - stock_vol: 标的日对数收益率的年化波动率
+    - rate_vol: 利率日变化（绝对值，小数）的年化波动
+    - correlation: 两者的相关系数
+    prices: 有 Date 列的股价表；yields: 有 DATE 列的国债收益率表（百分数）
+    """
+    stock = prices.set_index('Date')[price_column].sort_index()
+    rate = yields.set_index('DATE')[yield_column].sort_index() / 100
+    data = pd.concat([np.log(stock).diff(), rate.diff()], axis=1, join='inner').dropna().iloc[-window:]
+    data.columns = ['stock', 'rate']
+    return {'stock_vol': float(data['stock'].std() * np.sqrt(252)),
+            'rate_vol': float(data['rate'].std() * np.sqrt(252)),
+            'correlation': float(data['stock'].corr(data['rate']))}
+
+
+# ================= 风险指标 =================
+def var_cvar(pnl, levels=(0.95, 0.99)):
+    """
+    多个置信水平的 VaR 和 CVaR（都是正数，表示损失）
+    返回 {'95% VaR': ..., '95% CVaR': ..., '99% VaR': ..., ...}
+    """
+    pnl = np.asarray(pnl, float)
+    quantiles = np.quantile(pnl, [1 - level for level in levels])
+    metrics = {}
+    for level, q in zip(levels, quantiles):
+        label = f"{level * 100:g}%"
+        metrics[f"{label} VaR"] = -q
+        metrics[f"{label} CVaR"] = -pnl[pnl <= q].mean()
+    return metrics
+
+
+# ================= 引擎 =================
+class MarketShocks:
+    """
+    给 MonteCarloEngine 用的单步风险因子模型：标的价格（对数正态，无漂移）和利率（正态平行移动）
+    路径形状 (情景数, 2, 2)：第 0 个时间点是当前值，第 1 个是持有期末；最后一维是 (股价, 利率)
+    """
+
+    def __init__(self, spot, r, stock_vol, rate_vol, correlation):
+        self.spot, self.r0 = float(spot), float(r)
+        self.stock_vol, self.rate_vol = float(stock_vol), float(rate_vol)
+        self.chol = np.linalg.cholesky([[1.0, correlation], [correlation, 1.0]])
+        self.factors = 2
+        self.r = 0.0                    # 不贴现（MonteCarloEngine.price 才用到）
+
+    def evolve(self, z, times):
+        h = times[-1] - times[0]
+        eps = z[:, 0] @ self.chol.T
+        spot = self.spot * np.exp(self.stock_vol * np.sqrt(h) * eps[:, 0] - 0.5 * self.stock_vol ** 2 * h)
+        rate = self.r0 + self.rate_vol * np.sqrt(h) * eps[:, 1]
+        start = np.broadcast_to([self.spot, self.r0], (len(z), 2))
+        return np.stack([start, np.column_stack([spot, rate])], axis=1)
+
+
+class RiskEngine:
+    """
+    - spot: 标的现价；r: 当前无风险利率（期权贴现用）
+    - stock_vol / rate_vol / correlation: 风险因子参数（见 shock_parameters）
+    - horizon_days: 持有期（交易日），冲击和时间衰减都按 horizon_days / 252 年
+    """
+
+    def __init__(self, spot, r, stock_vol, rate_vol, correlation=0.0, horizon_days=10):
+        self.spot, self.r = float(spot), float(r)
+        self.shocks = MarketShocks(spot, r, stock_vol, rate_vol, correlation)
+        self.horizon = horizon_days / 252
+        self.bonds = []
+        self.options = []
+        self._grid = None
+
+    def __repr__(self):
+        return f"RiskEngine({len(self.bonds)} 只债券, {len(self.options)} 个期权, 持有期 {self.horizon * 252:.0f} 天)"
+
+    # ---------- 头寸 ----------
+    def add_bond(self, name, times, cashflows, price, notional):
+        """times / cashflows: 每 100 面值的现金流；price: 每 100 面值的价格；notional: 面值"""
+        times, cashflows = np.asarray(times, float), np.asarray(cashflows, float)
+        self.bonds.append({'name': name, 'times': times, 'cashflows': cashflows, 'notional': notional,
+                           'price': price, 'yield': bond_yield(times, cashflows, price),
+                           'market_value': price * notional / 100})
+        self._grid = None
+
+    def add_option(self, name, strike, T, sigma, option_type, quantity, multiplier=100, market_value=None):
+        """quantity: 手数（每手 multiplier 股）；market_value: 市场价值，默认用模型价值"""
+        call = bool(is_call(option_type))
+        model = black_scholes(self.spot, strike, T, self.r, sigma, call) * quantity * multiplier
+        self.options.append({'name': name, 'strike': strike, 'T': T, 'sigma': sigma, 'is_call': call,
+                             'units': quantity * multiplier, 'model_value': model,
+                             'market_value': model if market_value is None else market_value})
+
+    def market_value(self):
+        return sum(b['market_value'] for b in self.bonds) + sum(o['market_value'] for o in self.options)
+
+    # ---------- 重估 ----------
+    def _bond_grid(self):
+        """
+        所有债券持有期末还没支付的现金流合并成一张时间网格：
+        grid（网格时间，距持有期末）、weights（网格 x 债券，已按各自收益率贴现并乘上面值）、paid（持有期内已支付的现金）
+        """
+        if self._grid is None:
+            h = self.horizon
+            remaining = np.unique(np.concatenate([b['times'][b['times'] > h] for b in self.bonds] or [[]])) - h
+            weights = np.zeros((len(remaining), len(self.bonds)))
+            paid = np.zeros(len(self.bonds))
+            for j, b in enumerate(self.bonds):
+                later = b['times'] > h
+                rows = np.searchsorted(remaining, b['times'][later] - h)
+                scale = b['notional'] / 100
+                weights[rows, j] = b['cashflows'][later] * np.exp(-b['yield'] * (b['times'][later] - h)) * scale
+                paid[j] = b['cashflows'][~later].sum() * scale
+            self._grid = (remaining, weights, paid)
+        return self._grid
+
+    def revalue(self, spot, rate):
+        """情景（股价、利率数组）下持有期末的组合模型价值，返回每个情景一个值"""
+        spot, rate = np.asarray(spot, float), np.asarray(rate, float)
+        value = np.zeros(len(spot))
+        if self.bonds:
+            grid, weights, paid = self._bond_grid()
+            shift = rate - self.shocks.r0
+            value += np.exp(-np.outer(shift, grid)) @ weights.sum(axis=1) + paid.sum()
+        if self.options:
+            K, T, sigma, call, units = (np.array([o[k] for o in self.options])
+                                        for k in ('strike', 'T', 'sigma', 'is_call', 'units'))
+            prices = black_scholes(spot[:, None], K, np.maximum(T - self.horizon, 0.0), rate[:, None], sigma, call)
+            value += prices @ units
+        return value
+
+    def base_value(self):
+        """当前的组合模型价值（债券按自己的收益率贴现，等于市场价格）"""
+        return sum(b['market_value'] for b in self.bonds) + sum(o['model_value'] for o in self.options)
+
+    def _pnl_chunks(self, n_scenarios, chunk_size, seed, antithetic):
+        """按块生成情景损益，每次 yield 一块"""
+        engine = MonteCarloEngine(self.shocks, [0.0, self.horizon], antithetic=antithetic, seed=seed,
+                                  chunk_size=chunk_size)
+        base = self.base_value()
+        remaining = n_scenarios
+        for _, block in engine.chunks(n_scenarios):
+            for paths in (block if antithetic else (block,)):
+                if remaining <= 0:
+                    return
+                pnl = self.revalue(paths[:remaining, 1, 0], paths[:remaining, 1, 1]) - base
+                remaining -= len(pnl)
+                yield pnl
+
+    def simulate(self, n_scenarios=1_000_000, chunk_size=100_000, seed=42, antithetic=False):
+        """
+        模拟 n_scenarios 个持有期末情景，按块全量重估，返回每个情景的损益数组
+        """
+        return np.concatenate(list(self._pnl_chunks(n_scenarios, chunk_size, seed, antithetic)))
+
+    def simulate_sketch(self, n_scenarios=10_000_000, chunk_size=100_000, seed=42, antithetic=False,
+                        sketch=None, processes=1):
+        """
+        和 simulate 一样，但损益不保留，逐块写入 分位数草图.QuantileSketch，内存和情景数无关
+        - sketch: 接着往已有的草图里写（比如分几次跑）；None 时新建
+        - processes > 1 时情景平均分给多个进程，各自用独立的种子模拟，最后合并草图
+        """
+        sketch = sketch if sketch is not None else QuantileSketch()
+        if processes > 1:
+            seeds = np.random.SeedSequence(seed).generate_state(processes)
+            sizes = [len(part) for part in np.array_split(np.arange(n_scenarios), processes)]
+            tasks = [(self, n, chunk_size, int(s), antithetic) for n, s in zip(sizes, seeds)]
+            with ProcessPoolExecutor(processes) as pool:
+                for part in pool.map(_sketch_part, tasks):
+                    sketch.merge(part)
+            return sketch
+        for pnl in self._pnl_chunks(n_scenarios, chunk_size, seed, antithetic):
+            sketch.update(pnl)
+        return sketch
+
+
+def _sketch_part(args):
+    """进程池里的任务：一个进程模拟一部分情景，只把草图传回去"""
+    engine, n_scenarios, chunk_size, seed, antithetic = args
+    return engine.simulate_sketch(n_scenarios, chunk_size, seed, antithetic)
+
+if __name__ == '__main__':
+    treasury = pd.read_excel('./US_Treasury_Yields.xlsx')
+    prices = pd.read_excel('./AAPL_stock.xlsx')
+    params = shock_parameters(prices, treasury)
+    print('风险因子参数:', {k: round(v, 4) for k, v in params.items()})
+
+    r = treasury['DGS10'].iloc[-1] / 100
+    spot = prices.sort_values('Date')['Close'].iloc[-1]
+    engine = RiskEngine(spot, r, horizon_days=10, **params)
+
+    # 各种期限的国债
+    securities = pd.read_csv('./Securities.csv').dropna(subset=['Price per $100'])
+    for _, bond in securities.drop_duplicates('Security Term').head(10).iterrows():
+        kind, times, cashflows = security_cashflows(bond)
+        if times is None:
+            print(f"跳过 {bond['CUSIP']} {bond['Security Term']}: 疑似 TIPS，不能按名义利率重估")
+            continue
+        engine.add_bond(f"{bond['Security Type']} {bond['Security Term']}" + (' FRN' if kind == 'frn' else ''),
+                        times, cashflows, bond['Price per $100'], 10_000)
+    for K, T, kind, qty in [(spot * 0.9, 0.5, 'call', 2), (spot * 0.95, 0.25, 'put', 3), (spot * 1.1, 1.0, 'call', -1)]:
+        engine.add_option(f"{kind} {K:.0f}", K, T, 0.3, kind, qty)
+    print(engine, f"组合价值 ${engine.market_value():,.0f}")
+
+    start = time.time()
+    pnl = engine.simulate(1_000_000)
+    print(f"100 万个情景全量重估, 用时 {time.time() - start:.2f}秒")
+    for name, value in var_cvar(pnl, (0.95, 0.99, 0.999)).items():
+        print(f"  {name}: ${value:,.2f}")
+
+    # 同样的情景写入分位数草图，结果和精确计算一致；情景数可以加到上亿而内存不变
+    start = time.time()
+    sketch = engine.simulate_sketch(1_000_000)
+    print(f"草图: {sketch}, 用时 {time.time() - start:.2f}秒")
+    for name, value in sketch.var_cvar((0.95, 0.99, 0.999)).items():
+        print(f"  {name}: ${value:,.2f}")
+    sketch = engine.simulate_sketch(4_000_000, processes=2)
+    print(f"两个进程 400 万个情景合并: 99.9% CVaR ${sketch.var_cvar((0.999,))['99.9% CVaR']:,.2f}")
+
+    # 对照：Delta 近似（原来 monte_carlo_var 的思路）低估了空头期权的尾部风险
+    engine_short = RiskEngine(spot, r, horizon_days=10, **params)
+    engine_short.add_option('卖出看跌', spot * 0.95, 0.1, 0.3, 'put', -10)
+    pnl = engine_short.simulate(200_000)
+    from 期权分析 import bs_greeks
+    delta = bs_greeks(spot, spot * 0.95, 0.1, r, 0.3, 'put')['delta'] * -1000
+    stock_move = spot * params['stock_vol'] * np.sqrt(10 / 252) * np.random.default_rng(0).standard_normal(200_000)
+    print(f"卖出 10 手看跌 99% VaR: 全量重估 ${var_cvar(pnl, (0.99,))['99% VaR']:,.0f}, "
+          f"Delta 近似 ${var_cvar(delta * stock_move, (0.99,))['99% VaR']:,.0f}")
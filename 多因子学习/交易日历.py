@@ -0,0 +1,195 @@
+'''
+交易日历：
+
+各个脚本里找日期的写法都是整列布尔比较：
+    - 低相关组合回测 的 quarter_starts 每个季度做一次 index[index >= d]
+    - 第9天 / 第10天 每个月 df[df['Month'] == month]，每次都扫一遍整张因子表
+    - 第8-2天 的 get_recent_data 每只股票重新排序再按日期过滤
+数据越长、月份越多，重复扫描越多。
+
+TradingCalendar 用价格数据的日期建一次（去重、排序后的 DatetimeIndex），之后所有查询都是二分查找：
+    - 下一个 / 上一个交易日，往前往后数 n 个交易日
+    - 每个周期（周 / 月 / 季 / 年）第一个和最后一个交易日的位置，按周期缓存
+    - 调仓日程：每周 / 每月 / 每季第一个（或最后一个）交易日
+    - 长表（一行一个 日期 x 股票）按周期分组的行号，代替每个周期一次的布尔筛选
+
+用法：
+    cal = TradingCalendar(prices.index)
+    cal.next_day('2024-03-29')                   # 2024-04-01
+    cal.offset('2024-03-29', -20)                # 往前 20 个交易日
+    cal.schedule('Q', '2015-01-01', '2024-12-31')  # 每季度第一个交易日
+    rows = cal.group_rows(df['Date'], 'M')       # {Period('2024-03'): 行号数组, ...}
+'''
+
+import numpy as np
+import pandas as pd
+
+
+class TradingCalendar:
+    """
+    - dates: 交易日（DatetimeIndex、日期列都可以，可以有重复、可以无序）
+    周期 freq 用 pandas 的周期代码：'W' 周、'M' 月、'Q' 季、'Y' 年
+    """
+
+    def __init__(self, dates):
+        self.dates = pd.DatetimeIndex(pd.unique(pd.DatetimeIndex(dates).dropna())).sort_values()
+        self._values = self.dates.values
+        self._periods = {}
+
+    def __len__(self):
+        return len(self.dates)
+
+    def __repr__(self):
+        if not len(self):
+            return 'TradingCalendar([])'
+        return f"TradingCalendar({self.dates[0].date()} ~ {self.dates[-1].date()}, {len(self)} 个交易日)"
+
+    # ---------- 单个日期 ----------
+    def locate(self, date, roll='next'):
+        """
+        date 对应的交易日位置
+        roll='next': date 当天或之后第一个交易日；roll='prev': date 当天或之前最后一个交易日
+        超出日历范围时 KeyError
+        """
+        pos = int(self.positions([date], roll)[0])
+        self._at(pos, date)
+        return pos
+
+    def is_trading_day(self, date):
+        date = np.datetime64(pd.Timestamp(date), 'ns')
+        pos = np.searchsorted(self._values, date)
+        return pos < len(self) and self._values[pos] == date
+
+    def next_day(self, date):
+        """date 之后（不含当天）的第一个交易日"""
+        return self._at(self.positions([date], 'prev')[0] + 1, date)
+
+    def prev_day(self, date):
+        """date 之前（不含当天）的最后一个交易日"""
+        return self._at(self.positions([date], 'next')[0] - 1, date)
+
+    def _at(self, pos, date):
+        if pos < 0 or pos >= len(self):
+            raise KeyError(f"{date} 超出交易日历范围 {self!r}")
+        return self.dates[pos]
+
+    def offset(self, date, n, roll='prev'):
+        """
+        从 date 数 n 个交易日（n 可以为负）
+        date 不是交易日时先按 roll 对齐：默认 'prev'，即 offset(周六, 1) 是下周一
+        """
+        return self._at(self.locate(date, roll) + n, date)
+
+    # ---------- 批量日期 ----------
+    def positions(self, dates, roll='next'):
+        """一批日期对齐到交易日的位置（ndarray）；超出范围时 'next' 得到 len(self)，'prev' 得到 -1"""
+        values = pd.DatetimeIndex(dates).values
+        if roll == 'next':
+            return np.searchsorted(self._values, values, side='left')
+        if roll == 'prev':
+            return np.searchsorted(self._values, values, side='right') - 1
+        raise ValueError(f"不支持的 roll: {roll}")
+
+    def align(self, dates, roll='next'):
+        """一批日期对齐到交易日，超出日历范围的日期去掉"""
+        pos = self.positions(dates, roll)
+        return self.dates[pos[(pos >= 0) & (pos < len(self))]]
+
+    # ---------- 周期 ----------
+    def periods(self, freq='M'):
+        """
+        每个周期一行：period（pandas Period）、start / end（这个周期的交易日位置 [start, end)）
+        同一个 freq 只计算一次
+        """
+        if freq not in self._periods:
+            keys = self.dates.to_period(freq)
+            starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]]) if len(keys) else np.array([], dtype=int)
+            self._periods[freq] = pd.DataFrame({
+                'period': keys[starts],
+                'start': starts,
+                'end': np.r_[starts[1:], len(keys)].astype(int),
+            })
+        return self._periods[freq]
+
+    def _period_row(self, date, freq, roll):
+        table = self.periods(freq)
+        pos = self.locate(date, roll)
+        return table.iloc[np.searchsorted(table['start'].to_numpy(), pos, side='right') - 1]
+
+    def period_start(self, date, freq='M', roll='prev'):
+        """date 所在周期的第一个交易日"""
+        return self.dates[self._period_row(date, freq, roll)['start']]
+
+    def period_end(self, date, freq='M', roll='prev'):
+        """date 所在周期的最后一个交易日"""
+        return self.dates[self._period_row(date, freq, roll)['end'] - 1]
+
+    def schedule(self, freq='M', start=None, end=None, anchor='start'):
+        """
+        调仓日程：每个周期第一个（anchor='start'）或最后一个（anchor='end'）交易日，
+        只保留落在 [start, end] 之间的日期
+        """
+        table = self.periods(freq)
+        pos = table['start'].to_numpy() if anchor == 'start' else table['end'].to_numpy() - 1
+        days = self.dates[pos]
+        if start is not None:
+            days = days[days >= pd.Timestamp(start)]
+        if end is not None:
+            days = days[days <= pd.Timestamp(end)]
+        return days
+
+    def lookback_start(self, years, end=None):
+        """
+        end（默认最后一个交易日）往前 years 年的第一个交易日；
+        数据不足 years 年时就是第一个交易日（和 第8-2天 的 get_recent_data 规则一样，一年按 365 天）
+        """
+        last = self.dates[-1] if end is None else self.dates[self.locate(end, roll='prev')]
+        available = (last - self.dates[0]).days / 365
+        start = last - pd.Timedelta(days=int(min(years, available) * 365))
+        return self.dates[self.locate(start, roll='next')]
+
+    # ---------- 长表分组 ----------
+    def group_rows(self, dates, freq='M', cumulative=False):
+        """
+        长表（一行一个 日期 x 股票）按周期分组：{Period: 行号数组}，行号保持原来的先后顺序
+        cumulative=True 时每个周期对应的是 这个周期及以前 的所有行（滚动训练用）
+        只排序一次，之后每个周期是一次二分查找，代替每个周期 df[df['Month'] == month] 扫描整张表
+        日历里没有交易日的周期不会出现在结果里
+        """
+        values = pd.DatetimeIndex(dates).values
+        order = np.argsort(values, kind='stable')
+        table = self.periods(freq)
+        bounds = np.searchsorted(values[order], self._values[table['start'].to_numpy()], side='left')
+        ends = np.r_[bounds[1:], len(values)]
+        if cumulative:
+            bounds = np.zeros_like(bounds)
+        return {period: np.sort(order[a:b]) for period, a, b in zip(table['period'], bounds, ends)}
+
+
+if __name__ == '__main__':
+    import time
+
+    # 用 TSLA 的日线做日历
+    prices = pd.read_excel('./TSLA_all_data.xlsx', index_col=0)
+    cal = TradingCalendar(prices.index)
+    print(cal)
+    print('2024-03-29 之后的交易日:', cal.next_day('2024-03-29').date())
+    print('2024-03-30 往前 20 个交易日:', cal.offset('2024-03-30', -20).date())
+    print('2024-05-15 所在月份:', cal.period_start('2024-05-15').date(), '~', cal.period_end('2024-05-15').date())
+    print('每季度第一个交易日:', [d.date() for d in cal.schedule('Q', '2024-01-01')])
+    print('每月最后一个交易日:', [d.date() for d in cal.schedule('M', '2025-01-01', anchor='end')])
+
+    # 长表按月分组：每月一次布尔筛选 vs 一次排序 + 二分查找
+    n_stocks = 500
+    panel = pd.DataFrame({'Date': np.tile(cal.dates, n_stocks),
+                          'company': np.repeat(np.arange(n_stocks), len(cal))})
+    panel['Month'] = panel['Date'].dt.to_period('M')
+    months = sorted(panel['Month'].unique())
+
+    start = time.time()
+    masked = {m: panel.index[panel['Month'] == m].to_numpy() for m in months}
+    print(f"布尔筛选 {len(months)} 个月 x {len(panel)} 行, 用时 {time.time() - start:.3f}秒")
+    start = time.time()
+    grouped = cal.group_rows(panel['Date'], 'M')
+    print(f"group_rows 同样的分组, 用时 {time.time() - start:.3f}秒")
+    print('结果相同:', all(np.array_equal(masked[m], grouped[m]) for m in months))
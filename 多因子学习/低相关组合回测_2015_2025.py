@@ -6,7 +6,9 @@ import numpy as np
 import pandas as pd
 import yfinance as yf
 import matplotlib.pyplot as plt
-from datetime import timedelta
+
+from 滚动协方差 import RollingCovariance
+from 交易日历 import TradingCalendar
 
 
 def get_nasdaq100_tickers() -> list:
@@ -54,108 +56,176 @@ def daily_returns(close: pd.DataFrame) -> pd.DataFrame:
 
 
 def quarter_starts(index: pd.DatetimeIndex, start: str, end: str) -> list:
-    """Build quarter start dates aligned to the trading calendar in index."""
+    """
+    Build quarter start dates aligned to the trading calendar in index:
+    each calendar quarter start in [start, end] is rolled to the next available trading day,
+    with one binary search for all quarters instead of a scan of index per quarter.
+    """
     qs = pd.date_range(start=start, end=end, freq='QS')
-    aligned = []
-    for d in qs:
-        # if the exact date not in index, shift to next available trading day
-        if d in index:
-            aligned.append(d)
-        else:
-            # find the next index date after d
-            future = index[index >= d]
-            if len(future) == 0:
-                break
-            aligned.append(future[0])
-    return aligned
+    return list(TradingCalendar(index).align(qs, roll='next'))
 
 
-def select_low_corr(ret_window: pd.DataFrame, k: int = 10) -> list:
+def corr_matrix(values: np.ndarray) -> np.ndarray:
+    """
+    Pearson correlation of the columns of a (days x tickers) array, same as DataFrame.corr().
+    Without missing data this is a single matrix product of the standardized returns.
+    With missing data, pairwise-complete sums come from a few masked matrix products
+    (counts, sums and sums of squares over the days where both tickers have data).
+    """
+    x = np.asarray(values, dtype=float)
+    valid = ~np.isnan(x)
+    if valid.all():
+        z = x - x.mean(axis=0)
+        z /= np.sqrt((z * z).sum(axis=0))
+        with np.errstate(invalid='ignore'):
+            return np.clip(z.T @ z, -1.0, 1.0)
+
+    m = valid.astype(float)
+    x0 = np.where(valid, x - np.nanmean(x, axis=0), 0.0)     # center first to limit cancellation
+    n = m.T @ m
+    sx = x0.T @ m                   # sx[i, j]: sum of x_i over days where x_j is also present
+    sxy = x0.T @ x0
+    sxx = (x0 * x0).T @ m
+    with np.errstate(invalid='ignore', divide='ignore'):
+        cov = sxy - sx * sx.T / n
+        var = sxx - sx * sx / n
+        corr = cov / np.sqrt(var * var.T)
+    corr[n < 2] = np.nan
+    return np.clip(corr, -1.0, 1.0)
+
+
+def select_low_corr(ret_window: pd.DataFrame, k: int = 10, corr: np.ndarray = None) -> list:
     """
     Select k tickers using the described low-correlation heuristic:
     1) First: smallest avg |corr| with all others
     2) Second: smallest |corr| with the first
     3+) Each next: smallest avg |corr| with already selected
+
+    The avg |corr| to the selected set is kept as a running sum (and count of non-NaN pairs)
+    per ticker, updated with one column of |corr| per pick, so each step is O(n).
+
+    corr, if given, is the pairwise correlation matrix of all columns of ret_window
+    (e.g. from RollingCovariance); pairwise correlations do not depend on the other columns,
+    so the filtered sub-matrix is the same as recomputing it.
+
+    Tickers without any valid correlation to the selected set are never picked, so fewer
+    than k tickers may be returned.
     """
     # Filter columns with enough data
     min_days = 60
     cols = ret_window.columns[ret_window.notna().sum() >= min_days]
-    ret_window = ret_window[cols]
-    if len(ret_window.columns) < k:
-        k = len(ret_window.columns)
-    corr = ret_window.corr()
-    abs_corr = corr.abs()
-
-    selected = []
-
+    n = len(cols)
+    k = min(k, n)
+    if k == 0:
+        return []
+    if corr is None:
+        abs_corr = np.abs(corr_matrix(ret_window[cols].to_numpy()))
+    else:
+        keep = ret_window.columns.get_indexer(cols)
+        abs_corr = np.abs(np.asarray(corr, dtype=float)[np.ix_(keep, keep)])
+    np.fill_diagonal(abs_corr, np.nan)          # never compare a ticker with itself
+    present = ~np.isnan(abs_corr)
+    filled = np.where(present, abs_corr, 0.0)
+
+    def pick(score, taken):
+        """Index of the smallest score among untaken tickers, or None if none has a valid score"""
+        score = np.where(taken | np.isnan(score), np.inf, score)
+        if np.isinf(score).all():
+            return None
+        return int(np.argmin(score))
+
+    taken = np.zeros(n, dtype=bool)
     # 1) first stock
-    avg_abs = abs_corr.apply(lambda s: s.drop(labels=s.name).mean(), axis=1)
-    first = avg_abs.idxmin()
-    selected.append(first)
-
-    if len(selected) >= k:
-        return selected
+    with np.errstate(invalid='ignore', divide='ignore'):
+        first = pick(filled.sum(axis=1) / present.sum(axis=1), taken)
+    if first is None:
+        return []
+    selected = [first]
+    taken[first] = True
+    if k == 1:
+        return [cols[first]]
 
     # 2) second stock: smallest |corr| with first
-    second = abs_corr[first].drop(labels=first).idxmin()
+    total = filled[:, first].copy()
+    count = present[:, first].astype(float)
+    second = pick(abs_corr[:, first], taken)
+    if second is None:
+        return [cols[first]]
     selected.append(second)
+    taken[second] = True
 
+    # 3+) running sum of |corr| to the selected set
     while len(selected) < k:
-        remaining = [c for c in corr.columns if c not in selected]
-        # For each candidate, compute avg |corr| with selected set
-        scores = {}
-        for c in remaining:
-            scores[c] = abs_corr.loc[c, selected].mean()
-        # pick the minimal score
-        nxt = min(scores, key=scores.get)
+        total += filled[:, selected[-1]]
+        count += present[:, selected[-1]]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            nxt = pick(total / count, taken)
+        if nxt is None:                         # no remaining ticker overlaps the selected set
+            break
         selected.append(nxt)
-    return selected
+        taken[nxt] = True
+    return [cols[i] for i in selected]
 
 
-def simulate_portfolio(ret: pd.DataFrame, rebalance_dates: list, lookback_months: int = 6, k: int = 10, initial_wealth: float = 1_000_000.0) -> pd.Series:
+def rebalance_segments(index: pd.DatetimeIndex, rebalance_dates: list, lookback_months: int = 6) -> pd.DataFrame:
     """
-    Simulate equal-weight portfolio rebalanced quarterly using low-correlation selection.
-    Portfolio return on each day within the holding window is the simple average of constituent returns.
+    Map rebalance dates to integer positions in index with one searchsorted call each.
+    Returns one row per holding period: [start, end) positions of the period and
+    [lb_start, start) positions of its lookback window.
     """
-    wealth = pd.Series(index=ret.index, dtype=float)
-    wealth.iloc[0] = initial_wealth
-
-    # Build holding periods
-    for i, t0 in enumerate(rebalance_dates):
-        # Define t1 as next rebalance start or end of data
-        t1 = rebalance_dates[i + 1] if i + 1 < len(rebalance_dates) else ret.index[-1] + timedelta(days=1)
-
-        # Lookback window: past 6 months
-        lb_start = t0 - pd.DateOffset(months=lookback_months)
-        window = ret[(ret.index >= lb_start) & (ret.index < t0)]
-        if window.shape[0] < 40:
-            # Not enough data, skip selection, carry wealth forward
-            period_idx = ret[(ret.index >= t0) & (ret.index < t1)].index
-            wealth.loc[period_idx] = wealth.shift(1).loc[period_idx]
-            continue
+    dates = pd.DatetimeIndex(rebalance_dates)
+    starts = index.searchsorted(dates, side='left')
+    ends = np.r_[starts[1:], len(index)]
+    lb_dates = pd.DatetimeIndex([d - pd.DateOffset(months=lookback_months) for d in dates])
+    lb_starts = index.searchsorted(lb_dates, side='left')
+    return pd.DataFrame({'date': dates, 'start': starts, 'end': ends, 'lb_start': lb_starts})
+
+
+def simulate_portfolio(ret: pd.DataFrame, rebalance_dates: list, lookback_months: int = 6, k: int = 10,
+                       initial_wealth: float = 1_000_000.0, weight_fn=None) -> pd.Series:
+    """
+    Simulate a portfolio rebalanced on rebalance_dates using low-correlation selection.
+    Portfolio return on each day within the holding window is the simple average of constituent returns,
+    or, if weight_fn is given, the weighted sum with weights = weight_fn(lookback_window, selected).
+
+    Each holding period is one contiguous slice of ret: its daily portfolio returns are compounded
+    with a single cumprod seeded by the wealth at the end of the previous period, so the cost is
+    linear in days x holdings. Periods without enough lookback data (or no selection) carry wealth flat.
+    The lookback correlation matrices come from one RollingCovariance engine that slides its
+    pairwise sums from one quarter's window to the next instead of recomputing every window.
+    """
+    values = np.full(len(ret.index), np.nan)
+    values[0] = initial_wealth
+    wealth_now = initial_wealth
+    engine = RollingCovariance(ret)
 
-        selected = select_low_corr(window, k=k)
+    for seg in rebalance_segments(ret.index, rebalance_dates, lookback_months).itertuples():
+        if seg.start >= seg.end:
+            continue
+        window = ret.iloc[seg.lb_start:seg.start]
+        if window.shape[0] >= 40:
+            selected = select_low_corr(window, k=k, corr=engine.corr_rows(seg.lb_start, seg.start))
+        else:
+            selected = []
         if len(selected) == 0:
-            period_idx = ret[(ret.index >= t0) & (ret.index < t1)].index
-            wealth.loc[period_idx] = wealth.shift(1).loc[period_idx]
+            # Not enough data, skip selection, carry wealth forward
+            values[seg.start:seg.end] = wealth_now
             continue
 
-        period_ret = ret[selected]
-        period_idx = period_ret[(period_ret.index >= t0) & (period_ret.index < t1)].index
-
-        # Equal weight daily portfolio return
-        ew_ret = period_ret.loc[period_idx].mean(axis=1).fillna(0.0)
+        period_ret = ret.iloc[seg.start:seg.end][selected]
+        if weight_fn is None:
+            # Equal weight daily portfolio return
+            port_ret = period_ret.mean(axis=1).fillna(0.0).to_numpy()
+        else:
+            weights = np.asarray(weight_fn(window[selected], selected), dtype=float)
+            port_ret = period_ret.fillna(0.0).to_numpy() @ weights
 
-        # Compound wealth
-        for d in period_idx:
-            prev = wealth.shift(1).loc[d]
-            if pd.isna(prev):
-                # initialize previous wealth if missing
-                prev = wealth.loc[wealth.index[wealth.index.get_loc(d)-1]] if wealth.index.get_loc(d) > 0 else initial_wealth
-            wealth.loc[d] = prev * (1.0 + ew_ret.loc[d])
+        # Compound wealth: same sequence of multiplications as wealth[d] = wealth[d-1] * (1 + r[d])
+        path = np.multiply.accumulate(np.r_[wealth_now, 1.0 + port_ret])[1:]
+        values[seg.start:seg.end] = path
+        wealth_now = path[-1]
 
-    wealth = wealth.ffill()
-    return wealth
+    return pd.Series(values, index=ret.index).ffill()
 
 
 def max_drawdown(wealth: pd.Series) -> float:
@@ -0,0 +1,237 @@
+'''
+滚动协方差 / 相关系数引擎：
+
+低相关组合回测 每个季度都要在过去 6 个月的收益率上重新算一次相关矩阵，
+QuantLib 学习/第7天 的 portfolio_optimization 和 efficient_frontier_analysis 又各自 returns_df.cov() 一遍。
+相邻两次计算的窗口大部分是重叠的，每次从头算浪费了大部分工作。
+
+RollingCovariance 对一张 (日期 x 资产) 的收益率表维护窗口内的成对累加量（外积的和）：
+    n[i, j]   两只股票都有数据的天数（EWMA 时是权重之和）
+    sx[i, j]  i 在这些天的收益之和
+    sxy[i, j] i、j 收益乘积之和
+    sxx[i, j] i 收益平方之和（同样只在 j 也有数据的天）
+每一项都是一次矩阵乘法（缺失值当 0，再乘 0/1 掩码），所以缺失值按成对剔除处理，
+结果和 DataFrame.cov() / DataFrame.corr() 相同。
+
+窗口移动时只加上新进来的行、减掉移出去的行（滑动窗口），EWMA 模式则是整体乘衰减因子再加新行；
+查询可以是任意日期、任意顺序，往前走时增量更新，往回跳或跳得太远时直接重算。
+为了减少大数相减的误差，累加前先减去每只股票全样本的均值（协方差和这个平移无关）。
+
+用法：
+    engine = RollingCovariance(returns, window=126)       # 126 个交易日的滑动窗口
+    engine.cov('2020-06-30')                              # 截止到这一天（含）的协方差 DataFrame
+    engine.corr_between('2020-01-01', '2020-07-01')       # [start, end) 区间的相关系数
+    RollingCovariance(returns, halflife=60).cov('2020-06-30')   # EWMA 协方差
+'''
+
+import time
+
+import numpy as np
+import pandas as pd
+
+
+class RollingCovariance:
+    """
+    - returns: 收益率 DataFrame，行是日期（升序），列是资产，可以有 NaN
+    - window: 滑动窗口的行数；None 表示从第一行开始的扩展窗口
+    - halflife: 给出时使用 EWMA（和 DataFrame.ewm(halflife=...).cov() 相同，adjust=True），忽略 window
+    - min_periods: 两只股票共同数据少于这个天数时协方差记为 NaN
+    - max_drift: 滑动窗口增量更新累计处理的行数超过 max_drift 倍窗口长度时重算一次，防止误差积累
+    """
+
+    def __init__(self, returns, window=None, halflife=None, min_periods=2, max_drift=20):
+        self.index = pd.DatetimeIndex(returns.index)
+        self.columns = returns.columns
+        x = returns.to_numpy(dtype=float)
+        valid = ~np.isnan(x)
+        with np.errstate(invalid='ignore'):
+            shift = np.nan_to_num(np.nanmean(np.where(valid, x, np.nan), axis=0))
+        self._mask = valid.astype(float)
+        self._x = np.where(valid, x - shift, 0.0)
+        self.window = window
+        self.halflife = halflife
+        self.decay = 0.5 ** (1.0 / halflife) if halflife else 1.0
+        self.min_periods = min_periods
+        self.max_drift = max_drift
+        self._range = None          # 当前累加量覆盖的行 [lo, hi)
+        self._sums = None
+        self._moved = 0             # 上次重算以来增量处理过的行数
+
+    # ---------- 累加量 ----------
+    def _block(self, a, b, weights=None):
+        """行 [a, b) 的外积之和；weights 是每行的权重（EWMA 用）"""
+        x, m = self._x[a:b], self._mask[a:b]
+        if weights is None:
+            return {'n': m.T @ m, 'sx': x.T @ m, 'sxy': x.T @ x, 'sxx': (x * x).T @ m}
+        wm, wx = m * weights[:, None], x * weights[:, None]
+        return {'n': m.T @ wm, 'sx': x.T @ wm, 'sxy': x.T @ wx, 'sxx': (x * x).T @ wm,
+                'n2': m.T @ (wm * weights[:, None]),        # 权重平方和，用于无偏修正
+                'count': m.T @ m}                           # 共同数据天数（不衰减）
+
+    def _combine(self, sums, block, sign=1.0, scale=1.0):
+        """sums * scale + sign * block；权重平方和衰减 scale²，天数 count 不衰减"""
+        power = {'count': 0, 'n2': 2}
+        return {key: sums[key] * scale ** power.get(key, 1) + sign * value for key, value in block.items()}
+
+    def _ewm_weights(self, a, b):
+        """行 [a, b) 在 b-1 这一天的 EWMA 权重：最新一行为 1，往前每行乘 decay"""
+        return self.decay ** np.arange(b - 1 - a, -1, -1, dtype=float)
+
+    def _move(self, a, b):
+        """把累加量移动到行 [a, b)"""
+        if self._range == (a, b):
+            return self._sums
+        lo, hi = self._range or (b, b)
+        if self.halflife:
+            # EWMA：同一起点往后走时，旧的累加量整体衰减再加新行；其它情况重算
+            if self._range is not None and a == lo and hi <= b:
+                block = self._block(hi, b, self._ewm_weights(hi, b))
+                self._sums = self._combine(self._sums, block, scale=self.decay ** (b - hi))
+            else:
+                self._sums = self._block(a, b, self._ewm_weights(a, b))
+        else:
+            changed = abs(a - lo) + abs(b - hi)
+            overlap = min(b, hi) - max(a, lo)
+            if (self._range is None or overlap <= 0 or changed >= b - a
+                    or self._moved + changed > self.max_drift * (b - a)):
+                self._sums = self._block(a, b)
+                self._moved = 0
+            else:
+                sums = self._sums
+                # 进来的行加上，出去的行减掉
+                if a < lo:
+                    sums = self._combine(sums, self._block(a, lo))
+                elif a > lo:
+                    sums = self._combine(sums, self._block(lo, a), sign=-1.0)
+                if b > hi:
+                    sums = self._combine(sums, self._block(hi, b))
+                elif b < hi:
+                    sums = self._combine(sums, self._block(b, hi), sign=-1.0)
+                self._sums = sums
+                self._moved += changed
+        self._range = (a, b)
+        return self._sums
+
+    # ---------- 由累加量得到协方差 ----------
+    def _cov_from(self, sums, ddof=1):
+        n = sums['n']
+        with np.errstate(invalid='ignore', divide='ignore'):
+            centered = sums['sxy'] - sums['sx'] * sums['sx'].T / n
+            if 'n2' in sums:
+                cov = centered / (n - sums['n2'] / n)       # 加权无偏估计，和 pandas ewm(bias=False) 一样
+            else:
+                cov = centered / (n - ddof)
+        cov[self._counts(sums) < self.min_periods] = np.nan
+        return cov
+
+    def _corr_from(self, sums):
+        n, sx = sums['n'], sums['sx']
+        with np.errstate(invalid='ignore', divide='ignore'):
+            cov = sums['sxy'] - sx * sx.T / n
+            var = sums['sxx'] - sx * sx / n                 # i 在 i、j 都有数据那些天的方差
+            corr = cov / np.sqrt(var * var.T)
+        corr[self._counts(sums) < max(self.min_periods, 2)] = np.nan
+        return np.clip(corr, -1.0, 1.0)
+
+    def _counts(self, sums):
+        return np.rint(sums['count'] if 'count' in sums else sums['n'])
+
+    # ---------- 行号区间查询 ----------
+    def _rows(self, position):
+        """截止到第 position 行（含）的窗口"""
+        end = position + 1
+        if self.halflife or self.window is None:
+            return 0, end
+        return max(0, end - self.window), end
+
+    def cov_rows(self, a, b, ddof=1):
+        """行 [a, b) 的协方差矩阵（ndarray）"""
+        return self._cov_from(self._move(a, b), ddof)
+
+    def corr_rows(self, a, b):
+        """行 [a, b) 的相关系数矩阵（ndarray）"""
+        return self._corr_from(self._move(a, b))
+
+    def count_rows(self, a, b):
+        """行 [a, b) 里每对股票的共同数据天数，对角线就是每只股票自己的数据天数"""
+        return self._counts(self._move(a, b))
+
+    # ---------- 日期查询 ----------
+    def _position(self, date):
+        """date 当天或之前最后一个交易日的行号"""
+        pos = self.index.searchsorted(pd.Timestamp(date), side='right') - 1
+        if pos < 0:
+            raise KeyError(f"{date} 早于第一天 {self.index[0]}")
+        return pos
+
+    def _frame(self, values):
+        return pd.DataFrame(values, index=self.columns, columns=self.columns)
+
+    def cov(self, date=None, ddof=1):
+        """截止到 date（含，默认最后一天）的窗口协方差 DataFrame"""
+        pos = len(self.index) - 1 if date is None else self._position(date)
+        return self._frame(self.cov_rows(*self._rows(pos), ddof=ddof))
+
+    def corr(self, date=None):
+        """截止到 date（含，默认最后一天）的窗口相关系数 DataFrame"""
+        pos = len(self.index) - 1 if date is None else self._position(date)
+        return self._frame(self.corr_rows(*self._rows(pos)))
+
+    def cov_between(self, start, end=None, ddof=1):
+        """日期区间 [start, end) 的协方差 DataFrame，end=None 表示到最后一天"""
+        a = self.index.searchsorted(pd.Timestamp(start), side='left')
+        b = len(self.index) if end is None else self.index.searchsorted(pd.Timestamp(end), side='left')
+        return self._frame(self.cov_rows(a, b, ddof))
+
+    def corr_between(self, start, end=None):
+        """日期区间 [start, end) 的相关系数 DataFrame"""
+        a = self.index.searchsorted(pd.Timestamp(start), side='left')
+        b = len(self.index) if end is None else self.index.searchsorted(pd.Timestamp(end), side='left')
+        return self._frame(self.corr_rows(a, b))
+
+    def iter_cov(self, dates=None, ddof=1):
+        """按日期顺序逐个给出 (日期, 协方差 ndarray)，每一步只做增量更新"""
+        positions = range(len(self.index)) if dates is None else map(self._position, dates)
+        for pos in positions:
+            yield self.index[pos], self.cov_rows(*self._rows(pos), ddof=ddof)
+
+
+if __name__ == '__main__':
+    # 随机收益率（带缺失值），和 pandas 的 rolling / ewm / 区间 cov 对照
+    rng = np.random.default_rng(0)
+    days, assets = 2520, 100
+    factor = rng.normal(0, 0.01, (days, 1))
+    data = factor + rng.normal(0.0005, 0.02, (days, assets))
+    data[rng.random((days, assets)) < 0.05] = np.nan
+    data[:300, :10] = np.nan                                   # 上市较晚的股票
+    returns = pd.DataFrame(data, index=pd.bdate_range('2015-01-01', periods=days),
+                           columns=[f"S{i:03d}" for i in range(assets)])
+
+    engine = RollingCovariance(returns, window=126)
+    for date in ['2016-03-31', '2019-12-31', returns.index[-1]]:
+        pos = returns.index.get_loc(pd.Timestamp(date))
+        window = returns.iloc[pos - 125:pos + 1]
+        print(f"{date} 滑动窗口 cov 最大误差 {np.nanmax(np.abs(engine.cov(date) - window.cov()).to_numpy()):.2e},"
+              f" corr 最大误差 {np.nanmax(np.abs(engine.corr(date) - window.corr()).to_numpy()):.2e}")
+
+    ewm = RollingCovariance(returns.iloc[:, :5], halflife=60)
+    expect = returns.iloc[:, :5].ewm(halflife=60).cov().loc[returns.index[-1]]
+    print(f"EWMA cov 最大误差 {np.nanmax(np.abs(ewm.cov() - expect).to_numpy()):.2e}")
+
+    # 每个季度初看过去 6 个月：逐次重算 vs 增量滑动
+    quarters = pd.date_range('2015-07-01', returns.index[-1], freq='QS')
+    start = time.time()
+    for q in quarters:
+        window = returns.loc[q - pd.DateOffset(months=6):q - pd.Timedelta(days=1)]
+        window.corr()
+    print(f"DataFrame.corr() 每季度重算 {len(quarters)} 次, 用时 {time.time() - start:.3f}秒")
+    start = time.time()
+    for q in quarters:
+        engine.corr_between(q - pd.DateOffset(months=6), q)
+    print(f"RollingCovariance 增量更新 {len(quarters)} 次, 用时 {time.time() - start:.3f}秒")
+
+    # 每天一个 126 日滑动窗口
+    start = time.time()
+    for date, cov in engine.iter_cov():
+        pass
+    print(f"逐日滑动窗口协方差 {days} 天 x {assets} 只股票, 用时 {time.time() - start:.3f}秒")
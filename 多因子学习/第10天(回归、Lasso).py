@@ -12,6 +12,8 @@ from sklearn.preprocessing import StandardScaler
 import matplotlib.pyplot as plt
 import seaborn as sns
 
+from 交易日历 import TradingCalendar
+
 # ================== 1. 读取数据 ==================
 file_path = './Day8-2_factors_and_standardized.xlsx'
 df = pd.read_excel(file_path, sheet_name='Standardized_Factors')
@@ -28,6 +30,11 @@ target = 'future_return_20'
 # 添加 Month 列，用于按月滚动
 df['Month'] = pd.to_datetime(df['Date']).dt.to_period('M')
 
+# 交易日历：每个月（以及截止到每个月）对应哪些行只算一次，代替每个月整表比较 df['Month']
+calendar = TradingCalendar(df['Date'])
+month_rows = calendar.group_rows(df['Date'], 'M')
+rows_until = calendar.group_rows(df['Date'], 'M', cumulative=True)
+
 # 定义回归模型
 models = {
     'Linear': LinearRegression(),  # 普通线性回归
@@ -42,7 +49,7 @@ weights_list = []      # 用于存储每个月各模型因子权重
 months = sorted(df['Month'].unique())
 for month in months:
     # 训练数据为当月及以前所有数据
-    train_data = df[df['Month'] <= month].dropna(subset=factor_cols + [target])
+    train_data = df.iloc[rows_until[month]].dropna(subset=factor_cols + [target])
     if ROLLING_WINDOW is not None:
         train_data = train_data.tail(ROLLING_WINDOW)    # 可选：仅取最近 N 条数据
     if train_data.empty:
@@ -71,7 +78,7 @@ weights_df = pd.DataFrame(weights_list)  # 最终存储每月各模型因子权
 # ================== 3. 计算每只股票每日因子得分 ==================
 scores_list = []
 for month in months:
-    month_data = df[df['Month'] == month].dropna(subset=factor_cols + [target])
+    month_data = df.iloc[month_rows[month]].dropna(subset=factor_cols + [target])
     if month_data.empty:
         continue
 
@@ -117,10 +124,11 @@ print(avg_score_july)
 
 # ================== 5. 生成月度统计 ==================
 monthly_summary = []
+score_rows = calendar.group_rows(scores_df['Date'], 'M')
 for month in months:
-    month_data = scores_df[scores_df['Month'] == month]
-    if month_data.empty:
+    if len(score_rows.get(month, [])) == 0:
         continue
+    month_data = scores_df.iloc[score_rows[month]]
     # 统计每只股票当月出现天数和平均因子得分
     summary = month_data.groupby('company').agg(
         AppearDays=('Date', 'count'),
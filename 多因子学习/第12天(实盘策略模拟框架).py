@@ -8,6 +8,8 @@
 '''
 
 # =================== 导入库 ===================
+import os
+import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 from matplotlib import rcParams
@@ -40,17 +42,44 @@ def load_stock_data(file_path, start_date=None, end_date=None):
     if start_date: df = df[df.index >= pd.to_datetime(start_date)]
     if end_date: df = df[df.index <= pd.to_datetime(end_date)]
 
-    # 计算20日均线（MA20）
-    df['MA20'] = df[price_col].rolling(20).mean()
+    # 计算MA20、RSI指标
+    df['MA20'], df['RSI'] = compute_indicators(df[price_col])
 
-    # 计算RSI指标（14日）
-    delta = df[price_col].diff()
+    return df, price_col
+
+def compute_indicators(close):
+    """
+    计算20日均线（MA20）和14日RSI
+    - close: 一只股票的收盘价Series，或者多只股票的收盘价DataFrame（每列一只），rolling 一次算完全部股票
+    """
+    ma20 = close.rolling(20).mean()
+
+    delta = close.diff()
     gain = delta.clip(lower=0).rolling(14).mean()
     loss = -delta.clip(upper=0).rolling(14).mean()
     rs = gain / loss
-    df['RSI'] = 100 - 100 / (1 + rs)
+    rsi = 100 - 100 / (1 + rs)
+    return ma20, rsi
 
-    return df, price_col
+def load_many(file_paths, start_date=None, end_date=None):
+    """
+    加载多只股票，按日期对齐成宽表（每列一只股票），方便一次性计算指标和模拟
+    - file_paths: {股票代码: Excel文件路径}
+    返回: 收盘价、MA20、RSI 三个DataFrame
+    """
+    closes = {}
+    for symbol, path in file_paths.items():
+        df, price_col = load_stock_data(path, start_date, end_date)
+        closes[symbol] = df[price_col]
+    close = pd.DataFrame(closes).sort_index()
+    if close.isna().any().any():
+        # 各股票交易日不完全一样：每只股票在自己的交易日上算指标，保证和单只运行的结果一样
+        parts = [compute_indicators(close[c].dropna()) for c in close.columns]
+        ma20 = pd.concat([m for m, _ in parts], axis=1).reindex(close.index)
+        rsi = pd.concat([r for _, r in parts], axis=1).reindex(close.index)
+    else:
+        ma20, rsi = compute_indicators(close)
+    return close, ma20, rsi
 
 # =================== 模拟券商类 ===================
 class SimpleBroker:
@@ -112,6 +141,88 @@ def macd_rsi_strategy(df, price_col, broker):
         # 记录每日组合价值
         broker.record_portfolio(date, price)
 
+# =================== 向量化模拟 ===================
+def macd_rsi_signals(price, ma20, rsi):
+    """和 macd_rsi_strategy 相同的买卖条件，一次算出整段时间的信号（NaN 的比较结果都是 False）"""
+    buy = (price > ma20) & (rsi < 70)
+    sell = ~buy & (rsi > 70)  # elif：当天有买入信号就不看卖出
+    return buy, sell
+
+def simulate_signals(price, buy, sell, cash=100000, fraction=0.2, verbose=False):
+    """
+    用信号数组模拟交易，支持一只（一维数组）或多只股票（二维数组，日期 x 股票，每只股票独立账户）
+    - 买入数量 = int(当前现金 / 价格 * fraction)，依赖当前现金，所以只在有信号的日子逐日更新状态，
+      每天同时处理全部股票；没有信号的日子现金和持仓不变，不用遍历
+    - 现金、持仓曲线 = 每天的变化量 cumsum；组合价值 = 现金 + 持仓 * 价格
+    返回: 现金、持仓、组合价值（和 price 形状相同）、交易记录列表 [(日期下标, 股票下标, 'BUY'/'SELL', 数量, 价格)]
+    """
+    price = np.asarray(price, dtype=float)
+    one = price.ndim == 1
+    price, buy, sell = (np.atleast_2d(np.asarray(a).T).T for a in (price, buy, sell))
+    n_days, n_stocks = price.shape
+
+    cash_now = np.full(n_stocks, float(cash))
+    pos_now = np.zeros(n_stocks, dtype=np.int64)
+    d_cash = np.zeros((n_days, n_stocks))
+    d_pos = np.zeros((n_days, n_stocks), dtype=np.int64)
+    trades = []
+
+    for t in np.flatnonzero((buy | sell).any(axis=1)):
+        p = price[t]
+        # 买入：现金的 fraction 能买多少股
+        with np.errstate(invalid='ignore', divide='ignore'):
+            qty = np.where(buy[t], np.floor(cash_now / p * fraction), 0).astype(np.int64)
+        cost = qty * p
+        bought = (qty > 0) & (cash_now >= cost)
+        # 卖出：全部卖出
+        sold = sell[t] & (pos_now > 0)
+
+        for j in np.flatnonzero(bought | sold):
+            side, q = ('BUY', int(qty[j])) if bought[j] else ('SELL', int(pos_now[j]))
+            trades.append((t, j, side, q, p[j]))
+            if verbose:
+                print(f"📈 买入 {q}股 @ {p[j]:.2f}" if side == 'BUY' else f"📉 卖出 {q}股 @ {p[j]:.2f}")
+
+        d_cash[t] = np.where(bought, -cost, np.where(sold, pos_now * p, 0.0))
+        d_pos[t] = np.where(bought, qty, np.where(sold, -pos_now, 0))
+        cash_now += d_cash[t]
+        pos_now += d_pos[t]
+
+    cash_arr = np.cumsum(np.vstack([np.full(n_stocks, float(cash)), d_cash]), axis=0)[1:]
+    pos_arr = np.cumsum(d_pos, axis=0)
+    value = cash_arr + np.where(pos_arr != 0, pos_arr * price, 0.0)
+    if one:
+        return cash_arr[:, 0], pos_arr[:, 0], value[:, 0], trades
+    return cash_arr, pos_arr, value, trades
+
+def macd_rsi_vectorized(df, price_col, broker):
+    """
+    和 macd_rsi_strategy 结果相同（交易记录、每日组合价值一样），但不逐行 iterrows
+    结果写回 broker，plot_portfolio 可以直接用
+    """
+    price = df[price_col].to_numpy()
+    buy, sell = macd_rsi_signals(price, df['MA20'].to_numpy(), df['RSI'].to_numpy())
+    cash, pos, value, trades = simulate_signals(price, buy, sell, cash=broker.cash, verbose=True)
+
+    broker.history += [(side, qty, p) for _, _, side, qty, p in trades]
+    broker.portfolio_values += list(zip(df.index, value))
+    if len(df):
+        broker.cash, broker.positions = cash[-1], int(pos[-1])
+
+def simulate_many(close, ma20, rsi, cash=100000, fraction=0.2):
+    """
+    多只股票同时模拟（每只股票一个独立的 SimpleBroker 账户，和单只运行的结果一样）
+    返回: 组合价值宽表（日期 x 股票）、交易记录DataFrame
+    """
+    buy, sell = macd_rsi_signals(close.to_numpy(), ma20.to_numpy(), rsi.to_numpy())
+    cash_arr, pos_arr, _, trades = simulate_signals(close.to_numpy(), buy, sell, cash=cash, fraction=fraction)
+    # 停牌/还没上市的日子用最近的收盘价估值
+    value = cash_arr + np.where(pos_arr != 0, pos_arr * close.ffill().to_numpy(), 0.0)
+    values = pd.DataFrame(value, index=close.index, columns=close.columns)
+    trades = pd.DataFrame([(close.index[t], close.columns[j], side, qty, p) for t, j, side, qty, p in trades],
+                          columns=['date', 'symbol', 'side', 'qty', 'price'])
+    return values, trades
+
 # =================== 绘制组合价值曲线 ===================
 def plot_portfolio(broker):
     """绘制组合价值曲线，并标记最终总资金"""
@@ -145,8 +256,8 @@ if __name__ == "__main__":
     # 2. 初始化券商
     broker = SimpleBroker(cash=100000)
 
-    # 3. 执行策略
-    macd_rsi_strategy(df, price_col, broker)
+    # 3. 执行策略（向量化版本，结果和 macd_rsi_strategy(df, price_col, broker) 逐行运行一样）
+    macd_rsi_vectorized(df, price_col, broker)
 
     # 4. 输出最终结果
     print(f"\n最终现金: {broker.cash:.2f}")
@@ -161,7 +272,16 @@ if __name__ == "__main__":
     print(f"最终总资金: {total_value:.2f}")
     print(f"交易记录: {broker.history}")
 
-    # 5. 绘制组合价值
+    # 5. 多只股票同时模拟（每只股票独立账户，各10万初始资金）
+    import glob
+    files = {os.path.basename(f).split('_')[0]: f for f in sorted(glob.glob('./*_all_data.xlsx'))}
+    close, ma20, rsi = load_many(files, start_date='2020-01-01', end_date='2023-12-31')
+    values, trades = simulate_many(close, ma20, rsi, cash=100000)
+    summary = pd.DataFrame({'最终总资金': values.ffill().iloc[-1],
+                            '交易次数': trades.groupby('symbol').size().reindex(values.columns, fill_value=0)})
+    print(summary.sort_values('最终总资金', ascending=False))
+
+    # 6. 绘制组合价值
     plot_portfolio(broker)
 
 '''
@@ -47,6 +47,11 @@ print('Top 3 stocks:', top_stocks.index.tolist())
 ''' HOOD, TME, HIMS 是最高得分. 现在用这3只股票导入到backtrader回测'''
 # 导入backtrader库
 import backtrader as bt
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Backtrader学习'))
+from 组合账户 import PortfolioBook  # 目标权重调仓：一次算出每只股票要买卖多少
 
 # 定义策略，买入得分最高的3只股票，20天轮换一次
 # top3 = ['HOOD', 'TME', 'HIMS']  # 这里用上面得分最高的3只股票
@@ -58,6 +63,10 @@ class SimpleTop3Strategy(bt.Strategy):
     def __init__(self):
         self.rebalance_date = 0
         self.holding_period = 20   # 每20 天换仓一次
+        self.book = PortfolioBook(self)   # 用数组记录持仓
+
+    def notify_order(self, order):
+        self.book.on_order(order)   # 成交后更新持仓
 
     def next(self):
         self.rebalance_date += 1
@@ -65,21 +74,12 @@ class SimpleTop3Strategy(bt.Strategy):
         if self.rebalance_date % self.holding_period != 0:
             return
 
-        # 卖出不在当前top中
-        for data in self.datas:                             # 遍历每只股票
-            pos = self.getposition(data)                    # 查看当前持仓
-            if pos.size > 0 and data._name not in self.params.top3:
-                # 如果持仓中这只股票不在top3 中,
-                self.close(data)        # 卖出
-
-        # 买入新的top3 股票 (等权)
+        # 以前的做法: 先逐只卖出不在top3的, 再逐只按 总资产*权重/收盘价 买入没有持仓的
+        # 现在直接给出目标权重: top3 等权, 其它股票权重为0 (有持仓就卖出)
+        # 只对和目标差别超过总资产2%的股票下单, 先卖后买, 整股, 留1%现金防止开盘价跳高资金不够
         weight = 1.0 / len(self.params.top3)                # 等权总是1.  这样分配有几只股票.
-        for data in self.datas:                             # 遍历每只股票
-            # 如果这只股票再top 3 中, 并且没有持仓
-            if data._name in self.params.top3 and self.getposition(data).size == 0:
-                # 按等权分配资金, 计算买入股数
-                size = self.broker.getvalue() * weight / data.close[0]
-                self.buy(data, size=size)
+        targets = {name: weight for name in self.params.top3}
+        self.book.rebalance(targets, lot=1, cash_buffer=0.01, min_trade_pct=0.02)
 
 
 # 初始化Cerebro引擎
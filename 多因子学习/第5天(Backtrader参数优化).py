@@ -106,9 +106,13 @@ class MultiFactorStrategy(bt.Strategy):
 
 #  =====================第四步: 运行Backtrader策略并进行参数优化==================
 if __name__ == '__main__':
-    cerebro = bt.Cerebro(optreturn=False)   # optreturn=False,保证返回完整策略
+    # 结果存储在 Backtrader学习/结果存储.py, 把那个目录加到导入路径
+    import sys
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Backtrader学习'))
+    from 结果存储 import SweepStore, run_sweep
 
     # 为top 5 股票加载对应的价格数据
+    datas = {}
     for symbol in top5_stock_list:
         file_path = f"./{symbol}_all_data.xlsx"
         if not os.path.exists(file_path):
@@ -119,63 +123,38 @@ if __name__ == '__main__':
         df_price = pd.read_excel(file_path, index_col=0, parse_dates=True)
         df_price.index.name = 'date'
         df_price = df_price[['open', 'high', 'low', 'close', 'volume']]
-
-        # 将数据封装为Backtrader
-        datafeed = bt.feeds.PandasData(dataname=df_price)
-        cerebro.adddata(datafeed, name=symbol)
+        datas[symbol] = df_price
 
     # 设置参数网格, 进行多因子组合优化
-    cerebro.optstrategy(
-        MultiFactorStrategy,
+    grid = dict(
         pe_weight=np.arange(-2, 2.1, 0.5),
         pb_weight=np.arange(-2, 2.1, 0.5),
         momentum_weight=np.arange(0, 2.1, 0.5),
         volatility_weight=np.arange(-2, 2.1, 0.5)
     )
 
-    # 设置初始资金
-    cerebro.broker.setcash(1000000)
-
     # 添加分析器: 年化收益率 与 夏普比率
-    cerebro.addanalyzer(bt.analyzers.SharpeRatio, _name='sharpe')
-    cerebro.addanalyzer(bt.analyzers.Returns, _name='returns')
+    analyzers = ((bt.analyzers.SharpeRatio, 'sharpe'), (bt.analyzers.Returns, 'returns'))
     print(f"正在进行参数优化, 请等等.....\n")
 
-    results = cerebro.run(maxcpus=1)    # 多线程不使用, 避免不稳定
-
-    # 用于存储每组参数组合的回测结果
-    results_list = []
-
-    # 遍历每个优化结果
-    for stratlist in results:
-        strat = stratlist[0]
-        params = strat.params
-        rets = strat.analyzers.returns.get_analysis()
-        sharpe = strat.analyzers.sharpe.get_analysis().get('sharperatio', None)
-        sharpe_val = sharpe if sharpe is not None else 0    # 防止为None
-
-        # 打印结果
-        print(f"参数组合: PE={params.pe_weight}, PB={params.pb_weight}, "
-              f"Momentum={params.momentum_weight}, Volatility={params.volatility_weight}")
-        print(f"年化收益率: {rets.get('rnorm100', 0):.2f}")
-        print(f"夏普率: {sharpe_val:.2f}")
-        print("_" * 40)
-
-        # 保存结果到excel里.
-        '''优化太多了大概有3000多,  不可能每次优化每次看. 只能保存起来'''
-        result_dict = {
-            "PE": params.pe_weight,
-            'PB': params.pb_weight,
-            'Momentum': params.momentum_weight,
-            'Volatility': params.volatility_weight,
-            'Annualized Return (%)': rets.get('rnorm100', 0),
-            'Sharpe Ratio': sharpe_val
-        }
-        results_list.append(result_dict)
-
-    # 转换为DataFrame保存到Excel
-    df_results = pd.DataFrame(results_list)
+    # 每跑完一组就追加到 ./results 里, 中途崩溃后重新运行会跳过已经跑完的参数
+    '''优化太多了大概有3000多,  不可能每次优化每次看. 只能保存起来'''
+    store = SweepStore('./results', sweep='Day5_multifactor_weights')
+    df_all = run_sweep(MultiFactorStrategy, grid, datas, store, maxcpus=1,     # 多线程不使用, 避免不稳定
+                       cash=1000000, commission=0, analyzers=analyzers)
+    store.compact()
+
+    # 转换成原来的列名保存到Excel
+    df_results = df_all.rename(columns={
+        'pe_weight': 'PE',
+        'pb_weight': 'PB',
+        'momentum_weight': 'Momentum',
+        'volatility_weight': 'Volatility',
+        'rnorm100': 'Annualized Return (%)',
+        'sharpe': 'Sharpe Ratio'
+    })[['PE', 'PB', 'Momentum', 'Volatility', 'Annualized Return (%)', 'Sharpe Ratio']]
     df_results.to_excel("Day5_parameter_optimization_results.xlsx", index=False)
 
+    # 打印夏普最高的几组
+    print(df_results.sort_values(by='Sharpe Ratio', ascending=False).head(10))
     print(f"参数优化完成, 结果已保存到Day5_parameter_optimization_results.xlsx")
-
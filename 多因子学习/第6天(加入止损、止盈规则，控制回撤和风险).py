@@ -8,11 +8,15 @@
 
 # 导入相关库
 import os  # 处理文件路径
+import sys
 import pandas as pd  # 用于读取Excel文件和数据处理
 import numpy as np  # 数学计算库
 import backtrader as bt  # 回测框架
 from scipy.stats import zscore  # z-score标准化方法
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Backtrader学习'))
+from 组合账户 import PortfolioBook  # 用NumPy数组记录持仓，代替每根K线循环getposition
+
 # ========== Step 1: 读取并处理多因子数据 ==========
 file_path = './Day4_factor_all_stocks.xlsx'  # 多因子Excel文件路径
 df = pd.read_excel(file_path)  # 读取Excel
@@ -71,69 +75,70 @@ class MultiFactorStrategy(bt.Strategy):
     def __init__(self):
         self.scores = GLOBAL_FACTOR_SCORE  # 获取因子分数字典
         self.order = None  # 当前订单状态
-        self.buyprice = {}  # 记录每只股票的买入价（用于止盈止损判断）
+        self.book = PortfolioBook(self)  # 持仓数量、市值都放在数组里，成交时更新
+
+        # 因子得分只和参数有关，开始前一次算好：因子矩阵(股票 x 因子) @ 权重向量
+        names = [data._name for data in self.datas]
+        factors = np.array([[self.scores.get(name, {}).get(col, 0) for col in ('PE', 'PB', 'Momentum', 'Volatility')]
+                            for name in names], dtype=float).reshape(len(names), 4)
+        weights = np.array([self.params.pe_weight, self.params.pb_weight,
+                            self.params.momentum_weight, self.params.volatility_weight])
+        self.score = factors @ weights
+        self.scored = np.flatnonzero([name in self.scores for name in names])  # 有得分的股票下标
+
+        self.buyprice = np.full(len(self.datas), np.nan)  # 记录每只股票的买入价（用于止盈止损判断），NaN表示没有
+
+    def notify_order(self, order):
+        self.book.on_order(order)  # 成交后更新持仓数组（self.order 的处理和原来一样）
 
     def next(self):
         if self.order:
             return  # 若当前有订单未完成，则跳过
 
         total_value = self.broker.getvalue()  # 当前账户总资产
-        # 当前持仓市值总和
-        current_position_value = sum([
-            self.getposition(data).size * data.close[0] for data in self.datas
-        ])
+        self.book.mark()  # 读取当前收盘价
+        current_position_value = self.book.exposure  # 当前持仓市值总和（数组点积）
         current_position_pct = current_position_value / total_value if total_value > 0 else 0
 
-        for data in self.datas:
+        for i in self.scored:
+            data = self.datas[i]
             stock = data._name  # 股票代码
-
-            if stock not in self.scores:
-                continue  # 如果该股票没有得分，跳过
-
-            pos = self.getposition(data)  # 当前持仓信息
-            price = data.close[0]  # 当前收盘价
-
-            # 计算该股票的综合得分（加权因子值）
-            f = self.scores[stock]
-            score = (
-                self.params.pe_weight * f.get('PE', 0) +
-                self.params.pb_weight * f.get('PB', 0) +
-                self.params.momentum_weight * f.get('Momentum', 0) +
-                self.params.volatility_weight * f.get('Volatility', 0)
-            )
+            size = self.book.size[i]  # 当前持仓数量
+            price = self.book.price[i]  # 当前收盘价
+            score = self.score[i]  # 该股票的综合得分（加权因子值）
 
             # === 止损/止盈判断（已持仓） ===
-            if pos.size > 0:
-                buy_price = self.buyprice.get(stock, None)  # 获取买入价
-                if buy_price is not None:
+            if size > 0:
+                buy_price = self.buyprice[i]  # 获取买入价
+                if not np.isnan(buy_price):
                     change_pct = (price - buy_price) / buy_price  # 计算涨跌幅
                     if change_pct < -self.params.stop_lost:  # 跌超5%
                         self.order = self.sell(data=data)  # 止损卖出
                         print(f"{stock}止损卖出, 跌幅{change_pct:.2%}")
-                        self.buyprice.pop(stock, None)  # 删除记录
+                        self.buyprice[i] = np.nan  # 删除记录
                         continue
                     if change_pct >= self.params.take_profit:  # 涨超10%
                         self.order = self.sell(data=data)  # 止盈卖出
                         print(f"{stock}止盈卖出, 涨幅{change_pct:.2%}")
-                        self.buyprice.pop(stock, None)
+                        self.buyprice[i] = np.nan
                         continue
 
             # === 买入逻辑 ===
-            if score > 0 and pos.size == 0:  # 得分正，未持仓
+            if score > 0 and size == 0:  # 得分正，未持仓
                 if current_position_pct < self.params.max_total_position:  # 总仓位未超限
                     cash = self.broker.getcash()  # 当前现金
                     max_size = (total_value * self.params.max_position_pct) // price  # 可买股数
                     if max_size > 0 and cash > price:  # 有钱且能买
                         self.order = self.buy(data=data, size=max_size)
-                        self.buyprice[stock] = price  # 记录买入价
+                        self.buyprice[i] = price  # 记录买入价
                         print(f"{stock}买入, 仓位大小{max_size}股, 买入价{price}")
                 else:
                     print('仓位达到上限, 暂不买入')
 
             # === 得分转负且已持仓，清仓 ===
-            elif score < 0 and pos.size > 0:
+            elif score < 0 and size > 0:
                 self.order = self.sell(data=data)
-                self.buyprice.pop(stock, None)
+                self.buyprice[i] = np.nan
                 print(f"{stock} 多因子分数负, 卖出")
 
 
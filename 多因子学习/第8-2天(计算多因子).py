@@ -11,6 +11,8 @@ import pandas as pd
 import numpy as np
 from scipy.stats import zscore      # 这是用标准化因子的库
 
+from 交易日历 import TradingCalendar
+
 # ==============读取数据============
 def load_all_data(path='.'):
     '''
@@ -50,19 +52,15 @@ def get_recent_data(df, date_col, years=5):
     """
     df = df.copy()
     df[date_col] = pd.to_datetime(df[date_col])  # 转换日期列为datetime格式
-    df = df.sort_values(by=date_col)
-
-    # 获取数据中最早和最晚日期
-    last_date = df[date_col].max()
-    earliest_date = df[date_col].min()
-    avaliable_years = (last_date - earliest_date).days / 365  # 可用年数
+    df = df.dropna(subset=[date_col])
+    if not df[date_col].is_monotonic_increasing:    # 已经按日期排好时不用再排序
+        df = df.sort_values(by=date_col)
 
-    # 如果数据不足 "years" 年, 就用数据实际可用的年数
-    years_to_use = min(years, avaliable_years)
-    start_date = last_date - pd.Timedelta(days=int(years_to_use * 365))
+    # 交易日历找出起始日期: 最晚日期往前 years 年, 数据不足 "years" 年就用数据实际可用的年数
+    start_date = TradingCalendar(df[date_col]).lookback_start(years)
 
-    # 筛选出指定时间范围的数据
-    return df[df[date_col] >= start_date]
+    # 日期已经排好序, 二分查找起始位置, 不用整列比较
+    return df.iloc[df[date_col].searchsorted(start_date, side='left'):]
 
 
 # ==================计算未来收益率======================
@@ -10,6 +10,8 @@ import pandas as pd
 from scipy.stats import spearmanr
 import matplotlib.pyplot as plt
 
+from 交易日历 import TradingCalendar
+
 # ====================1. 获取标准化多因子数据======================
 # 读取之前生成的标准化因子数据
 file_path = "Day8-2_factors_and_standardized.xlsx"
@@ -33,6 +35,10 @@ target = 'future_return_20'
 df['Month'] = df['Date'].dt.to_period('M')
 df['Quarter'] = df['Date'].dt.to_period('Q')
 
+# 交易日历：每个月对应哪些行只算一次，后面按月取数据不用再整表比较 df['Month'] == month
+calendar = TradingCalendar(df['Date'])
+month_rows = calendar.group_rows(df['Date'], 'M')
+
 # ==================2. 工具函数=================
 def calc_ic(group, factor, target):
     '''
@@ -100,11 +106,10 @@ for month, group in df.groupby('Month'):
 
     # 下个月使用该因子构建组合
     next_month = month + 1
-    next_group = df[df['Month'] == next_month]
-    if next_group.empty:
+    if next_month not in month_rows:
         continue
 
-    next_group = next_group.copy()
+    next_group = df.iloc[month_rows[next_month]].copy()
     if next_group[best_factor].isna().all():
         continue
     next_group = next_group.dropna(subset=[best_factor, target])